@@ -0,0 +1,147 @@
+"""
+Queue analytics rollups.
+
+`build_rollups(days)` recomputes the QueueRollup rows (hourly and daily) of
+every queue for the last `days` whole UTC days:
+
+- arrivals and waits stream from Token and TokenArchive (joined_at /
+  called_at) with `iterator()`, CHUNK rows at a time, and are summed per
+  (queue, hour) with numpy `bincount`; nothing per-row touches the ORM.
+  Archiving (rnr/archive.py) moves tokens between the two tables, so it
+  never takes them out of the counts;
+- calls, no-shows (calls that expired unconfirmed) and swaps are read from
+  the hourly history stats (rnr/history.py), which are rolled up first.
+
+Daily rows are the hourly arrays summed in groups of 24. The window is
+replaced as a whole, so reruns are idempotent and a token called hours after
+it booked lands in its arrival hour on the next run (as does a token
+archived while a run was reading). The analytics endpoint
+only reads these rows. Run `python manage.py rollup_analytics [--loop]`.
+"""
+import asyncio
+import logging
+from datetime import timezone as dt_timezone
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import history
+from .models import Queue, Token, TokenArchive, QueueEvent, QueueHourlyStat, QueueRollup, hour_bucket
+
+
+logger = logging.getLogger(__name__)
+
+
+# Token rows fetched (and aggregated) per chunk
+CHUNK = 5000
+# Days recomputed per run; older days are final
+DEFAULT_DAYS = 2
+
+
+def day_floor(dt):
+    return dt.astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def build_rollups(days=DEFAULT_DAYS, now=None):
+    """Rebuild hourly and daily rollups for the last `days` days. Returns the rows written."""
+    if np is None:
+        raise ImportError("Analytics rollups require numpy.")
+    history.rollup_all()
+    until = day_floor(now or timezone.now()) + timezone.timedelta(days=1)
+    since = until - timezone.timedelta(days=days)
+    queue_ids = np.array(sorted(Queue.objects.values_list('id', flat=True)), dtype=np.int64)
+    if not len(queue_ids):
+        return 0
+
+    hours = days * 24
+    size = len(queue_ids) * hours
+    origin = since.timestamp()
+    arrivals, waits = np.zeros(size, dtype=np.int64), np.zeros(size, dtype=np.int64)
+    wait_seconds = np.zeros(size)
+
+    for model in (Token, TokenArchive):
+        # Queues created mid-run are left for the next one
+        rows = (
+            model.objects.filter(joined_at__gte=since, joined_at__lt=until, queue_id__lte=queue_ids[-1])
+            .values_list('queue_id', 'joined_at', 'called_at').iterator(chunk_size=CHUNK)
+        )
+        while chunk := list(islice(rows, CHUNK)):
+            n = len(chunk)
+            queue = np.fromiter((r[0] for r in chunk), dtype=np.int64, count=n)
+            joined = np.fromiter((r[1].timestamp() for r in chunk), dtype=float, count=n)
+            called = np.fromiter((r[2].timestamp() if r[2] else np.nan for r in chunk), dtype=float, count=n)
+            q = np.searchsorted(queue_ids, queue)
+            # Archived rows may belong to queues deleted since
+            known = queue_ids[q] == queue
+            cell = (q * hours + ((joined - origin) // 3600).astype(np.int64))[known]
+            joined, called = joined[known], called[known]
+            arrivals += np.bincount(cell, minlength=size)
+            seen = ~np.isnan(called)
+            waits += np.bincount(cell[seen], minlength=size)
+            wait_seconds += np.bincount(cell[seen], weights=called[seen] - joined[seen], minlength=size)
+
+    per_kind = {kind: np.zeros(size, dtype=np.int64)
+                for kind in (QueueEvent.CALLED, QueueEvent.EXPIRED, QueueEvent.SWAPPED)}
+    first = hour_bucket(since)
+    for queue_id, bucket, kind, count in QueueHourlyStat.objects.filter(
+        bucket__gte=first, bucket__lt=first + hours, kind__in=per_kind, queue_id__lte=queue_ids[-1]
+    ).values_list('queue_id', 'bucket', 'kind', 'count'):
+        q = np.searchsorted(queue_ids, queue_id)
+        if queue_ids[q] == queue_id:
+            per_kind[kind][q * hours + bucket - first] += count
+
+    columns = {
+        "arrivals": arrivals,
+        "waits": waits,
+        "wait_seconds": wait_seconds,
+        "calls": per_kind[QueueEvent.CALLED],
+        "no_shows": per_kind[QueueEvent.EXPIRED],
+        # Both tokens of a swap record an event
+        "swaps": per_kind[QueueEvent.SWAPPED] // 2,
+    }
+    hourly = {name: col.reshape(len(queue_ids), hours) for name, col in columns.items()}
+    daily = {name: col.reshape(len(queue_ids), days, 24).sum(axis=2) for name, col in hourly.items()}
+
+    rollups = []
+    for granularity, table, step in (('hour', hourly, timezone.timedelta(hours=1)),
+                                     ('day', daily, timezone.timedelta(days=1))):
+        active = np.argwhere(table["arrivals"] + table["calls"] + table["swaps"] > 0)
+        for q, b in active:
+            rollups.append(QueueRollup(
+                queue_id=int(queue_ids[q]), granularity=granularity, start=since + step * int(b),
+                **{name: col[q, b].item() for name, col in table.items()},
+            ))
+
+    with transaction.atomic():
+        QueueRollup.objects.filter(start__gte=since, start__lt=until).delete()
+        QueueRollup.objects.bulk_create(rollups, batch_size=1000)
+    return len(rollups)
+
+
+def serialize_rollup(row):
+    return {
+        "start": row["start"],
+        "arrivals": row["arrivals"],
+        "avg_wait_minutes": round(row["wait_seconds"] / row["waits"] / 60, 1) if row["waits"] else None,
+        "calls": row["calls"],
+        "no_show_rate": round(row["no_shows"] / row["calls"], 3) if row["calls"] else None,
+        "swaps": row["swaps"],
+    }
+
+
+async def run_rollups(interval=900.0, days=DEFAULT_DAYS):
+    """Rebuild the recent rollups every `interval` seconds."""
+    while True:
+        try:
+            written = await sync_to_async(build_rollups)(days)
+            logger.info("Wrote %d queue rollups", written)
+        except Exception:
+            logger.exception("Queue analytics rollup failed")
+        await asyncio.sleep(interval)
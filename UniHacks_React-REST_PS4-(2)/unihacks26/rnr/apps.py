@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RnrConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rnr'
+
+    def ready(self):
+        # Hooks the query counter into every database connection
+        from . import metrics  # noqa: F401
@@ -0,0 +1,103 @@
+"""
+Archival of finished tokens and resolved swap requests.
+
+COMPLETED / SKIPPED tokens and ACCEPTED / REJECTED swap requests are moved
+to TokenArchive / SwapRequestArchive once they are older than a day (tokens
+of an epoch that has rolled over, see rnr/rollover.py, right away), in
+batches: each batch is one read, one bulk INSERT per table and one DELETE,
+in a single transaction. The live tables then hold only the working set
+(what is in line today plus one day of tail), so every hot query stays
+small. Resolved swap intents are removed with their tokens; what they did
+survives in the reward ledger and the queue history.
+
+Tokens still tied to something live (a pending swap request, an open swap
+intent) wait for the next run. Past bookings are read through
+`token_history()`, which merges the recent live rows with the archive.
+Run `python manage.py archive_tokens` daily.
+"""
+from django.db import transaction, models
+from django.utils import timezone
+
+from .models import Queue, Token, SwapRequest, TokenArchive, SwapRequestArchive
+
+
+FINISHED = ['COMPLETED', 'SKIPPED']
+RESOLVED = ['ACCEPTED', 'REJECTED']
+ARCHIVE_AFTER = timezone.timedelta(days=1)
+BATCH_SIZE = 1000
+
+TOKEN_FIELDS = ['id', 'user_id', 'queue_id', 'epoch', 'token_number', 'status', 'swaps_used',
+                'joined_at', 'called_at', 'counter', 'completed_at']
+SWAP_FIELDS = ['id', 'queue_id', 'sender_id', 'receiver_id', 'status', 'created_at']
+
+
+def archive_swaps(swaps):
+    SwapRequestArchive.objects.bulk_create([SwapRequestArchive(**s) for s in swaps], ignore_conflicts=True)
+    SwapRequest.objects.filter(id__in=[s['id'] for s in swaps]).delete()
+
+
+def archive_token_batch(cutoff, batch_size=BATCH_SIZE):
+    """Move one batch of finished tokens (and their swap requests). Returns (tokens, swaps)."""
+    with transaction.atomic():
+        tokens = list(
+            Token.objects.filter(status__in=FINISHED)
+            .filter(models.Q(joined_at__lt=cutoff) | models.Q(epoch__lt=models.F('queue__epoch')))
+            .exclude(sent_requests__status='PENDING').exclude(received_requests__status='PENDING')
+            .exclude(swap_intents__status='OPEN')
+            .order_by('id').values(*TOKEN_FIELDS)[:batch_size]
+        )
+        if not tokens:
+            return 0, 0
+        ids = [t['id'] for t in tokens]
+        swaps = list(SwapRequest.objects.filter(models.Q(sender_id__in=ids) | models.Q(receiver_id__in=ids))
+                     .values(*SWAP_FIELDS))
+        TokenArchive.objects.bulk_create([TokenArchive(**t) for t in tokens], ignore_conflicts=True)
+        archive_swaps(swaps)
+        Token.objects.filter(id__in=ids).delete()
+    return len(tokens), len(swaps)
+
+
+def archive_swap_batch(cutoff, batch_size=BATCH_SIZE):
+    """Move resolved swap requests between tokens that are still live. Returns the count."""
+    with transaction.atomic():
+        swaps = list(
+            SwapRequest.objects.filter(status__in=RESOLVED, created_at__lt=cutoff)
+            .order_by('id').values(*SWAP_FIELDS)[:batch_size]
+        )
+        if swaps:
+            archive_swaps(swaps)
+    return len(swaps)
+
+
+def archive(older_than=ARCHIVE_AFTER, batch_size=BATCH_SIZE, now=None):
+    cutoff = (now or timezone.now()) - older_than
+    moved = {"tokens": 0, "swaps": 0}
+    while True:
+        tokens, swaps = archive_token_batch(cutoff, batch_size)
+        moved["tokens"] += tokens
+        moved["swaps"] += swaps
+        if tokens < batch_size:
+            break
+    while (swaps := archive_swap_batch(cutoff, batch_size)):
+        moved["swaps"] += swaps
+        if swaps < batch_size:
+            break
+    return moved
+
+
+def token_history(user_id, before=None, limit=20):
+    """
+    A user's finished tokens, newest first, live and archived alike.
+    Page with `before` = the last id returned. Three queries at most.
+    """
+    live = Token.objects.filter(user_id=user_id, status__in=FINISHED)
+    archived = TokenArchive.objects.filter(user_id=user_id)
+    if before is not None:
+        live, archived = live.filter(id__lt=before), archived.filter(id__lt=before)
+    fields = ['id', 'queue_id', 'epoch', 'token_number', 'status', 'joined_at', 'called_at', 'completed_at']
+    rows = list(live.order_by('-id').values(*fields)[:limit]) + list(archived.order_by('-id').values(*fields)[:limit])
+    rows = sorted(rows, key=lambda r: r['id'], reverse=True)[:limit]
+    names = dict(Queue.objects.filter(id__in={r['queue_id'] for r in rows}).values_list('id', 'name'))
+    for r in rows:
+        r['queue_name'] = names.get(r['queue_id'])
+    return rows
@@ -0,0 +1,112 @@
+"""
+Async versions of the read-heavy endpoints, for ASGI deployments.
+
+Under ASGI a sync view holds a worker thread for the whole request. These
+views run on the event loop and only hand the queries themselves to Django's
+async ORM. That runs each query on the request's one sync thread, so a
+request's queries still run one after another, as in the sync views; the
+views save threads, not query time. They build their queries and payloads
+with the same helpers as the sync views in rnr/views.py, so both return the
+same JSON.
+
+Routed in place of the sync views when ASYNC_READ_VIEWS=1 (unihacks26/urls.py).
+Leave it off under WSGI, which would start an event loop per request.
+`python manage.py bench_asgi` compares uvicorn against the WSGI server.
+"""
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from .auth import authenticate, may_act_on
+from .models import UserMe, Institution, Queue
+from .snapshots import aget_snapshots
+from .views import (
+    DISCOVERY_PARAMS_ERROR, SEARCH_CACHE_SECONDS, active_counts_by_institution, discovery_candidates,
+    discovery_params, discovery_rows, get_page_size, incoming_swaps, institution_dashboard_rows, queue_heads,
+    rank_candidates, search_page, search_params, search_results, token_neighbours,
+    user_dashboard_rows, user_waiting_tokens,
+)
+
+
+async def alist(queryset):
+    return [row async for row in queryset]
+
+
+def refuse(request, **owner):
+    """The error response if the caller's token may not read `owner`'s data, else None."""
+    p = authenticate(request)
+    if p is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    if not may_act_on(request, p=p, **owner):
+        return JsonResponse({"error": "Unauthorized"}, status=403)
+    return None
+
+
+def not_found(model):
+    return JsonResponse({"detail": f"No {model._meta.object_name} matches the given query."}, status=404)
+
+
+@require_GET
+async def search_institutions(request):
+    try:
+        search_query, page, page_size, cache_key = search_params(request.GET)
+    except ValueError:
+        return JsonResponse({"error": "page and page_size must be integers"}, status=400)
+
+    data = await cache.aget(cache_key)
+    if data is not None:
+        return JsonResponse(data)
+
+    institutions, page_items = search_results(search_query, page, page_size)
+    count = await institutions.acount()
+    page_items = await alist(page_items)
+    queue_snapshots = await aget_snapshots([q.id for inst in page_items for q in inst.queues.all()])
+
+    data = search_page(count, page, page_size, page_items, queue_snapshots)
+    await cache.aset(cache_key, data, SEARCH_CACHE_SECONDS)
+    return JsonResponse(data)
+
+
+@require_GET
+async def discovery_map_api(request):
+    """See views.discovery_map_api."""
+    try:
+        lat, lng, radius, limit = discovery_params(request.GET)
+    except (KeyError, ValueError):
+        return JsonResponse({"error": DISCOVERY_PARAMS_ERROR}, status=400)
+
+    ranked = rank_candidates(await alist(discovery_candidates(lat, lng, radius)), lat, lng, radius, limit)
+    counts = dict(await alist(active_counts_by_institution([c[0] for c, _ in ranked])))
+    return JsonResponse(discovery_rows(ranked, counts), safe=False)
+
+
+@require_GET
+async def get_institution_dashboard(request, inst_id):
+    """See views.get_institution_dashboard."""
+    if (error := refuse(request, institution_id=inst_id)) is not None:
+        return error
+    limit = get_page_size(request)
+    if not await Institution.objects.filter(id=inst_id).aexists():
+        return not_found(Institution)
+    queues = await alist(Queue.objects.filter(institution_id=inst_id).order_by('id'))
+    if not queues:
+        return JsonResponse([], safe=False)
+    queue_snapshots = await aget_snapshots([q.id for q in queues])
+    head_tokens = await alist(queue_heads(queues, limit))
+    return JsonResponse(institution_dashboard_rows(queues, queue_snapshots, head_tokens, limit), safe=False)
+
+
+@require_GET
+async def get_user_dashboard(request, user_id):
+    if (error := refuse(request, user_id=user_id)) is not None:
+        return error
+    user = await UserMe.objects.filter(id=user_id).afirst()
+    if user is None:
+        return not_found(UserMe)
+    tokens = await alist(user_waiting_tokens(user_id))
+    if not tokens:
+        return JsonResponse([], safe=False)
+    queue_snapshots = await aget_snapshots([t.queue_id for t in tokens])
+    neighbours = await alist(token_neighbours(tokens))
+    swaps = await alist(incoming_swaps(tokens))
+    return JsonResponse(user_dashboard_rows(user, tokens, queue_snapshots, neighbours, swaps), safe=False)
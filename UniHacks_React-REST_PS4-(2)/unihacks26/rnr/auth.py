@@ -0,0 +1,170 @@
+"""
+Stateless identities for API requests.
+
+Users and institutions are not Django auth users, so login issues a JWT
+pair whose claims carry `role` ("user" / "institution") and `uid`.
+`ClaimsAuthentication` turns a valid access token straight into a
+`Principal` without touching the database; views authorize against the
+ids they already have in hand (token.user_id, queue.institution_id).
+
+Every API view requires a token (DEFAULT_PERMISSION_CLASSES) unless it is
+marked AllowAny; ids in the request body are never trusted. Views outside
+DRF (async reads, SSE) authenticate with `authenticate()`.
+
+Logins are async: the password check awaits the hashing pool
+(rnr/hashers.py), and failed attempts are counted per email in the cache.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .hashers import HashingBusy, ahash_password, averify_password
+from .models import UserMe
+
+
+ROLES = ('user', 'institution')
+
+
+class Principal:
+    """The caller, as described by its token's claims."""
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, role, uid, name=""):
+        self.role = role
+        self.id = self.pk = uid
+        self.name = name
+
+    def __repr__(self):
+        return f"<Principal {self.role}:{self.id}>"
+
+
+class ClaimsAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        role, uid = validated_token.get('role'), validated_token.get('uid')
+        if role not in ROLES or not isinstance(uid, int):
+            raise InvalidToken("Token has no role/uid claims")
+        return Principal(role, uid, validated_token.get('name', ""))
+
+
+def issue_tokens(role, account):
+    refresh = RefreshToken()
+    refresh['role'] = role
+    refresh['uid'] = account.id
+    refresh['name'] = account.name
+    return {"access": str(refresh.access_token), "refresh": str(refresh)}
+
+
+def authenticate(request, token=None):
+    """
+    The Principal for a plain Django request (no DRF), from its Authorization
+    header or from `token` (e.g. a query parameter, for EventSource). None if
+    missing or invalid.
+    """
+    auth = ClaimsAuthentication()
+    try:
+        if token is not None:
+            return auth.get_user(auth.get_validated_token(token))
+        result = auth.authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def principal(request):
+    user = request.user
+    return user if isinstance(user, Principal) else None
+
+
+def acting_user(request):
+    """
+    The user behind a user token, as an unsaved UserMe built from the claims
+    (enough for foreign keys and `user_name`). None otherwise.
+    """
+    p = principal(request)
+    return UserMe(id=p.id, name=p.name) if p is not None and p.role == 'user' else None
+
+
+def acting_institution_id(request):
+    """The institution behind an institution token, else None."""
+    p = principal(request)
+    return p.id if p is not None and p.role == 'institution' else None
+
+
+def may_act_on(request, user_id=None, institution_id=None, p=None):
+    """A token may act for its own user or for its own institution's queues."""
+    p = p or principal(request)
+    if p is None:
+        return False
+    return ((p.role == 'user' and p.id == _as_id(user_id))
+            or (p.role == 'institution' and p.id == _as_id(institution_id)))
+
+
+def _as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return {}
+    return request.POST
+
+
+def login_limit_key(role, email):
+    digest = hashlib.sha1(str(email).strip().lower().encode()).hexdigest()
+    return f"login-fail:{role}:{digest}"
+
+
+async def record_failed_login(key):
+    window = settings.LOGIN_LIMIT['WINDOW']
+    if not await cache.aadd(key, 1, window):
+        try:
+            await cache.aincr(key)
+        except ValueError:      # expired in between
+            await cache.aset(key, 1, window)
+
+
+async def password_login(request, model, role):
+    """
+    Check the body's email/password against `model`.
+    Returns (account, None) or (None, error response).
+    """
+    data = request_data(request)
+    email, password = data.get('email'), data.get('password')
+    key = login_limit_key(role, email)
+    if await cache.aget(key, 0) >= settings.LOGIN_LIMIT['ATTEMPTS']:
+        return None, JsonResponse({"error": "Too many failed attempts. Try again later."}, status=429)
+
+    account = await model.objects.filter(email=email).afirst()
+    try:
+        # Unknown emails still pay for one hash, so timing doesn't reveal them
+        ok, must_update = await averify_password(password, account.password if account else "!")
+    except HashingBusy:
+        return None, JsonResponse({"error": "Server busy, please retry."}, status=503, headers={"Retry-After": "1"})
+    if not ok:
+        await record_failed_login(key)
+        return None, JsonResponse({"error": "Invalid credentials"}, status=401)
+
+    await cache.adelete(key)
+    if must_update:
+        # Hashed under an older profile or cost; re-encode while we have the password
+        try:
+            account.password = await ahash_password(password)
+            await account.asave(update_fields=['password'])
+        except HashingBusy:
+            pass
+    return account, None
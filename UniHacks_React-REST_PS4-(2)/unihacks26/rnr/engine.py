@@ -0,0 +1,365 @@
+"""
+Optional in-memory queue engine.
+
+For high-traffic queues the WAITING line can live in process memory instead
+of being re-read from the Token table on every request. Each managed queue is
+a `QueueLine`: an indexable skip list of (position_key, token_id) entries, so
+rank, move-back, swap and call-next are all O(log N).
+
+The engine is authoritative for the lines it manages. Token changes are
+written behind: views record them with `defer()` and a background thread
+applies them in batched transactions every QUEUE_ENGINE['FLUSH_INTERVAL']
+seconds. Nothing is kept anywhere else, so recovery after a crash is simply
+reloading each line from the Token table on first use. Writes deferred but
+not yet flushed when the process died are lost.
+
+Views change a line in `transaction.on_commit`, so a rolled-back request
+leaves it alone. Lines can still change between a view's check and its
+commit (a call pops the token meanwhile), so every method that takes a
+token id checks and acts under the line's lock and tolerates a token that
+has already left.
+
+Enable it per queue with QUEUE_ENGINE['QUEUES'] (a list of ids, or '*').
+Because the lines live in one process, engine mode needs a single worker
+process, and the jobs that change lines behind the views (expiry sweep,
+rollover) run inside it: rnr/jobs.py starts them with the server and
+refuses engine mode without BACKGROUND_JOBS.
+"""
+import atexit
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, models, transaction
+
+from . import snapshots
+from .models import Token, POSITION_GAP
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, height):
+        self.key = key
+        self.next = [None] * height
+        # width[i]: how many entries next[i] skips over (1 = the adjacent entry)
+        self.width = [1] * height
+
+
+class IndexableSkipList:
+    """Sorted set with O(log n) insert, remove, rank and lookup by index."""
+
+    MAX_LEVEL = 32
+
+    def __init__(self, keys=()):
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+        for key in keys:
+            self.insert(key)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def _random_height(self):
+        height = 1
+        while height < self.MAX_LEVEL and random.getrandbits(1):
+            height += 1
+        return height
+
+    def _path(self, key):
+        """Last node before `key` on every level, and the rank of each."""
+        update = [self._head] * self.MAX_LEVEL
+        ranks = [0] * self.MAX_LEVEL
+        node, rank = self._head, 0
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                rank += node.width[i]
+                node = node.next[i]
+            update[i], ranks[i] = node, rank
+        return update, ranks, rank
+
+    def insert(self, key):
+        update, ranks, rank = self._path(key)
+        height = self._random_height()
+        self._level = max(self._level, height)
+        node = _Node(key, height)
+        for i in range(height):
+            prev = update[i]
+            node.next[i] = prev.next[i]
+            if prev.next[i] is not None:
+                node.width[i] = ranks[i] + prev.width[i] - rank
+            prev.next[i] = node
+            prev.width[i] = rank + 1 - ranks[i]
+        for i in range(height, self._level):
+            if update[i].next[i] is not None:
+                update[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        update, _, _ = self._path(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(self._level):
+            prev = update[i]
+            if prev.next[i] is node:
+                if node.next[i] is not None:
+                    prev.width[i] += node.width[i] - 1
+                prev.next[i] = node.next[i]
+            elif prev.next[i] is not None:
+                prev.width[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+
+    def rank(self, key):
+        """Number of entries smaller than `key`."""
+        return self._path(key)[2]
+
+    def at(self, index):
+        """Entry at 0-based `index`."""
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        node, position = self._head, 0
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and position + node.width[i] <= index + 1:
+                position += node.width[i]
+                node = node.next[i]
+        return node.key
+
+
+class QueueLine:
+    """One queue's WAITING line. Methods return {token_id: new position_key} for write-behind."""
+
+    def __init__(self, queue_id, tokens, high_water):
+        self.queue_id = queue_id
+        self.lock = threading.RLock()
+        self.keys = dict(tokens)
+        self.order = IndexableSkipList(sorted((key, token_id) for token_id, key in tokens))
+        self.high_water = max(high_water or 0, max(self.keys.values(), default=0))
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, token_id):
+        return token_id in self.keys
+
+    def rank(self, token_id):
+        """Tokens ahead of `token_id` (0 = front of the line), or None once it has left."""
+        with self.lock:
+            key = self.keys.get(token_id)
+            return None if key is None else self.order.rank((key, token_id))
+
+    def at(self, index):
+        with self.lock:
+            return self.order.at(index)[1]
+
+    def next_key(self):
+        """Reserve a sort key behind everything this queue has handed out."""
+        with self.lock:
+            self.high_water += POSITION_GAP
+            return self.high_water
+
+    def append(self, token_id, key=None):
+        with self.lock:
+            key = self.next_key() if key is None else key
+            self.high_water = max(self.high_water, key)
+            self.keys[token_id] = key
+            self.order.insert((key, token_id))
+            return {token_id: key}
+
+    def remove(self, token_id):
+        with self.lock:
+            self.order.remove((self.keys.pop(token_id), token_id))
+
+    def discard(self, token_id):
+        """Remove `token_id` if it is still in line. Returns whether it was."""
+        with self.lock:
+            if token_id not in self.keys:
+                return False
+            self.remove(token_id)
+            return True
+
+    def pop_front(self, count):
+        with self.lock:
+            called = [self.order.at(i)[1] for i in range(min(count, len(self.order)))]
+            for token_id in called:
+                self.remove(token_id)
+            return called
+
+    def swap(self, a, b):
+        """Exchange the places of `a` and `b`; nothing changes unless both are still in line."""
+        with self.lock:
+            if a not in self.keys or b not in self.keys:
+                return {}
+            ka, kb = self.keys[a], self.keys[b]
+            self.remove(a)
+            self.remove(b)
+            self.append(a, kb)
+            self.append(b, ka)
+            return {a: kb, b: ka}
+
+    def move_back(self, token_id, target_pos):
+        """
+        Slot `token_id` in right after whoever holds 1-based `target_pos`.
+        Returns (actual position, changed keys); (None, {}) once it has left.
+        """
+        with self.lock:
+            if token_id not in self.keys:
+                return None, {}
+            if target_pos > len(self.order):
+                if self.rank(token_id) == len(self.order) - 1:
+                    return len(self.order), {}
+                self.remove(token_id)
+                changes = self.append(token_id)
+                return len(self.order), changes
+
+            before = self.order.at(target_pos - 1)
+            after = self.order.at(target_pos) if target_pos < len(self.order) else None
+            changes = {}
+            if after is not None and after[0] - before[0] < 2:
+                changes = self.rebalance()
+                before = self.order.at(target_pos - 1)
+                after = self.order.at(target_pos) if target_pos < len(self.order) else None
+            key = (before[0] + after[0]) // 2 if after else before[0] + POSITION_GAP
+            self.remove(token_id)
+            changes.update(self.append(token_id, key))
+            return target_pos, changes
+
+    def rebalance(self):
+        """Re-spread keys evenly; only needed once a gap is exhausted."""
+        with self.lock:
+            tokens = [token_id for _, token_id in self.order]
+            self.keys = {token_id: n * POSITION_GAP for n, token_id in enumerate(tokens, start=1)}
+            self.order = IndexableSkipList((key, token_id) for token_id, key in self.keys.items())
+            self.high_water = max(self.high_water, len(tokens) * POSITION_GAP)
+            return dict(self.keys)
+
+
+class QueueEngine:
+    """Registry of in-memory lines plus the write-behind buffer."""
+
+    def __init__(self, queues='*', flush_interval=0.05):
+        self.queues = queues
+        self.flush_interval = flush_interval
+        self._lines = {}
+        self._lines_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def manages(self, queue_id):
+        return self.queues == '*' or int(queue_id) in self.queues
+
+    def line(self, queue_id):
+        """The queue's line, loaded from the Token table on first use."""
+        queue_id = int(queue_id)
+        line = self._lines.get(queue_id)
+        if line is None:
+            with self._lines_lock:
+                line = self._lines.get(queue_id)
+                if line is None:
+                    line = self._lines[queue_id] = self._load(queue_id)
+        return line
+
+    def _load(self, queue_id):
+        self.flush()
+        tokens = Token.objects.filter(queue_id=queue_id)
+        waiting = list(tokens.filter(status='WAITING').values_list('id', 'position_key'))
+        high_water = tokens.aggregate(last=models.Max('position_key'))['last']
+        return QueueLine(queue_id, waiting, high_water)
+
+    def reload(self, queue_id):
+        """Drop a line after the Token table was changed behind the engine's back."""
+        self.flush()
+        with self._lines_lock:
+            self._lines.pop(int(queue_id), None)
+
+    def defer(self, queue_id, token_id, **fields):
+        """Queue a Token UPDATE; later fields for the same token win."""
+        with self._pending_lock:
+            _, pending = self._pending.get(token_id, (queue_id, {}))
+            self._pending[token_id] = (queue_id, {**pending, **fields})
+
+    def defer_keys(self, queue_id, changes):
+        for token_id, key in changes.items():
+            self.defer(queue_id, token_id, position_key=key)
+
+    def flush(self):
+        """Write every deferred change in one transaction. Returns the token count."""
+        with self._flush_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                groups = {}
+                for token_id, (_, fields) in batch.items():
+                    groups.setdefault(tuple(sorted(fields)), []).append(Token(id=token_id, **fields))
+                with transaction.atomic():
+                    for fields, tokens in groups.items():
+                        Token.objects.bulk_update(tokens, fields, batch_size=500)
+                    for queue_id in {queue_id for queue_id, _ in batch.values()}:
+                        snapshots.invalidate(queue_id)
+            except Exception:
+                # Put the batch back underneath anything deferred meanwhile
+                with self._pending_lock:
+                    for token_id, (queue_id, fields) in batch.items():
+                        _, newer = self._pending.get(token_id, (queue_id, {}))
+                        self._pending[token_id] = (queue_id, {**fields, **newer})
+                raise
+            return len(batch)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="queue-engine-flush", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception("Queue engine flush failed; will retry")
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """The process-wide engine, or None when QUEUE_ENGINE manages no queues."""
+    global _engine
+    if _engine is None:
+        config = getattr(settings, 'QUEUE_ENGINE', {})
+        if not config.get('QUEUES'):
+            return None
+        with _engine_lock:
+            if _engine is None:
+                _engine = QueueEngine(config['QUEUES'], config.get('FLUSH_INTERVAL', 0.05))
+                _engine.start()
+    return _engine
+
+
+def line_for(queue_id):
+    """The engine's line for `queue_id` if that queue is engine-managed, else None."""
+    engine = get_engine()
+    if engine is None or not engine.manages(queue_id):
+        return None
+    return engine.line(queue_id)
@@ -0,0 +1,147 @@
+"""
+Live queue updates.
+
+Views call `emit()` when a queue changes; once the transaction commits the
+event is published on `queue:<id>` and `user:<id>` channels. SSE clients
+(see `views.queue_events_stream`) subscribe to those channels instead of
+polling. The default broker is in-process; set QUEUE_EVENTS['BACKEND'] to
+'redis' when running more than one worker so every process sees every event.
+Lifecycle events are also recorded as queue history (rnr/history.py).
+"""
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from . import history, snapshots
+
+
+# Per-subscriber buffer. A client that falls this far behind gets a single
+# "resync" event and should refetch its dashboard.
+SUBSCRIBER_BUFFER = 100
+
+
+def queue_channel(queue_id):
+    return f"queue:{queue_id}"
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+class InProcessBroker:
+    """Fan-out to asyncio subscribers living in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            targets = list(self._subscribers.get(channel, ()))
+        for loop, inbox in targets:
+            # Publishers are sync views on worker threads; hand off to the loop.
+            loop.call_soon_threadsafe(_deliver, inbox, message)
+
+    async def listen(self, channels, idle_timeout=None):
+        """Yield messages as they arrive, or None after `idle_timeout` seconds of quiet."""
+        loop = asyncio.get_running_loop()
+        entry = (loop, asyncio.Queue(maxsize=SUBSCRIBER_BUFFER))
+        with self._lock:
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(entry)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(entry[1].get(), idle_timeout)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                for channel in channels:
+                    subscribers = self._subscribers.get(channel)
+                    if subscribers:
+                        subscribers.discard(entry)
+                        if not subscribers:
+                            del self._subscribers[channel]
+
+
+def _deliver(inbox, message):
+    try:
+        inbox.put_nowait(message)
+    except asyncio.QueueFull:
+        while not inbox.empty():
+            inbox.get_nowait()
+        inbox.put_nowait(json.dumps({"type": "resync"}))
+
+
+class RedisBroker:
+    """Pub/sub through Redis (or anything speaking its protocol)."""
+
+    def __init__(self, url):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError as exc:
+            raise ImportError("QUEUE_EVENTS BACKEND 'redis' requires the `redis` package.") from exc
+        self._url = url
+        self._client = redis.Redis.from_url(url)
+        self._async_redis = redis.asyncio
+
+    def publish(self, channel, message):
+        self._client.publish(channel, message)
+
+    async def listen(self, channels, idle_timeout=None):
+        client = self._async_redis.Redis.from_url(self._url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(*channels)
+        try:
+            while True:
+                item = await pubsub.get_message(ignore_subscribe_messages=True, timeout=idle_timeout)
+                if item is None:
+                    yield None
+                    continue
+                data = item["data"]
+                yield data.decode() if isinstance(data, bytes) else data
+        finally:
+            await pubsub.unsubscribe(*channels)
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                config = getattr(settings, 'QUEUE_EVENTS', {})
+                if config.get('BACKEND', 'memory') == 'redis':
+                    _broker = RedisBroker(config['REDIS_URL'])
+                else:
+                    _broker = InProcessBroker()
+    return _broker
+
+
+def emit(event_type, queue_id, user_ids=(), **payload):
+    """
+    Publish a compact delta, e.g. {"type": "token_called", "queue": 3, "token": 41}.
+    Sent only if the surrounding transaction commits. Also drops the queue's
+    cached snapshot, since subscribers refetch on these events.
+    """
+    snapshots.invalidate(queue_id)
+    history.record(event_type, queue_id, user_ids, payload)
+    message = json.dumps({"type": event_type, "queue": queue_id, **payload})
+    channels = [queue_channel(queue_id)] + [user_channel(uid) for uid in set(user_ids)]
+
+    def send():
+        broker = get_broker()
+        for channel in channels:
+            broker.publish(channel, message)
+
+    transaction.on_commit(send, robust=True)
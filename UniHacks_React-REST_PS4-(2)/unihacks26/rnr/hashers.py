@@ -0,0 +1,85 @@
+"""
+Password hashing with a configurable cost, run off the request thread.
+
+A login costs one full hash, which at Django's default PBKDF2 cost is the
+most expensive thing the API does. The cost is set by
+settings.PASSWORD_HASHING (profile, iterations), and every hash goes
+through one bounded thread pool: at most WORKERS hashes run at once
+(hashlib releases the GIL, so they use real cores), and once MAX_PENDING
+are queued new ones fail fast with `HashingBusy` instead of stalling every
+worker behind a login storm. The async helpers await the pool, so the
+event loop keeps serving other requests meanwhile.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher, PBKDF2PasswordHasher, make_password, verify_password,
+)
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 at PASSWORD_HASHING['ITERATIONS']. Same encoding as
+    Django's, so hashes verify either way and a changed iteration count is
+    picked up by rehash-on-login.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASHING['ITERATIONS']
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_HASHING['ARGON2_TIME_COST']
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_HASHING['ARGON2_MEMORY_COST']
+
+
+class HashingBusy(Exception):
+    """Too many hashes already queued; answer 503 and let the client retry."""
+
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool, _slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                conf = settings.PASSWORD_HASHING
+                _slots = threading.BoundedSemaphore(conf['MAX_PENDING'])
+                _pool = ThreadPoolExecutor(conf['WORKERS'], thread_name_prefix='hasher')
+    return _pool, _slots
+
+
+def submit(fn, *args):
+    pool, slots = get_pool()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy()
+    future = pool.submit(fn, *args)
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+
+def hash_password(raw):
+    return submit(make_password, raw).result()
+
+
+async def ahash_password(raw):
+    return await asyncio.wrap_future(submit(make_password, raw))
+
+
+async def averify_password(raw, encoded):
+    """(is_correct, must_update); must_update means the hash uses old parameters."""
+    return await asyncio.wrap_future(submit(verify_password, raw, encoded))
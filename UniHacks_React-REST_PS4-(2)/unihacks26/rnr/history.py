@@ -0,0 +1,208 @@
+"""
+Append-only queue history.
+
+Token and SwapRequest rows change in place, so they can't answer "how many
+were called last Tuesday at 10". Every `events.emit()` that describes a
+token's lifecycle also records a `QueueEvent` row (BOOKED, CALLED, ...).
+Rows are buffered in-process after the transaction commits and written with
+one bulk INSERT per batch (QUEUE_HISTORY['BATCH_SIZE'] rows, or whatever has
+waited MAX_DELAY seconds at the next event or request end, or at exit).
+History is best-effort: a crash loses at most the unwritten batch.
+
+Events carry an hour `bucket` and are indexed by (bucket, queue), so reports
+and pruning read contiguous hour ranges and never touch the live tables. The
+table itself is not partitioned: `prune()` drops expired hours with ranged
+DELETEs over that index, not by dropping partitions.
+`rollup()` folds new events into QueueHourlyStat incrementally, tracking the
+last event id in a RollupCursor. Run `python manage.py rollup_events [--loop]
+[--prune]`.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import transaction, models
+from django.utils import timezone
+
+from .models import QueueEvent, QueueHourlyStat, RollupCursor, hour_bucket
+
+
+logger = logging.getLogger(__name__)
+
+
+# `emit()` event types that become history, by QueueEvent kind
+KINDS = {
+    "token_booked": QueueEvent.BOOKED,
+    "token_called": QueueEvent.CALLED,
+    "token_completed": QueueEvent.CONFIRMED,
+    "calls_expired": QueueEvent.EXPIRED,
+    "token_snoozed": QueueEvent.SNOOZED,
+    "swap_accepted": QueueEvent.SWAPPED,
+    "swap_matched": QueueEvent.SWAPPED,
+    "token_cancelled": QueueEvent.CANCELLED,
+    # Tokens still in line when the queue rolled over to a new epoch
+    "queue_rolled_over": QueueEvent.CANCELLED,
+    "token_moved": QueueEvent.MOVED,
+}
+
+# Events newer than this are left for the next rollup, so batches still being
+# inserted (with lower ids) are not skipped over.
+ROLLUP_SETTLE = timezone.timedelta(seconds=60)
+ROLLUP_CURSOR = "queue_events"
+
+
+class EventWriter:
+
+    def __init__(self, batch_size, max_delay):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.pending = []
+        self.since = None
+
+    def add(self, rows):
+        with self.lock:
+            if not self.pending:
+                self.since = time.monotonic()
+            self.pending.extend(rows)
+            due = len(self.pending) >= self.batch_size
+        if due:
+            self.flush()
+        else:
+            self.flush_if_stale()
+
+    def flush_if_stale(self):
+        if self.pending and time.monotonic() - self.since >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            rows, self.pending = self.pending, []
+        if not rows:
+            return 0
+        try:
+            QueueEvent.objects.bulk_create(rows, batch_size=self.batch_size)
+        except Exception:
+            logger.exception("Dropped %d queue history events", len(rows))
+            return 0
+        return len(rows)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = getattr(settings, 'QUEUE_HISTORY', {})
+                writer = EventWriter(config.get('BATCH_SIZE', 200), config.get('MAX_DELAY', 2.0))
+                atexit.register(writer.flush)
+                request_finished.connect(lambda **kwargs: writer.flush_if_stale(), weak=False)
+                _writer = writer
+    return _writer
+
+
+def record(event_type, queue_id, user_ids, payload):
+    """Queue history rows for an emitted event; written only if the transaction commits."""
+    kind = KINDS.get(event_type)
+    if kind is None:
+        return
+    now = timezone.now()
+    bucket = hour_bucket(now)
+    # Multi-token events list users in the same order as their tokens
+    token_ids = payload['tokens'] if 'tokens' in payload else [payload['token']]
+    rows = [
+        QueueEvent(bucket=bucket, queue_id=queue_id, token_id=token_id, user_id=user_id, kind=kind, at=now)
+        for token_id, user_id in zip(token_ids, user_ids)
+    ]
+    transaction.on_commit(lambda: get_writer().add(rows), robust=True)
+
+
+def rollup(limit=50000, now=None):
+    """
+    Fold up to `limit` event ids past the cursor into QueueHourlyStat.
+    One grouped query over the new range. Returns the number of events
+    folded, or None once there is nothing (settled) left to read.
+    """
+    settled = (now or timezone.now()) - ROLLUP_SETTLE
+    with transaction.atomic():
+        cursor, _ = RollupCursor.objects.select_for_update().get_or_create(name=ROLLUP_CURSOR)
+        start = cursor.position
+        top = QueueEvent.objects.filter(id__gt=start, at__lt=settled).aggregate(top=models.Max('id'))['top']
+        if top is None:
+            return None
+        end = min(top, start + limit)
+        groups = list(
+            QueueEvent.objects.filter(id__gt=start, id__lte=end)
+            .values_list('queue_id', 'bucket', 'kind').annotate(n=models.Count('id')).order_by()
+        )
+        existing = {
+            (s.queue_id, s.bucket, s.kind): s
+            for s in QueueHourlyStat.objects.filter(
+                bucket__in={g[1] for g in groups}, queue_id__in={g[0] for g in groups}
+            )
+        }
+        created, updated = [], []
+        for queue_id, bucket, kind, n in groups:
+            stat = existing.get((queue_id, bucket, kind))
+            if stat is None:
+                created.append(QueueHourlyStat(queue_id=queue_id, bucket=bucket, kind=kind, count=n))
+            else:
+                stat.count += n
+                updated.append(stat)
+        QueueHourlyStat.objects.bulk_create(created)
+        QueueHourlyStat.objects.bulk_update(updated, ['count'])
+        cursor.position = end
+        cursor.save(update_fields=['position', 'updated_at'])
+    return sum(g[3] for g in groups)
+
+
+def rollup_all(limit=50000):
+    total = 0
+    while (folded := rollup(limit)) is not None:
+        total += folded
+    return total
+
+
+def prune(retention_days=None, now=None, hours_per_batch=24):
+    """
+    Delete events older than QUEUE_HISTORY['RETENTION_DAYS'], `hours_per_batch`
+    hour buckets per DELETE. Events the rollup has not folded in yet are kept.
+    Returns the number deleted.
+    """
+    if retention_days is None:
+        retention_days = getattr(settings, 'QUEUE_HISTORY', {}).get('RETENTION_DAYS', 30)
+    cutoff = hour_bucket((now or timezone.now()) - timezone.timedelta(days=retention_days))
+    folded = RollupCursor.objects.filter(name=ROLLUP_CURSOR).values_list('position', flat=True).first() or 0
+    expired = QueueEvent.objects.filter(bucket__lt=cutoff, id__lte=folded)
+    start = expired.aggregate(first=models.Min('bucket'))['first']
+    deleted = 0
+    while start is not None and start < cutoff:
+        end = min(start + hours_per_batch, cutoff)
+        deleted += expired.filter(bucket__gte=start, bucket__lt=end).delete()[0]
+        start = end
+    return deleted
+
+
+async def run_rollup(interval=300.0, prune_expired=False):
+    """Roll up new events every `interval` seconds, then optionally prune."""
+    while True:
+        try:
+            folded = await sync_to_async(rollup_all)()
+            if folded:
+                logger.info("Rolled up %d queue events", folded)
+            if prune_expired:
+                pruned = await sync_to_async(prune)()
+                if pruned:
+                    logger.info("Pruned %d queue events", pruned)
+        except Exception:
+            logger.exception("Queue history rollup failed")
+        await asyncio.sleep(interval)
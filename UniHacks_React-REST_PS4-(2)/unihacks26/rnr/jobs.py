@@ -0,0 +1,68 @@
+"""
+Background jobs inside the server process.
+
+The expiry sweeper, the nightly rollover and swap matching change queue lines
+behind the views' backs. Engine-managed lines (rnr/engine.py) live in the server's
+memory, so in engine mode those jobs have to run in the server process:
+only there do their `reload()` calls and deferred writes reach the live
+line. With BACKGROUND_JOBS on, `start()` (called from wsgi.py and asgi.py)
+runs them on an asyncio loop in a daemon thread. Engine mode refuses to
+start without it, and the sweep, rollover and matching commands refuse to run
+beside an engine.
+"""
+import asyncio
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import CommandError
+
+
+logger = logging.getLogger(__name__)
+
+_thread = None
+_lock = threading.Lock()
+
+
+def engine_mode():
+    return bool(getattr(settings, 'QUEUE_ENGINE', {}).get('QUEUES'))
+
+
+def jobs():
+    from .matching import run_matcher
+    from .rollover import run_rollover
+    from .sweeper import run_sweeper
+    return [run_sweeper(), run_rollover(), run_matcher()]
+
+
+def start():
+    """Start the engine and the background jobs for this server process."""
+    global _thread
+    if engine_mode() and not settings.BACKGROUND_JOBS:
+        raise ImproperlyConfigured(
+            "QUEUE_ENGINE_QUEUES keeps lines in the server's memory; the jobs that change them must run "
+            "in the same process. Set BACKGROUND_JOBS=1."
+        )
+    if not settings.BACKGROUND_JOBS:
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        if engine_mode():
+            from .engine import get_engine
+            get_engine()
+
+        async def main():
+            await asyncio.gather(*jobs())
+
+        _thread = threading.Thread(target=asyncio.run, args=(main(),), name="background-jobs", daemon=True)
+        _thread.start()
+        logger.info("Started background jobs")
+
+
+def refuse_outside_server(job):
+    """For management commands: in engine mode, `job` runs inside the server process only."""
+    if engine_mode():
+        raise CommandError(f"QUEUE_ENGINE_QUEUES is set, so {job} runs inside the server process "
+                           "(BACKGROUND_JOBS); running it here would leave the server's lines stale.")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rnr.archive import ARCHIVE_AFTER, BATCH_SIZE, archive
+
+
+class Command(BaseCommand):
+    help = "Move finished tokens and resolved swap requests to the archive tables (see rnr/archive.py). Run daily."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=ARCHIVE_AFTER.total_seconds() / 3600,
+                            help="Only archive rows older than this many hours.")
+        parser.add_argument('--batch', type=int, default=BATCH_SIZE, help="Rows moved per transaction.")
+
+    def handle(self, *args, **options):
+        moved = archive(timezone.timedelta(hours=options['hours']), options['batch'])
+        self.stdout.write(f"Archived {moved['tokens']} tokens and {moved['swaps']} swap requests.")
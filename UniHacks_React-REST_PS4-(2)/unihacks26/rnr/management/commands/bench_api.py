@@ -0,0 +1,235 @@
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, models
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from rnr.auth import issue_tokens
+from rnr.history import get_writer
+from rnr.models import UserMe, Institution, Queue, Token, SwapRequest
+from seed_queues import seed_bulk
+
+
+# Relative frequency of each operation in the mixed phase
+MIX = {
+    "user_dashboard": 35,
+    "institution_dashboard": 15,
+    "search": 10,
+    "book": 12,
+    "call_next": 8,
+    "cancel": 8,
+    "swap_request": 6,
+    "swap_accept": 6,
+}
+
+
+class Command(BaseCommand):
+    help = ("Seed a throwaway database and drive booking bursts plus a mixed workload "
+            "through the API. Reports p50/p99 latency, queries per request and "
+            "throughput per endpoint; --json output can be diffed across commits.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--institutions', type=int, default=5)
+        parser.add_argument('--queues', type=int, default=2, help="Queues per institution.")
+        parser.add_argument('--tokens', type=int, default=200, help="WAITING tokens seeded per queue.")
+        parser.add_argument('--burst', type=int, default=500, help="Bookings in the burst phase.")
+        parser.add_argument('--requests', type=int, default=2000, help="Requests in the mixed phase.")
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', action='store_true', help="Print results as JSON.")
+        parser.add_argument('--output', help="Also write the JSON results to this file.")
+
+    def handle(self, *args, **options):
+        # Rejected cancels/swaps are part of the mix; don't log each one
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            started = time.perf_counter()
+            self.state = self.seed(options)
+            seeded = time.perf_counter() - started
+            results = {
+                "profile": settings.DB_PROFILE,
+                "workers": options['workers'],
+                "seed": options['seed'],
+                "dataset": {
+                    "institutions": options['institutions'],
+                    "queues": len(self.state["queues"]),
+                    "tokens": len(self.state["queues"]) * options['tokens'],
+                    "seed_seconds": round(seeded, 3),
+                },
+                "phases": {
+                    "booking_burst": self.run_phase(["book"] * options['burst'], options),
+                    "mixed": self.run_phase(self.mixed_ops(options), options),
+                },
+            }
+        finally:
+            # Write buffered history now; at exit the throwaway database is gone
+            get_writer().flush()
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.report(results)
+
+    def seed(self, options):
+        inst_ids, queue_ids, user_ids = seed_bulk(options['institutions'], options['queues'], options['tokens'], "bench")
+        # Fresh users for bookings; each books at most once per queue
+        fresh = UserMe.objects.bulk_create(
+            UserMe(name=f"Walk-in {n}", email=f"walkin{n}@bench.local", password="!", reward_points=100)
+            for n in range(options['burst'] + options['requests'])
+        )
+        hot_queue = queue_ids[0]
+        Queue.objects.filter(id=hot_queue).update(size=models.F('size') + options['burst'] + options['requests'])
+        tokens = list(Token.objects.values_list('id', 'queue_id', 'user_id'))
+        by_queue = {}
+        for token_id, queue_id, _ in tokens:
+            by_queue.setdefault(queue_id, []).append(token_id)
+        # Pending requests for the accept path: back half asks the front half
+        swaps = []
+        for queue_id, ids in by_queue.items():
+            half = len(ids) // 2
+            swaps += SwapRequest.objects.bulk_create(
+                SwapRequest(queue_id=queue_id, sender_id=ids[half + i], receiver_id=ids[i])
+                for i in range(0, half, 4)
+            )
+        return {
+            "institutions": inst_ids,
+            "queues": queue_ids,
+            "owner": dict(Queue.objects.filter(id__in=queue_ids).values_list('id', 'institution_id')),
+            "users": user_ids,
+            "tokens": [t for t, _, _ in tokens],
+            "token_owner": {t: user_id for t, _, user_id in tokens},
+            "by_queue": by_queue,
+            "fresh": [u.id for u in fresh],
+            "swaps": [s.id for s in swaps],
+            "swap_receiver": {s.id: s.receiver_id for s in swaps},
+            "lock": threading.Lock(),
+            "hot_queue": hot_queue,
+        }
+
+    def mixed_ops(self, options):
+        rng = random.Random(options['seed'])
+        return rng.choices(list(MIX), weights=list(MIX.values()), k=options['requests'])
+
+    def take(self, pool):
+        with self.state["lock"]:
+            return self.state[pool].pop() if self.state[pool] else None
+
+    def auth(self, model, account_id):
+        """Request headers carrying an access token for the account."""
+        role = 'institution' if model is Institution else 'user'
+        access = issue_tokens(role, model(id=account_id, name=''))['access']
+        return {"HTTP_AUTHORIZATION": f"Bearer {access}"}
+
+    def request(self, client, rng, op):
+        """Build and send one request for `op`; returns the response (or None if nothing to do)."""
+        s = self.state
+        queue_id = rng.choice(s["queues"])
+        if op == "book":
+            user_id = self.take("fresh")
+            return user_id and client.post(reverse('book_token'), {"queue_id": s["hot_queue"]},
+                                           **self.auth(UserMe, user_id))
+        if op == "user_dashboard":
+            user_id = rng.choice(s["users"])
+            return client.get(reverse('user_dashboard', args=[user_id]), **self.auth(UserMe, user_id))
+        if op == "institution_dashboard":
+            inst_id = rng.choice(s["institutions"])
+            return client.get(reverse('inst_dashboard', args=[inst_id]), **self.auth(Institution, inst_id))
+        if op == "search":
+            return client.get(reverse('search_institutions'), {"search": rng.choice(["clinic", "main", "pune", "cl"])})
+        if op == "call_next":
+            return client.post(reverse('call_next', args=[queue_id]), **self.auth(Institution, s["owner"][queue_id]))
+        if op == "cancel":
+            token_id = rng.choice(s["tokens"])
+            return client.post(reverse('token_manage'), {"token_id": token_id, "action": "CANCEL"},
+                               **self.auth(UserMe, s["token_owner"][token_id]))
+        if op == "swap_request":
+            ids = s["by_queue"][queue_id]
+            i = rng.randrange(1, len(ids))
+            return client.post(reverse('token_manage'), {
+                "token_id": ids[i], "action": "SWAP", "target_token_id": ids[rng.randrange(i)],
+            }, **self.auth(UserMe, s["token_owner"][ids[i]]))
+        if op == "swap_accept":
+            swap_id = self.take("swaps")
+            return swap_id and client.post(reverse('accept_swap', args=[swap_id]),
+                                           **self.auth(UserMe, s["token_owner"][s["swap_receiver"][swap_id]]))
+        raise ValueError(op)
+
+    def run_phase(self, ops, options):
+        workers = options['workers']
+
+        def worker(index):
+            client = Client(raise_request_exception=False)
+            rng = random.Random(options['seed'] * 1000 + index)
+            samples = []
+            try:
+                for op in ops[index::workers]:
+                    with CaptureQueriesContext(connections['default']) as ctx:
+                        started = time.perf_counter()
+                        response = self.request(client, rng, op)
+                        elapsed = time.perf_counter() - started
+                    if response is not None:
+                        samples.append((op, elapsed, len(ctx.captured_queries), response.status_code))
+            finally:
+                connections.close_all()
+            return samples
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            samples = [s for chunk in pool.map(worker, range(workers)) for s in chunk]
+        elapsed = time.perf_counter() - started
+
+        by_op = {}
+        for op, latency, queries, status_code in samples:
+            by_op.setdefault(op, []).append((latency, queries, status_code))
+        return {
+            "seconds": round(elapsed, 3),
+            "requests": len(samples),
+            "throughput": round(len(samples) / elapsed, 1),
+            "endpoints": {op: self.summarize(rows, elapsed) for op, rows in sorted(by_op.items())},
+        }
+
+    def summarize(self, rows, elapsed):
+        latencies = sorted(r[0] for r in rows)
+        queries = [r[1] for r in rows]
+        return {
+            "count": len(rows),
+            "errors": sum(r[2] >= 400 for r in rows),
+            "throughput": round(len(rows) / elapsed, 1),
+            "p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "p99_ms": round(latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, 2),
+            "queries_mean": round(statistics.mean(queries), 1),
+            "queries_max": max(queries),
+        }
+
+    def report(self, results):
+        d = results["dataset"]
+        self.stdout.write(
+            f"profile={results['profile']} workers={results['workers']} "
+            f"queues={d['queues']} tokens={d['tokens']} (seeded in {d['seed_seconds']}s)"
+        )
+        for name, phase in results["phases"].items():
+            self.stdout.write(f"\n{name}: {phase['requests']} requests in {phase['seconds']}s "
+                              f"({phase['throughput']} req/s)")
+            self.stdout.write(f"  {'endpoint':<22}{'count':>7}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'queries':>9}")
+            for op, r in phase["endpoints"].items():
+                self.stdout.write(
+                    f"  {op:<22}{r['count']:>7}{r['errors']:>6}{r['throughput']:>9.1f}"
+                    f"{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['queries_mean']:>9.1f}"
+                )
@@ -0,0 +1,182 @@
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from rnr.auth import issue_tokens
+from rnr.models import UserMe, Institution
+from seed_queues import seed_bulk
+
+
+# (label, server, ASYNC_READ_VIEWS)
+SETUPS = [
+    ("wsgi", "wsgi", "0"),
+    ("uvicorn, sync views", "uvicorn", "0"),
+    ("uvicorn, async views", "uvicorn", "1"),
+]
+
+
+class Command(BaseCommand):
+    help = ("Serve a throwaway database with the WSGI server, with uvicorn running the sync views, and with "
+            "uvicorn running the async read views (ASYNC_READ_VIEWS=1). Drives the same mix of dashboard, "
+            "search and discovery reads at each concurrency level and reports req/s and latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--institutions', type=int, default=5)
+        parser.add_argument('--queues', type=int, default=2, help="Queues per institution.")
+        parser.add_argument('--tokens', type=int, default=100, help="WAITING tokens seeded per queue.")
+        parser.add_argument('--concurrency', default="1,16,64", help="Comma-separated client counts.")
+        parser.add_argument('--requests', type=int, default=500, help="Requests per concurrency level.")
+        parser.add_argument('--wsgi-server', choices=['runserver', 'gunicorn'], default='runserver',
+                            help="WSGI server for unihacks26.wsgi (gunicorn runs gthread with 16 threads).")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', action='store_true', help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        if importlib.util.find_spec('uvicorn') is None:
+            raise CommandError("uvicorn is not installed (pip install uvicorn).")
+        if options['wsgi_server'] == 'gunicorn' and importlib.util.find_spec('gunicorn') is None:
+            raise CommandError("gunicorn is not installed.")
+        levels = [int(c) for c in options['concurrency'].split(',')]
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            inst_ids, queue_ids, user_ids = seed_bulk(
+                options['institutions'], options['queues'], options['tokens'], "bench")
+            paths = self.paths(inst_ids, user_ids, options)
+            # The servers are separate processes; point them at the throwaway database
+            env = {**os.environ, "SQLITE_PATH": str(connection.settings_dict['NAME']),
+                   "POSTGRES_DB": str(connection.settings_dict['NAME'])}
+            connections.close_all()
+            results = {"profile": settings.DB_PROFILE, "cores": os.cpu_count(), "wsgi_server": options['wsgi_server'],
+                       "runs": []}
+            for label, server, async_views in SETUPS:
+                server_env = {**env, "ASYNC_READ_VIEWS": async_views}
+                with Server(server if server == "uvicorn" else options['wsgi_server'], server_env) as port:
+                    asyncio.run(drive(port, paths[:20], 20))     # warm-up
+                    for level in levels:
+                        run = asyncio.run(drive(port, paths, level, options['requests']))
+                        results["runs"].append({"setup": label, "concurrency": level, **run})
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"profile={results['profile']} cores={results['cores']} "
+                          f"wsgi={results['wsgi_server']} requests/level={options['requests']}")
+        self.stdout.write(f"  {'setup':<22}{'clients':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        for r in results["runs"]:
+            self.stdout.write(f"  {r['setup']:<22}{r['concurrency']:>8}{r['throughput']:>9.1f}"
+                              f"{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['errors']:>8}")
+
+    def paths(self, inst_ids, user_ids, options):
+        """A seeded mix of the four async-capable reads, as (path, access token or None)."""
+        rng = random.Random(options['seed'])
+        pages = [(reverse('user_dashboard', args=[u]), issue_tokens('user', UserMe(id=u, name=''))['access'])
+                 for u in user_ids]
+        pages += [(f"{reverse('inst_dashboard', args=[i])}?limit=20",
+                   issue_tokens('institution', Institution(id=i, name=''))['access']) for i in inst_ids]
+        pages += [(f"{reverse('search_institutions')}?search={term}&page={page}", None)
+                  for term in ("clinic", "main", "pune", "cl") for page in (1, 2)]
+        pages += [(f"{reverse('discovery_map')}?lat={18.5 + n * 0.01}&lng={73.8 + n * 0.01}", None) for n in range(5)]
+        weights = [35 / len(user_ids)] * len(user_ids) + [15 / len(inst_ids)] * len(inst_ids) + [10 / 8] * 8 + [10 / 5] * 5
+        return rng.choices(pages, weights=weights, k=options['requests'])
+
+
+class Server:
+    """A server subprocess on a free local port, for use as a context manager."""
+
+    def __init__(self, kind, env):
+        self.kind = kind
+        self.env = env
+
+    def command(self, port):
+        if self.kind == "uvicorn":
+            return [sys.executable, "-m", "uvicorn", "unihacks26.asgi:application", "--port", str(port),
+                    "--log-level", "warning", "--no-access-log"]
+        if self.kind == "gunicorn":
+            return [sys.executable, "-m", "gunicorn", "unihacks26.wsgi:application", "--bind", f"127.0.0.1:{port}",
+                    "--worker-class", "gthread", "--threads", "16", "--log-level", "warning"]
+        # Django's threaded WSGI server, serving WSGI_APPLICATION (unihacks26.wsgi)
+        return [sys.executable, "manage.py", "runserver", f"127.0.0.1:{port}", "--noreload", "--skip-checks"]
+
+    def __enter__(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self.process = subprocess.Popen(self.command(port), cwd=settings.BASE_DIR, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return port
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.__exit__()
+                    raise CommandError(f"{self.kind} did not start.")
+                time.sleep(0.1)
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+async def fetch(port, path, access=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    auth = f"Authorization: Bearer {access}\r\n" if access else ""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n{auth}Connection: close\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+    return int(response.split(b" ", 2)[1]) if response else 599
+
+
+async def drive(port, paths, concurrency, total=None):
+    """`concurrency` clients issue `paths` (one request each) back to back."""
+    pending = list(paths[:total] if total else paths)
+    latencies, errors = [], 0
+
+    async def client():
+        nonlocal errors
+        while pending:
+            path, access = pending.pop()
+            started = time.perf_counter()
+            try:
+                code = await fetch(port, path, access)
+            except OSError:
+                code = 599
+            latencies.append(time.perf_counter() - started)
+            errors += code >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, 1),
+    }
@@ -0,0 +1,118 @@
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from rnr.auth import issue_tokens
+from rnr.history import get_writer
+from rnr.models import UserMe, Institution, Queue, Token, SwapRequest, POSITION_GAP
+
+
+class Command(BaseCommand):
+    help = ("Measure concurrent booking and swap-accept throughput against the "
+            "configured DB_PROFILE. Runs in a throwaway test database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=2000)
+        parser.add_argument('--swaps', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--json', action='store_true', help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = {
+                "profile": settings.DB_PROFILE,
+                "workers": options['workers'],
+                "booking": self.bench_booking(options['bookings'], options['workers']),
+                "swap_accept": self.bench_swaps(options['swaps'], options['workers']),
+            }
+        finally:
+            # Write buffered history now; at exit the throwaway database is gone
+            get_writer().flush()
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"profile={results['profile']} workers={results['workers']}")
+        for name in ('booking', 'swap_accept'):
+            r = results[name]
+            self.stdout.write(
+                f"  {name:<12} {r['ops']:>6} ops  {r['throughput']:>8.1f} ops/s  "
+                f"p50 {r['p50_ms']:.1f} ms  p99 {r['p99_ms']:.1f} ms  errors {r['errors']}"
+            )
+
+    def make_queue(self, size):
+        inst = Institution.objects.create(name="Bench", email=f"bench{time.time_ns()}@x.com", phone="0", password="x")
+        return Queue.objects.create(institution=inst, name="Bench", size=size)
+
+    def make_users(self, count, tag):
+        UserMe.objects.bulk_create(
+            UserMe(name=f"{tag} {n}", email=f"{tag}{n}@bench.local", password="x", reward_points=100)
+            for n in range(count)
+        )
+        return list(UserMe.objects.filter(email__endswith="@bench.local", name__startswith=tag)
+                    .values_list('id', flat=True))
+
+    def run(self, calls, workers):
+        """Fire (url, data, user id) POSTs from `workers` threads; returns latency/throughput stats."""
+        def worker(chunk):
+            client = Client(raise_request_exception=False)
+            timings, errors = [], 0
+            try:
+                for url, data, user_id in chunk:
+                    auth = f"Bearer {issue_tokens('user', UserMe(id=user_id, name=''))['access']}"
+                    started = time.perf_counter()
+                    response = client.post(url, data, HTTP_AUTHORIZATION=auth)
+                    timings.append(time.perf_counter() - started)
+                    errors += response.status_code >= 400
+            finally:
+                connections.close_all()
+            return timings, errors
+
+        chunks = [calls[i::workers] for i in range(workers)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            outcomes = list(pool.map(worker, chunks))
+        elapsed = time.perf_counter() - started
+
+        timings = sorted(t for chunk, _ in outcomes for t in chunk)
+        return {
+            "ops": len(timings),
+            "errors": sum(e for _, e in outcomes),
+            "seconds": round(elapsed, 3),
+            "throughput": round(len(timings) / elapsed, 1),
+            "p50_ms": round(statistics.median(timings) * 1000, 2),
+            "p99_ms": round(timings[int(len(timings) * 0.99) - 1] * 1000, 2),
+        }
+
+    def bench_booking(self, count, workers):
+        queue = self.make_queue(count)
+        url = reverse('book_token')
+        return self.run([(url, {"queue_id": queue.id}, uid) for uid in self.make_users(count, "book")], workers)
+
+    def bench_swaps(self, count, workers):
+        # Disjoint sender/receiver pairs, so every accept can succeed
+        queue = self.make_queue(count * 2)
+        users = self.make_users(count * 2, "swap")
+        Token.objects.bulk_create(
+            Token(user_id=uid, queue=queue, token_number=n, position_key=n * POSITION_GAP)
+            for n, uid in enumerate(users, start=1)
+        )
+        tokens = list(Token.objects.filter(queue=queue).order_by('token_number'))
+        SwapRequest.objects.bulk_create(
+            SwapRequest(queue=queue, sender=tokens[i + 1], receiver=tokens[i]) for i in range(0, len(tokens), 2)
+        )
+        swaps = SwapRequest.objects.filter(queue=queue).values_list('id', 'receiver__user_id')
+        return self.run([(reverse('accept_swap', args=[sid]), {}, uid) for sid, uid in swaps], workers)
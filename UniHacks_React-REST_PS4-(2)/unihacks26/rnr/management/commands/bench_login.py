@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from rnr.auth import issue_tokens
+from rnr.models import UserMe
+
+
+class Command(BaseCommand):
+    help = ("Drive a login storm through the API at several PBKDF2 costs on a throwaway "
+            "database. Reports logins/s (total and per hashing core) and the latency of a "
+            "dashboard probe running alongside, to show other endpoints stay responsive.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', default="1000000,600000,260000",
+                            help="Comma-separated PBKDF2 iteration counts to compare.")
+        parser.add_argument('--logins', type=int, default=200, help="Logins per cost.")
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=16, help="Concurrent clients.")
+        parser.add_argument('--json', action='store_true', help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        cores = min(os.cpu_count() or 1, settings.PASSWORD_HASHING['WORKERS'])
+        results = {"cores": cores, "hash_workers": settings.PASSWORD_HASHING['WORKERS'], "runs": []}
+        try:
+            probe_user = UserMe.objects.create(name="Probe", email="probe@bench.local", password="!")
+            for iterations in [int(i) for i in options['iterations'].split(',')]:
+                with override_settings(PASSWORD_HASHING={**settings.PASSWORD_HASHING, 'ITERATIONS': iterations},
+                                       LOGIN_LIMIT={'ATTEMPTS': 10 ** 9, 'WINDOW': 1}):
+                    results["runs"].append(self.run(iterations, probe_user.id, cores, options))
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"hashing cores={cores} workers={options['workers']}")
+        self.stdout.write(f"  {'iterations':>10}{'logins/s':>10}{'per core':>10}{'p50 ms':>9}{'p99 ms':>9}"
+                          f"{'503s':>6}{'probe p50':>11}{'probe p99':>11}")
+        for r in results["runs"]:
+            self.stdout.write(
+                f"  {r['iterations']:>10}{r['throughput']:>10.1f}{r['per_core']:>10.1f}{r['p50_ms']:>9.1f}"
+                f"{r['p99_ms']:>9.1f}{r['busy']:>6}{r['probe_p50_ms']:>11.1f}{r['probe_p99_ms']:>11.1f}"
+            )
+
+    def run(self, iterations, probe_user_id, cores, options):
+        UserMe.objects.exclude(id=probe_user_id).delete()
+        cache.clear()
+        encoded = make_password("bench-pw")
+        emails = [f"login{n}@bench.local" for n in range(options['users'])]
+        UserMe.objects.bulk_create(UserMe(name=e, email=e, password=encoded) for e in emails)
+
+        def login(n):
+            client = Client(raise_request_exception=False)
+            started = time.perf_counter()
+            res = client.post(reverse('user_login'), {"email": emails[n % len(emails)], "password": "bench-pw"})
+            return time.perf_counter() - started, res.status_code
+
+        # A dashboard reader running through the storm
+        stop, probes = threading.Event(), []
+
+        def probe():
+            client = Client(raise_request_exception=False)
+            url = reverse('user_dashboard', args=[probe_user_id])
+            access = issue_tokens('user', UserMe(id=probe_user_id, name=''))['access']
+            while not stop.is_set():
+                started = time.perf_counter()
+                client.get(url, HTTP_AUTHORIZATION=f"Bearer {access}")
+                probes.append(time.perf_counter() - started)
+            connections.close_all()
+
+        prober = threading.Thread(target=probe)
+        prober.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['workers']) as pool:
+            samples = list(pool.map(login, range(options['logins'])))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        prober.join()
+
+        ok = sorted(latency for latency, code in samples if code == 200)
+        probes.sort()
+        return {
+            "iterations": iterations,
+            "logins": len(ok),
+            "busy": sum(code == 503 for _, code in samples),
+            "throughput": round(len(ok) / elapsed, 1),
+            "per_core": round(len(ok) / elapsed / cores, 1),
+            "p50_ms": round(statistics.median(ok) * 1000, 1) if ok else None,
+            "p99_ms": round(ok[max(0, int(len(ok) * 0.99) - 1)] * 1000, 1) if ok else None,
+            "probe_p50_ms": round(statistics.median(probes) * 1000, 1) if probes else None,
+            "probe_p99_ms": round(probes[max(0, int(len(probes) * 0.99) - 1)] * 1000, 1) if probes else None,
+        }
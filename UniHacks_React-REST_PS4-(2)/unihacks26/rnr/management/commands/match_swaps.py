@@ -0,0 +1,24 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from rnr.jobs import refuse_outside_server
+from rnr.matching import match_all, run_matcher
+
+
+class Command(BaseCommand):
+    help = "Pair open swap intents into swaps (see rnr/matching.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep matching instead of running once.")
+        parser.add_argument('--interval', type=float, default=10.0, help="Seconds between passes with --loop.")
+        parser.add_argument('--budget', type=float, default=None,
+                            help="Stop starting new queues after this many seconds (default: the interval).")
+
+    def handle(self, *args, **options):
+        refuse_outside_server("swap matching")
+        if options['loop']:
+            asyncio.run(run_matcher(options['interval'], options['budget']))
+        else:
+            matched = match_all(options['budget'])
+            self.stdout.write(f"Matched {matched} swaps.")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from rnr.jobs import refuse_outside_server
+from rnr.rollover import recount_active, rollover, rollover_due
+
+
+class Command(BaseCommand):
+    help = ("Start a new epoch on queues (numbering restarts at 1, tokens still in line are closed). "
+            "By default every queue whose epoch began before today; run shortly after midnight.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', type=int, action='append', help="Roll over this queue now (repeatable).")
+        parser.add_argument('--recount', action='store_true',
+                            help="Only recompute each queue's active token count from its tokens.")
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            updated = recount_active(options['queue'])
+            self.stdout.write(f"Recounted {updated} queues.")
+            return
+        refuse_outside_server("rollover (or POST /api/queue/rollover/<id>/)")
+        if options['queue']:
+            results = {queue_id: rollover(queue_id) for queue_id in options['queue']}
+        else:
+            results = rollover_due()
+        for queue_id, (epoch, closed) in results.items():
+            self.stdout.write(f"Queue {queue_id}: epoch {epoch}, closed {closed} tokens.")
+        self.stdout.write(f"Rolled over {len(results)} queues.")
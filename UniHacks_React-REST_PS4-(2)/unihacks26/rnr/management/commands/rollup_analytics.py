@@ -0,0 +1,21 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from rnr.analytics import DEFAULT_DAYS, build_rollups, run_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild hourly and daily queue analytics for recent days (see rnr/analytics.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help="Whole days to recompute, ending today.")
+        parser.add_argument('--loop', action='store_true', help="Keep rebuilding instead of running once.")
+        parser.add_argument('--interval', type=float, default=900.0, help="Seconds between passes with --loop.")
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            asyncio.run(run_rollups(options['interval'], options['days']))
+        else:
+            written = build_rollups(options['days'])
+            self.stdout.write(f"Wrote {written} rollup rows.")
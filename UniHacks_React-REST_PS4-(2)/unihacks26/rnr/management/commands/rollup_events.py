@@ -0,0 +1,24 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from rnr.history import prune, rollup_all, run_rollup
+
+
+class Command(BaseCommand):
+    help = "Fold new queue history events into hourly per-queue stats (see rnr/history.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep rolling up instead of running once.")
+        parser.add_argument('--interval', type=float, default=300.0, help="Seconds between passes with --loop.")
+        parser.add_argument('--prune', action='store_true',
+                            help="Also delete rolled-up events older than QUEUE_HISTORY_RETENTION_DAYS.")
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            asyncio.run(run_rollup(options['interval'], options['prune']))
+        else:
+            folded = rollup_all()
+            self.stdout.write(f"Rolled up {folded} events.")
+            if options['prune']:
+                self.stdout.write(f"Pruned {prune()} events.")
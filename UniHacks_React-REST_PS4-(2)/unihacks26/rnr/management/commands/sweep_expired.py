@@ -0,0 +1,22 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from rnr.jobs import refuse_outside_server
+from rnr.sweeper import sweep, run_sweeper
+
+
+class Command(BaseCommand):
+    help = "Expire stale swap requests and unconfirmed calls."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping instead of running once.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between sweeps with --loop.")
+
+    def handle(self, *args, **options):
+        refuse_outside_server("the expiry sweep")
+        if options['loop']:
+            asyncio.run(run_sweeper(options['interval']))
+        else:
+            result = sweep()
+            self.stdout.write(f"Expired {result['swaps']} swap requests and {result['calls']} calls.")
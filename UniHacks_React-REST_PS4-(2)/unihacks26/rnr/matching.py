@@ -0,0 +1,160 @@
+"""
+Batched swap matching.
+
+Instead of one SwapRequest per MOVE_FORWARD and a manual accept for each,
+tokens post standing intents (see `views.swap_intent_api`):
+
+    FORWARD  points=b   "I'll pay up to b reward points to move ahead"
+    BACKWARD points=a   "I'll move back for a points"
+
+A periodic pass per queue pairs buyers with sellers ahead of them whose ask
+they cover, maximizing the total surplus sum(bid - ask). Each matched pair
+exchanges places and the buyer pays the seller's ask, all in one transaction.
+
+The matching is a sweep from the front of the line with a min-heap of asks
+(O(n log n)). When a buyer takes a seller it leaves its bid in the heap, so a
+later buyer with a higher bid can take over that seller if doing so raises
+the total. Run it with `python manage.py match_swaps [--loop]`; in engine mode
+the swapped keys are written behind by the server's engine, so matching runs
+inside the server process instead (rnr/jobs.py).
+"""
+import asyncio
+import heapq
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+
+from .engine import get_engine, line_for
+from .events import emit
+from .models import Queue, Token, SwapIntent
+from .rewards import credit
+
+
+logger = logging.getLogger(__name__)
+
+
+# Oldest intents considered per queue per pass; keeps one pass bounded.
+MAX_INTENTS_PER_PASS = 5000
+
+
+def plan_matches(intents):
+    """
+    Maximum-surplus matching of FORWARD (buyer) and BACKWARD (seller) intents.
+    `intents` are (position_key, side, points, intent_id); a buyer can only
+    pair with a seller ahead of it whose ask is at most its bid.
+    Returns {buyer_id: seller_id}.
+    """
+    heap = []       # (price, kind, seq, intent_id); kind 0 = seller's ask, 1 = matched buyer's bid
+    match = {}      # buyer -> seller
+    for seq, (_, side, points, intent_id) in enumerate(sorted(intents)):
+        if side == 'BACKWARD':
+            heapq.heappush(heap, (points, 0, seq, intent_id))
+            continue
+        if not heap or heap[0][0] > points or (heap[0][0] == points and heap[0][1] == 1):
+            continue
+        _, kind, _, other = heapq.heappop(heap)
+        # Taking a matched buyer's bid means taking over its seller
+        match[intent_id] = match.pop(other) if kind else other
+        heapq.heappush(heap, (points, 1, seq, intent_id))
+    return match
+
+
+def match_queue(queue_id, limit=MAX_INTENTS_PER_PASS):
+    """One matching pass over a queue's open intents. Returns the number of swaps made."""
+    queue = Queue.objects.get(id=queue_id)
+    engine, line = get_engine(), line_for(queue_id)
+    now = timezone.now()
+    with transaction.atomic():
+        open_intents = SwapIntent.objects.filter(queue_id=queue_id, status='OPEN')
+        # Intents whose token has left the line (called, cancelled) are dropped
+        open_intents.exclude(token__status='WAITING').update(status='CANCELLED')
+        if line is not None:
+            open_intents.exclude(token_id__in=list(line.keys)).update(status='CANCELLED')
+
+        intents = list(
+            open_intents.select_for_update(of=('self', 'token__user')).select_related('token__user')
+            .order_by('created_at')[:limit]
+        )
+        by_id = {i.id: i for i in intents}
+        rows = []
+        for i in intents:
+            token = i.token
+            position = position_of(token, line)
+            if position is None:
+                continue
+            if i.side == 'FORWARD':
+                if token.swaps_used >= queue.max_swaps_per_user:
+                    continue
+                bid = min(i.points, token.user.reward_points)
+                rows.append((position, i.side, bid, i.id))
+            else:
+                rows.append((position, i.side, i.points, i.id))
+
+        pairs = plan_matches(rows)
+        if not pairs:
+            return 0
+
+        points, keys, swaps_used = {}, {}, []
+        for buyer_id, seller_id in pairs.items():
+            buyer, seller = by_id[buyer_id], by_id[seller_id]
+            b, s = buyer.token, seller.token
+            price = seller.points
+            points[b.user_id] = points.get(b.user_id, 0) - price
+            points[s.user_id] = points.get(s.user_id, 0) + price
+            if line is not None:
+                # Once the points have committed; the keys are written behind
+                transaction.on_commit(lambda b=b, s=s: engine.defer_keys(queue_id, line.swap(b.id, s.id)))
+            else:
+                keys[b.id], keys[s.id] = s.position_key, b.position_key
+            b.swaps_used += 1
+            swaps_used.append(b)
+            buyer.matched_with, seller.matched_with = s, b
+            for intent in (buyer, seller):
+                intent.status, intent.price, intent.matched_at = 'MATCHED', price, now
+
+        if keys:
+            Token.objects.bulk_update([Token(id=tid, position_key=k) for tid, k in keys.items()], ['position_key'])
+        Token.objects.bulk_update(swaps_used, ['swaps_used'])
+        credit(points, 'swap_matched')
+        SwapIntent.objects.bulk_update(
+            [by_id[i] for pair in pairs.items() for i in pair], ['status', 'price', 'matched_at', 'matched_with']
+        )
+        for buyer_id, seller_id in pairs.items():
+            b, s = by_id[buyer_id].token, by_id[seller_id].token
+            emit("swap_matched", queue_id, [b.user_id, s.user_id], tokens=[b.id, s.id], price=by_id[seller_id].points)
+    return len(pairs)
+
+
+def position_of(token, line):
+    """Sort key for the sweep; engine-managed lines hold the authoritative key (None once it has left)."""
+    return line.keys.get(token.id) if line is not None else token.position_key
+
+
+def match_all(budget_seconds=None):
+    """Match every queue with open intents, stopping once `budget_seconds` have passed."""
+    deadline = time.monotonic() + budget_seconds if budget_seconds else None
+    queue_ids = (
+        SwapIntent.objects.filter(status='OPEN', queue__allow_swaps=True)
+        .values_list('queue', flat=True).distinct().order_by()
+    )
+    matched = 0
+    for queue_id in queue_ids:
+        if deadline is not None and time.monotonic() > deadline:
+            break
+        matched += match_queue(queue_id)
+    return matched
+
+
+async def run_matcher(interval=10.0, budget_seconds=None):
+    """Run a matching pass every `interval` seconds."""
+    while True:
+        try:
+            matched = await sync_to_async(match_all)(budget_seconds or interval)
+            if matched:
+                logger.info("Matched %d swaps", matched)
+        except Exception:
+            logger.exception("Swap matching pass failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,272 @@
+"""
+Per-view request metrics, served in Prometheus text format at /api/metrics/.
+
+`MetricsMiddleware` times every request and tags it with the URL name from
+unihacks26/urls.py. While a request runs, a database execute wrapper
+(installed on every connection) counts queries and their time, and
+serializers report the time spent in `to_representation` (views that build
+rows by hand wrap them in `serializing()`). Queries slower
+than METRICS['SLOW_QUERY_MS'] are kept by fingerprint: the SQL with its
+literals and IN lists collapsed, so one slow query shape is one entry.
+
+All bookkeeping is a handful of additions under one lock per request.
+The endpoint only answers clients in METRICS['ALLOWED_NETWORKS'].
+"""
+import ipaddress
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hashlib import sha1
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Distinct slow-query fingerprints kept; later new shapes are only logged
+MAX_FINGERPRINTS = 200
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_seconds', 'serializer_seconds', 'serializer_depth', 'slow_seconds', 'slow')
+
+    def __init__(self, slow_seconds):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializer_depth = 0
+        self.slow_seconds = slow_seconds
+        self.slow = []
+
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class ViewStats:
+    __slots__ = ('requests', 'errors', 'latency_sum', 'buckets', 'queries', 'db_seconds', 'serializer_seconds')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.slow_queries = {}      # fingerprint id -> [sql, view, count, total seconds, max seconds]
+
+    def record(self, view, status_code, latency, m):
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound), len(LATENCY_BUCKETS))
+        with self.lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = ViewStats()
+            stats.requests += 1
+            stats.errors += status_code >= 500
+            stats.latency_sum += latency
+            stats.buckets[bucket] += 1
+            stats.queries += m.queries
+            stats.db_seconds += m.db_seconds
+            stats.serializer_seconds += m.serializer_seconds
+            for sql, seconds in m.slow:
+                self._record_slow(view, sql, seconds)
+
+    def _record_slow(self, view, sql, seconds):
+        shape = fingerprint(sql)
+        key = sha1(shape.encode()).hexdigest()[:12]
+        entry = self.slow_queries.get(key)
+        if entry is None:
+            logger.warning("Slow query in %s (%.1f ms) [%s]: %s", view, seconds * 1000, key, shape)
+            if len(self.slow_queries) >= MAX_FINGERPRINTS:
+                return
+            entry = self.slow_queries[key] = [shape, view, 0, 0.0, 0.0]
+        entry[2] += 1
+        entry[3] += seconds
+        entry[4] = max(entry[4], seconds)
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+            self.slow_queries.clear()
+
+    def render(self):
+        """Prometheus text exposition format."""
+        with self.lock:
+            views = {name: (s.requests, s.errors, s.latency_sum, list(s.buckets), s.queries, s.db_seconds,
+                            s.serializer_seconds) for name, s in self.views.items()}
+            slow = {key: list(entry) for key, entry in self.slow_queries.items()}
+
+        lines = [
+            "# HELP rnr_request_seconds Wall-clock latency per view.",
+            "# TYPE rnr_request_seconds histogram",
+        ]
+        for name, (requests, _, latency_sum, buckets, *_rest) in sorted(views.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += count
+                lines.append(f'rnr_request_seconds_bucket{{view="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'rnr_request_seconds_sum{{view="{name}"}} {latency_sum:.6f}')
+            lines.append(f'rnr_request_seconds_count{{view="{name}"}} {requests}')
+
+        for metric, index, kind, help_text in (
+            ("rnr_request_errors_total", 1, "counter", "Responses with a 5xx status per view."),
+            ("rnr_db_queries_total", 4, "counter", "Database queries issued per view."),
+            ("rnr_db_seconds_total", 5, "counter", "Time spent in database queries per view."),
+            ("rnr_serializer_seconds_total", 6, "counter", "Time spent serializing per view."),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            for name, values in sorted(views.items()):
+                value = values[index]
+                lines.append(f'{metric}{{view="{name}"}} {value:.6f}' if isinstance(value, float)
+                             else f'{metric}{{view="{name}"}} {value}')
+
+        lines += [
+            "# HELP rnr_slow_queries_total Queries slower than METRICS['SLOW_QUERY_MS'], by fingerprint.",
+            "# TYPE rnr_slow_queries_total counter",
+        ]
+        for key, (shape, view, count, total, worst) in sorted(slow.items()):
+            sql = shape[:500].replace('\\', '\\\\').replace('"', '\\"')
+            lines.append(f'rnr_slow_queries_total{{fingerprint="{key}",view="{view}",sql="{sql}"}} {count}')
+            lines.append(f'rnr_slow_query_seconds_total{{fingerprint="{key}"}} {total:.6f}')
+            lines.append(f'rnr_slow_query_max_seconds{{fingerprint="{key}"}} {worst:.6f}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """SQL shape: literals become ?, IN lists become (...)."""
+    shape = _LITERALS.sub("?", sql)
+    shape = _IN_LISTS.sub("(...)", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    m = _current.get()
+    if m is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        m.queries += 1
+        m.db_seconds += elapsed
+        if elapsed >= m.slow_seconds:
+            m.slow.append((sql, elapsed))
+
+
+def _install_wrapper(sender, connection, **kwargs):
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+connection_created.connect(_install_wrapper)
+
+
+@contextmanager
+def serializing():
+    """Count the block as serializer time; nested blocks are counted once."""
+    m = _current.get()
+    if m is None:
+        yield
+        return
+    m.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        m.serializer_depth -= 1
+        if not m.serializer_depth:
+            m.serializer_seconds += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """Adds the outermost `to_representation` time to the current request's metrics."""
+
+    def to_representation(self, instance):
+        with serializing():
+            return super().to_representation(instance)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match and match.url_name) or "unmatched"
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, 'METRICS', {}).get('SLOW_QUERY_MS', 200) / 1000
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        m = RequestMetrics(self.slow_seconds)
+        token = _current.set(m)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, started, m)
+        return response
+
+    async def __acall__(self, request):
+        m = RequestMetrics(self.slow_seconds)
+        token = _current.set(m)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, started, m)
+        return response
+
+    def finish(self, request, response, started, m):
+        # Event streams stay open for minutes; their latency means nothing
+        if not response.streaming:
+            registry.record(view_name(request), response.status_code, time.perf_counter() - started, m)
+
+
+def allowed_networks():
+    networks = getattr(settings, 'METRICS', {}).get('ALLOWED_NETWORKS', ['127.0.0.0/8', '::1/128'])
+    return [ipaddress.ip_network(n) for n in networks]
+
+
+def metrics_view(request):
+    try:
+        client = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        client = None
+    if client is None or not any(client in network for network in allowed_networks()):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
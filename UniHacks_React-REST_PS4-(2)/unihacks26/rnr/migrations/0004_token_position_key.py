@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:18
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+POSITION_GAP = 1 << 20
+
+
+def backfill_position_keys(apps, schema_editor):
+    # Existing tokens keep their current order, spread out by the gap.
+    Token = apps.get_model('rnr', 'Token')
+    Token.objects.update(position_key=F('token_number') * POSITION_GAP)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0003_institution_latitude_institution_longitude_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='token',
+            options={'ordering': ['position_key']},
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='position_key',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_position_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:22
+
+from django.db import migrations, models
+
+
+def backfill_counters(apps, schema_editor):
+    # Old renumbering could leave two tokens with the same number in a queue.
+    # Give later duplicates fresh numbers, then seed each queue's counter.
+    Queue = apps.get_model('rnr', 'Queue')
+    Token = apps.get_model('rnr', 'Token')
+    for queue in Queue.objects.all():
+        numbers = list(Token.objects.filter(queue=queue).order_by('id').values_list('id', 'token_number'))
+        last = max((n for _, n in numbers), default=0)
+        seen = set()
+        for token_id, number in numbers:
+            if number in seen:
+                last += 1
+                Token.objects.filter(id=token_id).update(token_number=last)
+            else:
+                seen.add(number)
+        queue.last_token_number = last
+        queue.save(update_fields=['last_token_number'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0004_token_position_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queue',
+            name='last_token_number',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='token',
+            constraint=models.UniqueConstraint(fields=('queue', 'token_number'), name='unique_token_number_per_queue'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0005_queue_last_token_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='token',
+            name='counter',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+    ]
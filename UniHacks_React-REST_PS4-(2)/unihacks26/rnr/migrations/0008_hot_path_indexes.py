@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0007_expiry_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='swaprequest',
+            index=models.Index(fields=['queue', 'status', 'created_at'], name='swap_queue_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='swaprequest',
+            index=models.Index(fields=['receiver', 'status'], name='swap_receiver_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['queue', 'status', 'position_key'], name='token_queue_status_pos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['queue', 'position_key'], name='token_queue_pos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['user', 'status', 'queue'], name='token_user_status_queue_idx'),
+        ),
+    ]
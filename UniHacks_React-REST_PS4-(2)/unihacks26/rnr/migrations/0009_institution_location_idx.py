@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='institution',
+            index=models.Index(fields=['latitude', 'longitude'], name='institution_location_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+
+# SQLite: an external-content FTS5 table with the trigram tokenizer gives
+# indexed, case-insensitive substring search. Triggers keep it in sync.
+# Note that SQLite migrations which rebuild rnr_institution drop these
+# triggers, and any such migration must recreate them.
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE rnr_institution_fts USING fts5(
+        name, address, content='rnr_institution', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER rnr_institution_fts_ai AFTER INSERT ON rnr_institution BEGIN
+        INSERT INTO rnr_institution_fts(rowid, name, address) VALUES (new.id, new.name, new.address);
+    END""",
+    """CREATE TRIGGER rnr_institution_fts_ad AFTER DELETE ON rnr_institution BEGIN
+        INSERT INTO rnr_institution_fts(rnr_institution_fts, rowid, name, address)
+        VALUES ('delete', old.id, old.name, old.address);
+    END""",
+    """CREATE TRIGGER rnr_institution_fts_au AFTER UPDATE OF name, address ON rnr_institution BEGIN
+        INSERT INTO rnr_institution_fts(rnr_institution_fts, rowid, name, address)
+        VALUES ('delete', old.id, old.name, old.address);
+        INSERT INTO rnr_institution_fts(rowid, name, address) VALUES (new.id, new.name, new.address);
+    END""",
+    "INSERT INTO rnr_institution_fts(rnr_institution_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS rnr_institution_fts_ai",
+    "DROP TRIGGER IF EXISTS rnr_institution_fts_ad",
+    "DROP TRIGGER IF EXISTS rnr_institution_fts_au",
+    "DROP TABLE IF EXISTS rnr_institution_fts",
+]
+
+# Postgres: trigram GIN indexes on UPPER(...), which is what icontains compiles to.
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS rnr_institution_name_trgm ON rnr_institution USING gin (UPPER(name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS rnr_institution_address_trgm ON rnr_institution USING gin (UPPER(address) gin_trgm_ops)",
+]
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS rnr_institution_name_trgm",
+    "DROP INDEX IF EXISTS rnr_institution_address_trgm",
+]
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0009_institution_location_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0010_institution_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queue',
+            name='service_mean_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='queue',
+            name='service_var_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='queue',
+            name='service_samples',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='queue',
+            name='last_served_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
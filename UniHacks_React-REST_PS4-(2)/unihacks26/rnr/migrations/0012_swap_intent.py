@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0011_service_time_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SwapIntent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('side', models.CharField(choices=[('FORWARD', 'Forward'), ('BACKWARD', 'Backward')], max_length=10)),
+                ('points', models.IntegerField()),
+                ('status', models.CharField(choices=[('OPEN', 'Open'), ('MATCHED', 'Matched'), ('CANCELLED', 'Cancelled')], default='OPEN', max_length=10)),
+                ('price', models.IntegerField(blank=True, null=True)),
+                ('matched_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('matched_with', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='rnr.token')),
+                ('queue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='swap_intents', to='rnr.queue')),
+                ('token', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='swap_intents', to='rnr.token')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['queue', 'status'], name='intent_queue_status_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'OPEN')), fields=('token',), name='one_open_intent_per_token')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_balances(apps, schema_editor):
+    # Seed the ledger with existing balances so it sums to reward_points
+    UserMe = apps.get_model('rnr', 'UserMe')
+    RewardLedger = apps.get_model('rnr', 'RewardLedger')
+    RewardLedger.objects.bulk_create(
+        (RewardLedger(user_id=user_id, delta=points, reason='opening_balance')
+         for user_id, points in UserMe.objects.exclude(reward_points=0).values_list('id', 'reward_points').iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0012_swap_intent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RewardLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('reason', models.CharField(max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reward_entries', to='rnr.userme')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created_at'], name='ledger_user_created_idx')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
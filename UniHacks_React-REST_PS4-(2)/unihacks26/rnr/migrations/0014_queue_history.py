@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0013_reward_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QueueEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.IntegerField()),
+                ('queue_id', models.IntegerField()),
+                ('token_id', models.IntegerField()),
+                ('user_id', models.IntegerField()),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Booked'), (2, 'Called'), (3, 'Confirmed'), (4, 'Expired'), (5, 'Snoozed'), (6, 'Swapped'), (7, 'Cancelled'), (8, 'Moved')])),
+                ('at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket', 'queue_id'], name='event_bucket_queue_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='QueueHourlyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue_id', models.IntegerField()),
+                ('bucket', models.IntegerField()),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Booked'), (2, 'Called'), (3, 'Confirmed'), (4, 'Expired'), (5, 'Snoozed'), (6, 'Swapped'), (7, 'Cancelled'), (8, 'Moved')])),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('queue_id', 'bucket', 'kind'), name='hourly_stat_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0014_queue_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('arrivals', models.IntegerField(default=0)),
+                ('wait_seconds', models.FloatField(default=0)),
+                ('waits', models.IntegerField(default=0)),
+                ('calls', models.IntegerField(default=0)),
+                ('no_shows', models.IntegerField(default=0)),
+                ('swaps', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['joined_at'], name='token_joined_idx'),
+        ),
+        migrations.AddField(
+            model_name='queuerollup',
+            name='queue',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='rnr.queue'),
+        ),
+        migrations.AddConstraint(
+            model_name='queuerollup',
+            constraint=models.UniqueConstraint(fields=('queue', 'granularity', 'start'), name='queue_rollup_unique'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0015_queue_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SwapRequestArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('queue_id', models.IntegerField()),
+                ('sender_id', models.BigIntegerField()),
+                ('receiver_id', models.BigIntegerField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('ACCEPTED', 'Accepted'), ('REJECTED', 'Rejected')], max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['queue_id', 'created_at'], name='swap_archive_queue_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TokenArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('user_id', models.IntegerField()),
+                ('queue_id', models.IntegerField()),
+                ('token_number', models.IntegerField()),
+                ('status', models.CharField(choices=[('WAITING', 'Waiting'), ('CALLING', 'Calling'), ('COMPLETED', 'Completed'), ('SKIPPED', 'Skipped')], max_length=20)),
+                ('swaps_used', models.IntegerField(default=0)),
+                ('joined_at', models.DateTimeField()),
+                ('called_at', models.DateTimeField(blank=True, null=True)),
+                ('counter', models.CharField(blank=True, max_length=50, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_id', 'id'], name='token_archive_user_idx'), models.Index(fields=['queue_id', 'joined_at'], name='token_archive_queue_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:58
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_active(apps, schema_editor):
+    Queue = apps.get_model('rnr', 'Queue')
+    Token = apps.get_model('rnr', 'Token')
+    active = (
+        Token.objects.filter(queue=models.OuterRef('pk'), status__in=['WAITING', 'CALLING'])
+        .values('queue').annotate(n=models.Count('id')).values('n')
+    )
+    Queue.objects.update(active_count=Coalesce(models.Subquery(active), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rnr', '0016_archive_tables'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='token',
+            name='unique_token_number_per_queue',
+        ),
+        migrations.AddField(
+            model_name='queue',
+            name='active_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='queue',
+            name='epoch',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='queue',
+            name='epoch_started_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='token',
+            name='epoch',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='tokenarchive',
+            name='epoch',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddConstraint(
+            model_name='token',
+            constraint=models.UniqueConstraint(fields=('queue', 'epoch', 'token_number'), name='unique_token_number_per_epoch'),
+        ),
+        migrations.RunPython(count_active, migrations.RunPython.noop),
+    ]
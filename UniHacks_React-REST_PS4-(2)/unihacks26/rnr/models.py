@@ -5,6 +5,18 @@ from django.db import models
 from django.utils import timezone
 
 
+# Spacing between consecutive sort keys. A token can be slotted between two
+# neighbours ~20 times before the queue needs a rebalance.
+POSITION_GAP = 1 << 20
+
+# How long a called token has to confirm, and a swap request to be answered.
+CALL_CONFIRM_WINDOW = timezone.timedelta(seconds=60)
+SWAP_REQUEST_TTL = timezone.timedelta(minutes=5)
+
+# Tokens still in line (waiting, or called and not yet confirmed).
+ACTIVE_STATUSES = ['WAITING', 'CALLING']
+
+
 
 
 # USER MODEL (Normal User)
@@ -16,6 +28,7 @@ class UserMe(models.Model):
     name = models.CharField(max_length=100)
     email = models.EmailField(unique=True)
     password = models.CharField(max_length=200)  # store hashed
+    # Running balance of RewardLedger; only changed through rnr/rewards.py
     reward_points = models.IntegerField(default=0)
 
 
@@ -30,6 +43,27 @@ class UserMe(models.Model):
 
 
 
+# REWARD LEDGER (append-only; UserMe.reward_points is its running total)
+
+
+class RewardLedger(models.Model):
+
+    user = models.ForeignKey(UserMe, on_delete=models.CASCADE, related_name="reward_entries")
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.delta:+d} ({self.reason})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='ledger_user_created_idx'),
+        ]
+
+
+
+
 #  INSTITUTION (Admin Model)
 
 
@@ -53,6 +87,13 @@ class Institution(models.Model):
         return self.name
 
 
+    class Meta:
+        indexes = [
+            # Bounding-box prefilter for discovery
+            models.Index(fields=['latitude', 'longitude'], name='institution_location_idx'),
+        ]
+
+
 
 
 # QUEUE
@@ -83,6 +124,24 @@ class Queue(models.Model):
     max_swaps_per_user = models.IntegerField(default=2)
 
 
+    # Numbering session (e.g. one per day). Rollover (rnr/rollover.py) starts
+    # a new epoch: numbering restarts and the old epoch's tokens are closed.
+    epoch = models.PositiveIntegerField(default=1)
+    epoch_started_at = models.DateTimeField(default=timezone.now)
+    # Last token number handed out in this epoch; bumped atomically by book_token_api
+    last_token_number = models.IntegerField(default=0)
+    # WAITING + CALLING tokens in this epoch; capacity is checked against it
+    active_count = models.IntegerField(default=0)
+
+
+    # Observed seconds per token, as an exponentially weighted mean/variance
+    # (rnr/eta.py). Updated on every call; `service_time_minutes` is the prior.
+    service_mean_seconds = models.FloatField(null=True, blank=True)
+    service_var_seconds = models.FloatField(default=0)
+    service_samples = models.IntegerField(default=0)
+    last_served_at = models.DateTimeField(null=True, blank=True)
+
+
     created_at = models.DateTimeField(auto_now_add=True)
 
 
@@ -110,7 +169,11 @@ class Token(models.Model):
     queue = models.ForeignKey(Queue, on_delete=models.CASCADE, related_name="tokens")
 
 
+    epoch = models.PositiveIntegerField(default=1)
     token_number = models.IntegerField()
+    # Sparse sort key: the line order. The displayed position is derived on
+    # read (rank among WAITING tokens), so cancels/moves only touch one row.
+    position_key = models.BigIntegerField(default=0)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='WAITING')
 
 
@@ -119,13 +182,18 @@ class Token(models.Model):
 
     joined_at = models.DateTimeField(auto_now_add=True)
     called_at = models.DateTimeField(null=True, blank=True)
+    # Service counter the token was called to (multi-counter halls)
+    counter = models.CharField(max_length=50, null=True, blank=True)
+    # Marks the rows of one batch call while it is being claimed (views.claim_next_tokens)
+    claim = models.UUIDField(null=True, blank=True, editable=False)
+    completed_at = models.DateTimeField(null=True, blank=True)
 
 
     def is_call_expired(self):
         if not self.called_at:
             return False
         # 60 second window for the "Confirmation Call"
-        expiry_time = self.called_at + timezone.timedelta(seconds=60)
+        expiry_time = self.called_at + CALL_CONFIRM_WINDOW
         return timezone.now() > expiry_time
 
 
@@ -134,7 +202,22 @@ class Token(models.Model):
 
 
     class Meta:
-        ordering = ['token_number']
+        ordering = ['position_key']
+        constraints = [
+            models.UniqueConstraint(fields=['queue', 'epoch', 'token_number'], name='unique_token_number_per_epoch'),
+        ]
+        indexes = [
+            # The line itself: heads, ranks, neighbours, batch calls
+            models.Index(fields=['queue', 'status', 'position_key'], name='token_queue_status_pos_idx'),
+            # Tail lookups (max key over the whole queue)
+            models.Index(fields=['queue', 'position_key'], name='token_queue_pos_idx'),
+            # "Does this user already hold a token here?" and the user dashboard
+            models.Index(fields=['user', 'status', 'queue'], name='token_user_status_queue_idx'),
+            # Expiry sweeper: CALLING tokens past the confirmation window
+            models.Index(fields=['status', 'called_at'], name='token_status_called_idx'),
+            # Analytics rollups read arrivals by time window
+            models.Index(fields=['joined_at'], name='token_joined_idx'),
+        ]
 
 
 
@@ -181,9 +264,199 @@ class SwapRequest(models.Model):
 
     
     def is_expired(self):
-        expiry_time = self.created_at + timedelta(minutes=5)
+        expiry_time = self.created_at + SWAP_REQUEST_TTL
         return timezone.now() > expiry_time
 
     def __str__(self):
         return f"Swap [{self.status}]: {self.sender.token_number} <-> {self.receiver.token_number}"
 
+    class Meta:
+        indexes = [
+            # Swap capacity checks and incoming requests on the dashboard
+            models.Index(fields=['queue', 'status', 'created_at'], name='swap_queue_status_idx'),
+            models.Index(fields=['receiver', 'status'], name='swap_receiver_status_idx'),
+            # Expiry sweeper: PENDING requests older than the TTL
+            models.Index(fields=['status', 'created_at'], name='swap_status_created_idx'),
+        ]
+
+
+
+
+
+# SWAP INTENT (batched by the matcher, rnr/matching.py)
+
+
+class SwapIntent(models.Model):
+
+    SIDE_CHOICES = (
+        ('FORWARD', 'Forward'),     # wants to move ahead; `points` is the most it will pay
+        ('BACKWARD', 'Backward'),   # willing to move back; `points` is what it asks
+    )
+
+    STATUS_CHOICES = (
+        ('OPEN', 'Open'),
+        ('MATCHED', 'Matched'),
+        ('CANCELLED', 'Cancelled'),
+    )
+
+    queue = models.ForeignKey(Queue, on_delete=models.CASCADE, related_name="swap_intents")
+    token = models.ForeignKey(Token, on_delete=models.CASCADE, related_name="swap_intents")
+
+    side = models.CharField(max_length=10, choices=SIDE_CHOICES)
+    points = models.IntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='OPEN')
+
+    # Filled in by the matcher
+    matched_with = models.ForeignKey(Token, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    price = models.IntegerField(null=True, blank=True)
+    matched_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Intent [{self.side} {self.points}]: {self.token.token_number}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['token'], condition=models.Q(status='OPEN'), name='one_open_intent_per_token'),
+        ]
+        indexes = [
+            models.Index(fields=['queue', 'status'], name='intent_queue_status_idx'),
+        ]
+
+
+
+
+# QUEUE HISTORY (append-only; written in batches by rnr/history.py)
+# Ids are plain integers rather than foreign keys: inserts do no constraint
+# checks, and the history outlives the tokens it describes.
+
+
+def hour_bucket(dt):
+    """Hours since the epoch; history rows are indexed, reported and pruned by it."""
+    return int(dt.timestamp()) // 3600
+
+
+class QueueEvent(models.Model):
+
+    BOOKED, CALLED, CONFIRMED, EXPIRED, SNOOZED, SWAPPED, CANCELLED, MOVED = range(1, 9)
+    KIND_CHOICES = (
+        (BOOKED, 'Booked'),
+        (CALLED, 'Called'),
+        (CONFIRMED, 'Confirmed'),
+        (EXPIRED, 'Expired'),       # missed the confirmation window
+        (SNOOZED, 'Snoozed'),
+        (SWAPPED, 'Swapped'),
+        (CANCELLED, 'Cancelled'),
+        (MOVED, 'Moved'),
+    )
+
+    bucket = models.IntegerField()
+    queue_id = models.IntegerField()
+    token_id = models.IntegerField()
+    user_id = models.IntegerField()
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.get_kind_display()} token {self.token_id} (queue {self.queue_id})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bucket', 'queue_id'], name='event_bucket_queue_idx'),
+        ]
+
+
+class QueueHourlyStat(models.Model):
+    """Events per queue, hour and kind; maintained by `history.rollup()`."""
+
+    queue_id = models.IntegerField()
+    bucket = models.IntegerField()
+    kind = models.PositiveSmallIntegerField(choices=QueueEvent.KIND_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['queue_id', 'bucket', 'kind'], name='hourly_stat_unique'),
+        ]
+
+
+class RollupCursor(models.Model):
+    """How far an incremental job has read (e.g. the last QueueEvent id folded in)."""
+
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+
+class QueueRollup(models.Model):
+    """Pre-aggregated queue analytics per hour or day (built by rnr/analytics.py)."""
+
+    GRANULARITY_CHOICES = (
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    )
+
+    queue = models.ForeignKey(Queue, on_delete=models.CASCADE, related_name="rollups")
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    start = models.DateTimeField()
+
+    arrivals = models.IntegerField(default=0)
+    # Waits of tokens that arrived in this bucket and have been called
+    wait_seconds = models.FloatField(default=0)
+    waits = models.IntegerField(default=0)
+    calls = models.IntegerField(default=0)
+    no_shows = models.IntegerField(default=0)
+    swaps = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['queue', 'granularity', 'start'], name='queue_rollup_unique'),
+        ]
+
+
+
+
+
+# ARCHIVE (finished tokens and resolved swap requests; moved by rnr/archive.py)
+# Same columns as the live tables, keeping the original ids, with plain
+# integers in place of foreign keys.
+
+
+class TokenArchive(models.Model):
+
+    id = models.BigIntegerField(primary_key=True)
+    user_id = models.IntegerField()
+    queue_id = models.IntegerField()
+    epoch = models.PositiveIntegerField(default=1)
+    token_number = models.IntegerField()
+    status = models.CharField(max_length=20, choices=Token.STATUS_CHOICES)
+    swaps_used = models.IntegerField(default=0)
+    joined_at = models.DateTimeField()
+    called_at = models.DateTimeField(null=True, blank=True)
+    counter = models.CharField(max_length=50, null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'id'], name='token_archive_user_idx'),
+            models.Index(fields=['queue_id', 'joined_at'], name='token_archive_queue_idx'),
+        ]
+
+
+class SwapRequestArchive(models.Model):
+
+    id = models.BigIntegerField(primary_key=True)
+    queue_id = models.IntegerField()
+    sender_id = models.BigIntegerField()
+    receiver_id = models.BigIntegerField()
+    status = models.CharField(max_length=20, choices=SwapRequest.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue_id', 'created_at'], name='swap_archive_queue_idx'),
+        ]
@@ -0,0 +1,40 @@
+"""
+Reward points.
+
+Every change is an append-only RewardLedger row plus one F() UPDATE of
+`UserMe.reward_points`, the ledger's running total. The UPDATE is computed
+by the database, so concurrent credits cannot overwrite each other, and
+only that one column is written. Debits that must not overdraw go through
+`charge()`, which locks the balance first.
+"""
+from django.db import models, transaction
+
+from .models import UserMe, RewardLedger
+
+
+def credit(deltas, reason):
+    """Apply {user_id: delta} in one INSERT and one UPDATE."""
+    deltas = {uid: delta for uid, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    with transaction.atomic():
+        RewardLedger.objects.bulk_create(
+            RewardLedger(user_id=uid, delta=delta, reason=reason) for uid, delta in deltas.items()
+        )
+        UserMe.objects.filter(id__in=deltas).update(reward_points=models.Case(
+            *[models.When(id=uid, then=models.F('reward_points') + delta) for uid, delta in deltas.items()],
+        ))
+
+
+def charge(user_id, points, reason):
+    """Debit up to `points`, never below zero. Returns the amount taken."""
+    with transaction.atomic():
+        balance = UserMe.objects.select_for_update().values_list('reward_points', flat=True).get(id=user_id)
+        taken = min(points, max(balance, 0))
+        credit({user_id: -taken}, reason)
+    return taken
+
+
+def balances(user_ids):
+    """{user_id: points} for many users in one query."""
+    return dict(UserMe.objects.filter(id__in=user_ids).values_list('id', 'reward_points'))
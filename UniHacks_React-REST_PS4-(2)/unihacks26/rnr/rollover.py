@@ -0,0 +1,88 @@
+"""
+Queue epochs: numbering sessions that restart.
+
+A queue numbers its tokens 1, 2, 3... within its current `epoch`, and
+`Queue.size` caps the tokens in line, not the numbers handed out. The views
+keep `Queue.active_count` current (+1 on booking, -1 when a token is
+completed or cancelled), so the capacity check in book_token_api stays a
+single conditional UPDATE.
+
+`rollover()` ends the epoch: tokens still in line are closed as SKIPPED,
+pending swap requests and open intents are dropped, and numbering and the
+counter restart. Each step is one set-based statement on the queue's rows.
+Tokens of closed epochs are archived by the next `archive_tokens` run
+whatever their age (rnr/archive.py).
+
+Manual: POST /api/queue/rollover/<id>/. Scheduled: run
+`python manage.py rollover_queues` shortly after midnight, or let
+`run_rollover` do it inside the server (BACKGROUND_JOBS, rnr/jobs.py).
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.db import transaction, models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .engine import get_engine
+from .events import emit
+from .models import Queue, Token, SwapRequest, SwapIntent, ACTIVE_STATUSES
+
+
+logger = logging.getLogger(__name__)
+
+
+def rollover(queue_id, now=None):
+    """Start the queue's next epoch. Returns (new epoch, tokens closed)."""
+    now = now or timezone.now()
+    engine = get_engine()
+    managed = engine is not None and engine.manages(queue_id)
+    if managed:
+        engine.flush()
+    with transaction.atomic():
+        # The row lock holds off bookings until the new epoch is in place
+        epoch = Queue.objects.select_for_update().values_list('epoch', flat=True).get(id=queue_id)
+        open_tokens = Token.objects.filter(queue_id=queue_id, epoch=epoch, status__in=ACTIVE_STATUSES)
+        closed = list(open_tokens.values_list('id', 'user_id'))
+        open_tokens.update(status='SKIPPED')
+        SwapRequest.objects.filter(queue_id=queue_id, status='PENDING').update(status='REJECTED')
+        SwapIntent.objects.filter(queue_id=queue_id, status='OPEN').update(status='CANCELLED')
+        Queue.objects.filter(id=queue_id).update(
+            epoch=epoch + 1, epoch_started_at=now, last_token_number=0, active_count=0,
+        )
+        emit("queue_rolled_over", queue_id, [user_id for _, user_id in closed],
+             tokens=[token_id for token_id, _ in closed], epoch=epoch + 1)
+    if managed:
+        engine.reload(queue_id)
+    return epoch + 1, len(closed)
+
+
+def rollover_due(now=None):
+    """Roll over every queue whose epoch began before today's (local) midnight."""
+    now = now or timezone.now()
+    midnight = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    due = Queue.objects.filter(epoch_started_at__lt=midnight).order_by('id').values_list('id', flat=True)
+    return {queue_id: rollover(queue_id, now) for queue_id in due}
+
+
+async def run_rollover(interval=60.0):
+    """Roll over due queues, checking every `interval` seconds."""
+    while True:
+        try:
+            rolled = await sync_to_async(rollover_due)()
+            if rolled:
+                logger.info("Rolled over %d queues", len(rolled))
+        except Exception:
+            logger.exception("Queue rollover failed")
+        await asyncio.sleep(interval)
+
+
+def recount_active(queue_ids=None):
+    """Recompute `active_count` from the tokens, e.g. after rows were edited by hand."""
+    active = (
+        Token.objects.filter(queue=models.OuterRef('pk'), epoch=models.OuterRef('epoch'), status__in=ACTIVE_STATUSES)
+        .values('queue').annotate(n=models.Count('id')).values('n')
+    )
+    queues = Queue.objects.all() if queue_ids is None else Queue.objects.filter(id__in=queue_ids)
+    return queues.update(active_count=Coalesce(models.Subquery(active), 0))
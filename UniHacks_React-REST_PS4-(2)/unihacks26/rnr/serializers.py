@@ -1,14 +1,16 @@
 from rest_framework import serializers
+from .metrics import TimedSerializerMixin
 from .models import UserMe, Institution, Queue, Token
+from .snapshots import get_snapshot
 
 
-class UserMeSerializer(serializers.ModelSerializer):
+class UserMeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = UserMe
         fields = ['id', 'name', 'email', 'reward_points']
 
 
-class QueueSerializer(serializers.ModelSerializer):
+class QueueSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     active_tokens = serializers.SerializerMethodField()
 
     class Meta:
@@ -16,18 +18,20 @@ class QueueSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'size', 'service_time_minutes', 'is_paused', 'is_closed', 'active_tokens']
 
     def get_active_tokens(self, obj):
-        return obj.tokens.filter(status__in=['WAITING', 'CALLING']).count()
+        # Callers serializing many queues fetch their snapshots in one go
+        snapshot = self.context.get('snapshots', {}).get(obj.id) or get_snapshot(obj.id)
+        return snapshot["active"] if snapshot else 0
 
 
-class InstitutionSerializer(serializers.ModelSerializer):
+class InstitutionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     queues = QueueSerializer(many=True, read_only=True)
     class Meta:
         model = Institution
         fields = ['id', 'name', 'email', 'phone', 'address', 'queues']
 
 
-class TokenSerializer(serializers.ModelSerializer):
+class TokenSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user_name = serializers.ReadOnlyField(source='user.name')
     class Meta:
         model = Token
-        fields = ['id', 'user', 'user_name', 'queue', 'token_number', 'status', 'joined_at']
+        fields = ['id', 'user', 'user_name', 'queue', 'token_number', 'status', 'counter', 'joined_at']
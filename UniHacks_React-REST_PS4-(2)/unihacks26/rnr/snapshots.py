@@ -0,0 +1,97 @@
+"""
+Cached per-queue snapshots.
+
+Read endpoints keep asking the same questions of each queue: who is being
+served, how many are waiting, how long is the wait. The answers live in one
+compact cache record per queue:
+
+    {"waiting": 12, "active": 14, "serving": 31, "head": 207, "eta_minutes": 60}
+
+Every queue change goes through `events.emit()`, which calls `invalidate()`,
+so the next read rebuilds the record. Records also expire after SNAPSHOT_TTL
+as a safety net for writes made outside the views (admin, shell).
+"""
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+
+from .eta import estimate
+from .models import Queue, Token, ACTIVE_STATUSES
+
+
+SNAPSHOT_TTL = 300
+
+
+def snapshot_key(queue_id):
+    return f"queue-snapshot:{queue_id}"
+
+
+def snapshot_rows(queue_ids):
+    """One query computing the snapshot fields of every queue in `queue_ids`."""
+    head = Token.objects.filter(
+        queue=models.OuterRef('pk'), status='WAITING'
+    ).order_by('position_key')
+    return Queue.objects.filter(id__in=queue_ids).annotate(
+        waiting=models.Count('tokens', filter=models.Q(tokens__status='WAITING')),
+        active=models.Count('tokens', filter=models.Q(tokens__status__in=ACTIVE_STATUSES)),
+        serving=Coalesce(models.Subquery(head.values('token_number')[:1]), 0),
+        head=models.Subquery(head.values('id')[:1]),
+    ).values(
+        'id', 'waiting', 'active', 'serving', 'head', 'service_time_minutes',
+        'service_mean_seconds', 'service_var_seconds', 'service_samples',
+    )
+
+
+def to_snapshot(q):
+    return {
+        "waiting": q['waiting'],
+        "active": q['active'],
+        "serving": q['serving'],
+        "head": q['head'],
+        "eta_minutes": estimate(q, q['waiting'])["minutes"],
+    }
+
+
+def build_snapshots(queue_ids):
+    """Compute snapshots for `queue_ids` straight from the database, in one query."""
+    return {q['id']: to_snapshot(q) for q in snapshot_rows(queue_ids)}
+
+
+def get_snapshots(queue_ids):
+    """Snapshots keyed by queue id; misses are rebuilt together and cached."""
+    queue_ids = list(dict.fromkeys(queue_ids))
+    cached = cache.get_many([snapshot_key(qid) for qid in queue_ids])
+    result = {qid: cached[snapshot_key(qid)] for qid in queue_ids if snapshot_key(qid) in cached}
+    missing = [qid for qid in queue_ids if qid not in result]
+    if missing:
+        built = build_snapshots(missing)
+        cache.set_many({snapshot_key(qid): snap for qid, snap in built.items()}, SNAPSHOT_TTL)
+        result.update(built)
+    return result
+
+
+async def aget_snapshots(queue_ids):
+    """`get_snapshots` for async views (rnr/async_views.py)."""
+    queue_ids = list(dict.fromkeys(queue_ids))
+    cached = await cache.aget_many([snapshot_key(qid) for qid in queue_ids])
+    result = {qid: cached[snapshot_key(qid)] for qid in queue_ids if snapshot_key(qid) in cached}
+    missing = [qid for qid in queue_ids if qid not in result]
+    if missing:
+        built = {q['id']: to_snapshot(q) async for q in snapshot_rows(missing)}
+        await cache.aset_many({snapshot_key(qid): snap for qid, snap in built.items()}, SNAPSHOT_TTL)
+        result.update(built)
+    return result
+
+
+def get_snapshot(queue_id):
+    return get_snapshots([queue_id]).get(queue_id)
+
+
+def invalidate(queue_id):
+    """
+    Drop the queue's snapshot now and again once the transaction commits, so a
+    reader that rebuilt it from pre-commit data cannot leave it stale.
+    """
+    key = snapshot_key(queue_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key), robust=True)
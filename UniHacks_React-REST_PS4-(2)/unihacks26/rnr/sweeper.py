@@ -0,0 +1,75 @@
+"""
+Set-based expiry of stale swap requests and unanswered calls.
+
+Run `python manage.py sweep_expired` from cron, or `--loop` to keep an
+asyncio loop sweeping every few seconds. In engine mode the sweep runs
+inside the server process instead (BACKGROUND_JOBS, rnr/jobs.py).
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.db import transaction, models
+from django.utils import timezone
+
+from .engine import get_engine
+from .events import emit
+from .models import Queue, Token, SwapRequest, CALL_CONFIRM_WINDOW, SWAP_REQUEST_TTL, POSITION_GAP
+
+
+logger = logging.getLogger(__name__)
+
+
+def expire_swap_requests(now=None):
+    """Reject PENDING swap requests older than the TTL. Returns the count."""
+    cutoff = (now or timezone.now()) - SWAP_REQUEST_TTL
+    return SwapRequest.objects.filter(status='PENDING', created_at__lt=cutoff).update(status='REJECTED')
+
+
+def expire_called_tokens(now=None):
+    """
+    Send CALLING tokens that missed the confirmation window to the back of
+    their queue, keeping their relative order. One UPDATE per affected queue.
+    """
+    cutoff = (now or timezone.now()) - CALL_CONFIRM_WINDOW
+    engine = get_engine()
+    if engine is not None:
+        engine.flush()
+    expired = Token.objects.filter(status='CALLING', called_at__lt=cutoff)
+    moved = 0
+    for queue_id in expired.values_list('queue', flat=True).distinct().order_by():
+        with transaction.atomic():
+            # The queue's row lock serializes this with snoozes and moves (views.lock_queue)
+            Queue.objects.select_for_update().values_list('id', flat=True).get(id=queue_id)
+            stale = expired.filter(queue_id=queue_id)
+            tokens = list(stale.values_list('id', 'user_id', 'position_key'))
+            if not tokens:
+                continue
+            tail = Token.objects.filter(queue_id=queue_id).aggregate(last=models.Max('position_key'))['last']
+            shift = tail + POSITION_GAP - min(t[2] for t in tokens)
+            token_ids = [t[0] for t in tokens]
+            moved += Token.objects.filter(id__in=token_ids, status='CALLING').update(
+                status='WAITING', called_at=None, counter=None,
+                position_key=models.F('position_key') + shift,
+            )
+            emit("calls_expired", queue_id, [t[1] for t in tokens], tokens=token_ids)
+        if engine is not None and engine.manages(queue_id):
+            engine.reload(queue_id)
+    return moved
+
+
+def sweep(now=None):
+    now = now or timezone.now()
+    return {"swaps": expire_swap_requests(now), "calls": expire_called_tokens(now)}
+
+
+async def run_sweeper(interval=5.0):
+    """Sweep forever, every `interval` seconds."""
+    while True:
+        try:
+            result = await sync_to_async(sweep)()
+            if any(result.values()):
+                logger.info("Expired %(swaps)d swap requests and %(calls)d calls", result)
+        except Exception:
+            logger.exception("Expiry sweep failed")
+        await asyncio.sleep(interval)
@@ -1,3 +1,1153 @@
-from django.test import TestCase
+import asyncio
+import bisect
+import json
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, models
+from django.test import AsyncRequestFactory, Client, TestCase, TransactionTestCase, override_settings
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from seed_queues import seed_bulk
+
+from . import async_views, jobs
+from .analytics import build_rollups, day_floor
+from .archive import archive
+from .auth import issue_tokens
+from .engine import IndexableSkipList, QueueEngine
+from .eta import estimate, record_calls
+from .events import InProcessBroker, queue_channel, user_channel
+from .history import EventWriter, get_writer, prune, rollup_all
+from .matching import match_all, plan_matches
+from .metrics import fingerprint, registry
+from .models import (
+    UserMe, Institution, Queue, Token, SwapRequest, SwapIntent, RewardLedger, QueueEvent, QueueHourlyStat,
+    QueueRollup, TokenArchive, SwapRequestArchive, POSITION_GAP, hour_bucket,
+)
+from .rewards import charge, credit
+from .rollover import recount_active, rollover, rollover_due
+from .snapshots import get_snapshot
+from .sweeper import sweep
+from .views import next_tail_key
+
+
+# The concurrency tests make SQLite slow on purpose; tests that check slow-query logging lower this again
+quiet_metrics = override_settings(METRICS={**settings.METRICS, 'SLOW_QUERY_MS': 60_000})
+
+
+def setUpModule():
+    quiet_metrics.enable()
+
+
+def tearDownModule():
+    quiet_metrics.disable()
+    # History buffered by earlier tests would be flushed at exit, after the test database is gone
+    get_writer().pending.clear()
+
+
+def make_queue(size=100, **kwargs):
+    inst = Institution.objects.create(name="Clinic", email=f"clinic{Institution.objects.count()}@x.com",
+                                      phone="123", password="x")
+    return Queue.objects.create(institution=inst, name="General", size=size, **kwargs)
+
+
+def make_user(n):
+    return UserMe.objects.create(name=f"User {n}", email=f"user{n}@x.com", password="x")
+
+
+def auth(account):
+    """Authorization header with a real access token for a UserMe or an Institution."""
+    role = 'institution' if isinstance(account, Institution) else 'user'
+    return {"HTTP_AUTHORIZATION": f"Bearer {issue_tokens(role, account)['access']}"}
+
+
+class QueuePositionTests(TestCase):
+
+    def setUp(self):
+        self.queue = make_queue()
+        self.tokens = []
+        for n in range(1, 6):
+            res = self.client.post(reverse('book_token'), {"queue_id": self.queue.id}, **auth(make_user(n)))
+            self.tokens.append(Token.objects.select_related('user').get(id=res.data['id']))
+
+    def line(self):
+        return list(Token.objects.filter(queue=self.queue, status='WAITING').values_list('id', flat=True))
+
+    def manage(self, token, action, **extra):
+        return self.client.post(reverse('token_manage'), {"token_id": token.id, "action": action, **extra},
+                                **auth(token.user))
+
+    def writes(self, queries):
+        return [q['sql'] for q in queries if q['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))]
+
+    def test_cancel_writes_single_row(self):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.manage(self.tokens[1], "CANCEL")
+        self.assertEqual(res.status_code, 200)
+        # The token row, plus the queue's active count
+        writes = self.writes(ctx.captured_queries)
+        self.assertEqual([w.split()[1] for w in writes], ['"rnr_token"', '"rnr_queue"'])
+        self.assertEqual(self.line(), [t.id for t in self.tokens if t != self.tokens[1]])
+
+    def test_move_back_slots_between_neighbours(self):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.manage(self.tokens[0], "MOVE_BACK", target_position=3)
+        self.assertEqual(len(self.writes(ctx.captured_queries)), 1)
+        self.assertEqual(res.data['message'], "Moved back to position 3.")
+        ids = [t.id for t in self.tokens]
+        self.assertEqual(self.line(), [ids[1], ids[2], ids[0], ids[3], ids[4]])
+
+    def test_move_back_past_end_goes_to_tail(self):
+        self.manage(self.tokens[0], "MOVE_BACK", target_position=50)
+        self.assertEqual(self.line()[-1], self.tokens[0].id)
+
+    def test_repeated_moves_rebalance_when_gap_is_exhausted(self):
+        for _ in range(30):
+            self.manage(Token.objects.filter(queue=self.queue, status='WAITING').select_related('user').first(),
+                        "MOVE_BACK", target_position=2)
+        keys = list(Token.objects.filter(queue=self.queue, status='WAITING').values_list('position_key', flat=True))
+        self.assertEqual(len(set(keys)), 5)
+
+    def test_snooze_moves_to_back(self):
+        self.client.post(reverse('snooze_token', args=[self.tokens[0].id]), **auth(self.tokens[0].user))
+        self.assertEqual(self.line()[-1], self.tokens[0].id)
+
+
+class UserDashboardQueryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.me = make_user(0)
+        others = [make_user(n) for n in range(1, 21)]
+        self.queues = [make_queue() for _ in range(3)]
+        for q in self.queues:
+            for n, u in enumerate(others[:10] + [self.me] + others[10:], start=1):
+                Token.objects.create(user=u, queue=q, token_number=n, position_key=n * POSITION_GAP)
+        mine = Token.objects.get(user=self.me, queue=self.queues[0])
+        sender = Token.objects.get(queue=self.queues[0], token_number=15)
+        SwapRequest.objects.create(queue=self.queues[0], sender=sender, receiver=mine)
+
+    def test_query_count_is_constant(self):
+        # user, tokens (+ranks), uncached queue snapshots, neighbours, incoming swaps
+        with self.assertNumQueries(5):
+            res = self.client.get(reverse('user_dashboard', args=[self.me.id]), **auth(self.me))
+        self.assertEqual(len(res.data), 3)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('user_dashboard', args=[self.me.id]), **auth(self.me))
+
+        extra = make_queue()
+        for n, u in enumerate([make_user(99), self.me], start=1):
+            Token.objects.create(user=u, queue=extra, token_number=n, position_key=n * POSITION_GAP)
+        with self.assertNumQueries(5):
+            res = self.client.get(reverse('user_dashboard', args=[self.me.id]), **auth(self.me))
+        self.assertEqual(len(res.data), 4)
+
+    def test_requires_owner(self):
+        url = reverse('user_dashboard', args=[self.me.id])
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.client.get(url, **auth(make_user(50))).status_code, 403)
+
+    def test_payload(self):
+        first = self.client.get(reverse('user_dashboard', args=[self.me.id]), **auth(self.me)).data[0]
+        self.assertEqual(first["queue_id"], self.queues[0].id)
+        self.assertEqual(first["current_serving"], 1)
+        self.assertEqual(first["position"], 10)
+        self.assertEqual([t["token"] for t in first["swappable_ahead"]], [10, 9, 8, 7, 6])
+        self.assertEqual([t["token"] for t in first["swappable_behind"]], [12, 13, 14, 15, 16])
+        self.assertEqual(first["swappable_behind"][0]["position"], 1)
+        self.assertEqual(first["incoming_swaps"][0]["sender_position"], 14)
+        self.assertEqual(first["incoming_swaps"][0]["sender_name"], "User 14")
+
+
+class InstitutionDashboardTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        first = make_queue()
+        self.inst = first.institution
+        self.queues = [first, Queue.objects.create(institution=self.inst, name="Second", size=100)]
+        users = [make_user(n) for n in range(1, 8)]
+        for q in self.queues:
+            for n, u in enumerate(users, start=1):
+                Token.objects.create(user=u, queue=q, token_number=n, position_key=n * POSITION_GAP)
+        Token.objects.filter(queue=self.queues[0], token_number=7).update(status='COMPLETED')
+
+    def test_bounded_queries_and_head_window(self):
+        # institution, queues, snapshots (cold cache only), head tokens (+users)
+        with self.assertNumQueries(4):
+            res = self.client.get(reverse('inst_dashboard', args=[self.inst.id]), {"limit": 4}, **auth(self.inst))
+        with self.assertNumQueries(3):
+            self.client.get(reverse('inst_dashboard', args=[self.inst.id]), {"limit": 4}, **auth(self.inst))
+        first, second = res.data
+        self.assertEqual(first["active_tokens"], 6)
+        self.assertEqual(first["current_serving"], 1)
+        self.assertEqual(second["active_tokens"], 7)
+        self.assertEqual([t["token_number"] for t in first["tokens"]], [1, 2, 3, 4])
+        self.assertEqual(first["tokens"][0]["user_name"], "User 1")
+        self.assertEqual(first["next_cursor"], 4 * POSITION_GAP)
+
+    def test_cursor_pages_through_queue(self):
+        url = reverse('inst_queue_tokens', args=[self.inst.id, self.queues[0].id])
+        res = self.client.get(url, {"limit": 4, "cursor": 4 * POSITION_GAP}, **auth(self.inst))
+        self.assertEqual([t["token_number"] for t in res.data["tokens"]], [5, 6])
+        self.assertIsNone(res.data["next_cursor"])
+
+
+class LiveEventTests(TestCase):
+
+    def test_call_next_publishes_after_commit(self):
+        queue = make_queue()
+        user = make_user(1)
+        token = Token.objects.create(user=user, queue=queue, token_number=1, position_key=POSITION_GAP)
+        published = []
+        broker = mock.Mock(publish=lambda channel, message: published.append((channel, json.loads(message))))
+        with mock.patch('rnr.events.get_broker', return_value=broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('call_next', args=[queue.id]), **auth(queue.institution))
+        event = {"type": "token_called", "queue": queue.id, "token": token.id, "number": 1, "counter": None}
+        self.assertEqual(published, [(queue_channel(queue.id), event), (user_channel(user.id), event)])
+
+    def test_in_process_broker_delivers_across_threads(self):
+        broker = InProcessBroker()
+
+        async def scenario():
+            events = broker.listen(["queue:1"], idle_timeout=0.05)
+            self.assertIsNone(await anext(events))  # subscribed, nothing yet
+            threading.Thread(target=broker.publish, args=("queue:1", "hello")).start()
+            message = await anext(events)
+            while message is None:
+                message = await anext(events)
+            await events.aclose()
+            return message
+
+        self.assertEqual(asyncio.run(scenario()), "hello")
+        self.assertEqual(broker._subscribers, {})
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    BOOKINGS = int(os.environ.get('BOOKING_LOAD_TEST_SIZE', 2000))
+    WORKERS = 16
+
+    def book_all(self, queue, users):
+        def book(chunk):
+            client = Client()
+            try:
+                return [client.post(reverse('book_token'), {"queue_id": queue.id}, **auth(user)) for user in chunk]
+            finally:
+                connections.close_all()
+
+        chunks = [users[i::self.WORKERS] for i in range(self.WORKERS)]
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            return [res for batch in pool.map(book, chunks) for res in batch]
+
+    def make_users(self, count):
+        UserMe.objects.bulk_create(
+            UserMe(name=f"Load {n}", email=f"load{n}@x.com", password="x") for n in range(count)
+        )
+        return list(UserMe.objects.only('id', 'name'))
+
+    def test_burst_gets_unique_dense_numbers(self):
+        queue = make_queue(size=self.BOOKINGS)
+        responses = self.book_all(queue, self.make_users(self.BOOKINGS))
+
+        self.assertEqual({r.status_code for r in responses}, {201})
+        numbers = sorted(Token.objects.filter(queue=queue).values_list('token_number', flat=True))
+        self.assertEqual(numbers, list(range(1, self.BOOKINGS + 1)))
+        keys = Token.objects.filter(queue=queue).values_list('position_key', flat=True)
+        self.assertEqual(len(set(keys)), self.BOOKINGS)
+        queue.refresh_from_db()
+        self.assertEqual(queue.last_token_number, self.BOOKINGS)
+
+    def test_burst_never_exceeds_size(self):
+        queue = make_queue(size=50)
+        responses = self.book_all(queue, self.make_users(200))
+
+        self.assertEqual(sum(r.status_code == 201 for r in responses), 50)
+        self.assertEqual({r.data.get("error") for r in responses if r.status_code != 201}, {"Queue is full"})
+        self.assertEqual(Token.objects.filter(queue=queue).count(), 50)
+
+    def test_concurrent_snoozes_get_distinct_tail_keys(self):
+        queue = make_queue()
+        tokens = [Token.objects.create(user=u, queue=queue, token_number=n, position_key=n * POSITION_GAP)
+                  for n, u in enumerate(self.make_users(32), start=1)]
+
+        def snooze(token):
+            try:
+                return Client().post(reverse('snooze_token', args=[token.id]), **auth(token.user)).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            self.assertEqual(set(pool.map(snooze, tokens)), {200})
+        keys = Token.objects.filter(queue=queue).values_list('position_key', flat=True)
+        self.assertEqual(len(set(keys)), len(tokens))
+
+
+class CallNextBatchTests(TransactionTestCase):
+
+    def setUp(self):
+        self.queue = make_queue()
+        for n in range(1, 41):
+            Token.objects.create(user=make_user(n), queue=self.queue, token_number=n, position_key=n * POSITION_GAP)
+
+    def call(self, client=None, **params):
+        url = reverse('call_next', args=[self.queue.id])
+        if params:
+            url += '?' + '&'.join(f"{k}={v}" for k, v in params.items())
+        return (client or self.client).post(url, **auth(self.queue.institution))
+
+    def test_batch_spreads_over_counters(self):
+        res = self.call(count=4, counter="A,B")
+        self.assertEqual([(t["token_number"], t["counter"]) for t in res.data["tokens"]],
+                         [(1, "A"), (2, "B"), (3, "A"), (4, "B")])
+        self.assertEqual(self.call().data["token_number"], 5)
+        self.assertFalse(Token.objects.filter(claim__isnull=False).exists())
+
+    def test_rejects_bad_counter_names(self):
+        for counter in ("A" * 51, "claim:1", "A,<b>"):
+            self.assertEqual(self.call(count=2, counter=counter).status_code, 400, counter)
+        self.assertFalse(Token.objects.filter(status='CALLING').exists())
+
+    def test_parallel_counters_never_double_call(self):
+        def press_next(counter):
+            client = Client()
+            try:
+                return [t["id"] for _ in range(3) for t in self.call(client, count=2, counter=counter).data["tokens"]]
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(6) as pool:
+            called = [tid for batch in pool.map(press_next, "ABCDEF") for tid in batch]
+        self.assertEqual(len(called), len(set(called)))
+        self.assertEqual(len(called), Token.objects.filter(queue=self.queue, status='CALLING').count())
+        self.assertEqual(len(called), 36)
+
+
+class ExpirySweeperTests(TestCase):
+
+    def test_sweep_expires_stale_swaps_and_calls(self):
+        queue = make_queue()
+        tokens = [Token.objects.create(user=make_user(n), queue=queue, token_number=n, position_key=n * POSITION_GAP)
+                  for n in range(1, 6)]
+        old = timezone.now() - timezone.timedelta(minutes=10)
+        stale = SwapRequest.objects.create(queue=queue, sender=tokens[4], receiver=tokens[3])
+        SwapRequest.objects.filter(id=stale.id).update(created_at=old)
+        fresh = SwapRequest.objects.create(queue=queue, sender=tokens[3], receiver=tokens[2])
+        Token.objects.filter(id__in=[tokens[0].id, tokens[1].id]).update(status='CALLING', called_at=old)
+
+        self.assertEqual(sweep(), {"swaps": 1, "calls": 2})
+
+        self.assertEqual(SwapRequest.objects.get(id=stale.id).status, 'REJECTED')
+        self.assertEqual(SwapRequest.objects.get(id=fresh.id).status, 'PENDING')
+        line = list(Token.objects.filter(queue=queue, status='WAITING').values_list('token_number', flat=True))
+        self.assertEqual(line, [3, 4, 5, 1, 2])
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), "EXPLAIN assertions cover SQLite and PostgreSQL")
+class HotQueryIndexTests(TestCase):
+    """Every query on the serving path must be an index search, never a table scan."""
+
+    def setUp(self):
+        self.queue = make_queue()
+        self.user = make_user(1)
+        self.token = Token.objects.create(user=self.user, queue=self.queue, token_number=1, position_key=POSITION_GAP)
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be seq-scanned
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index):
+        self.assertPlanUsesIndex(queryset.explain(), index)
+
+    def assertRunsOnIndex(self, func, index):
+        """EXPLAIN the query `func` actually runs."""
+        with CaptureQueriesContext(connection) as ctx:
+            func()
+        with connection.cursor() as cursor:
+            explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+            cursor.execute(explain + ctx.captured_queries[-1]['sql'])
+            plan = "\n".join(" ".join(str(col) for col in row) for row in cursor.fetchall())
+        self.assertPlanUsesIndex(plan, index)
+
+    def assertPlanUsesIndex(self, plan, index):
+        if connection.vendor == 'sqlite':
+            self.assertNotRegex(plan, r"\bSCAN rnr_", plan)
+            self.assertRegex(plan, r"USING (COVERING )?INDEX " + index, plan)
+        else:
+            # Postgres may pick another index with the same prefix; any index will do
+            self.assertNotIn("Seq Scan", plan, plan)
+            self.assertIn("Index", plan, plan)
+
+    def test_line_queries(self):
+        line = Token.objects.filter(queue=self.queue, status='WAITING')
+        self.assertUsesIndex(line.order_by('position_key')[:1], 'token_queue_status_pos_idx')
+        self.assertUsesIndex(line.filter(position_key__lt=POSITION_GAP).values('queue')
+                             .annotate(n=models.Count('id')).order_by(), 'token_queue_status_pos_idx')
+        self.assertUsesIndex(Token.objects.filter(queue=self.queue, status__in=['WAITING', 'CALLING'])
+                             .order_by('position_key'), 'token_queue')
+
+    def test_tail_lookup(self):
+        self.assertRunsOnIndex(lambda: next_tail_key(self.queue), 'token_queue_pos_idx')
+
+    def test_user_lookups(self):
+        self.assertUsesIndex(Token.objects.filter(user=self.user, queue=self.queue, status='WAITING'), 'token_')
+        self.assertUsesIndex(Token.objects.filter(user=self.user, status='WAITING'), 'token_user_status_queue_idx')
+
+    def test_swap_lookups(self):
+        now = timezone.now()
+        self.assertUsesIndex(SwapRequest.objects.filter(queue=self.queue, status='PENDING', created_at__gte=now),
+                             'swap_queue_status_idx')
+        self.assertUsesIndex(SwapRequest.objects.filter(receiver__in=[self.token], status='PENDING'),
+                             'swap_receiver_status_idx')
+
+    def test_sweeper_lookups(self):
+        now = timezone.now()
+        self.assertUsesIndex(Token.objects.filter(status='CALLING', called_at__lt=now), 'token_status_called_idx')
+        self.assertUsesIndex(SwapRequest.objects.filter(status='PENDING', created_at__lt=now),
+                             'swap_status_created_idx')
+
+
+class DiscoveryTests(TestCase):
+
+    def test_nearest_first_with_crowd_status(self):
+        spots = {"Near": (19.0760, 72.8777), "Mid": (19.1000, 72.9000), "Far": (28.6139, 77.2090)}
+        for name, (lat, lng) in spots.items():
+            inst = Institution.objects.create(name=name, email=f"{name}@x.com", phone="1", password="x",
+                                              latitude=lat, longitude=lng)
+            if name == "Mid":
+                queue = Queue.objects.create(institution=inst, name="Q", size=100)
+                for n in range(1, 7):
+                    Token.objects.create(user=make_user(n), queue=queue, token_number=n, position_key=n)
+
+        res = self.client.get(reverse('discovery_map'), {"lat": 19.0761, "lng": 72.8778, "radius_km": 25})
+        self.assertEqual([r["name"] for r in res.data], ["Near", "Mid"])
+        self.assertLess(res.data[0]["distance_km"], 0.1)
+        self.assertEqual(res.data[1]["active_tokens"], 6)
+        self.assertEqual(res.data[1]["crowd"]["status"], "Medium")
+
+    def test_requires_coordinates(self):
+        self.assertEqual(self.client.get(reverse('discovery_map')).status_code, 400)
+        for params in ({"lat": "inf", "lng": 0}, {"lat": "nan", "lng": 0}, {"lat": 91, "lng": 0},
+                       {"lat": 0, "lng": -181}, {"lat": 0, "lng": 0, "radius_km": "nan"}):
+            self.assertEqual(self.client.get(reverse('discovery_map'), params).status_code, 400, params)
+
+    def test_box_wraps_at_the_antimeridian(self):
+        for name, lng in [("Fiji", 179.99), ("Samoa", -179.99)]:
+            Institution.objects.create(name=name, email=f"{name}@x.com", phone="1", password="x",
+                                       latitude=-17.0, longitude=lng)
+        for lng in (179.995, -179.995):
+            res = self.client.get(reverse('discovery_map'), {"lat": -17.0, "lng": lng, "radius_km": 5})
+            self.assertEqual(sorted(r["name"] for r in res.data), ["Fiji", "Samoa"])
+
+
+class InstitutionSearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for n, (name, address) in enumerate([("City Hospital", "MG Road, Pune"),
+                                             ("Hospice Care", "Baner, Pune"),
+                                             ("Central Bank", "Fort, Mumbai")]):
+            inst = Institution.objects.create(name=name, address=address, email=f"s{n}@x.com",
+                                              phone="1", password="x")
+            queue = Queue.objects.create(institution=inst, name="Q", size=100)
+            for k in range(1, n + 2):
+                Token.objects.create(user=make_user(n * 10 + k), queue=queue, token_number=k, position_key=k)
+
+    def search(self, **params):
+        return self.client.get(reverse('search_institutions'), params).data
+
+    def test_matches_name_and_address_with_active_counts(self):
+        # count, institutions, queues, queue snapshots
+        with self.assertNumQueries(4):
+            data = self.search(search="  HOSP ")
+        self.assertEqual([r["name"] for r in data["results"]], ["City Hospital", "Hospice Care"])
+        self.assertEqual(data["results"][1]["queues"][0]["active_tokens"], 2)
+        self.assertEqual(self.search(search="pune")["count"], 2)
+        self.assertEqual(self.search(search="mg")["count"], 1)
+
+    def test_paginates_and_caches(self):
+        data = self.search(page=2, page_size=2)
+        self.assertEqual((data["count"], len(data["results"])), (3, 1))
+        with self.assertNumQueries(0):
+            self.search(page=2, page_size=2)
+        Institution.objects.filter(name="Central Bank").update(name="Central Hospital")
+        self.assertEqual(self.search(search="central hosp")["results"][0]["name"], "Central Hospital")
+
+
+class QueueSnapshotTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.queue = make_queue(service_time_minutes=5)
+        for n in range(1, 4):
+            self.client.post(reverse('book_token'), {"queue_id": self.queue.id}, **auth(make_user(n)))
+
+    def test_writes_invalidate_snapshot(self):
+        self.assertEqual(get_snapshot(self.queue.id)["waiting"], 3)
+        self.client.post(reverse('book_token'), {"queue_id": self.queue.id}, **auth(make_user(4)))
+        self.assertEqual(get_snapshot(self.queue.id)["eta_minutes"], 20)
+
+        self.client.post(reverse('call_next', args=[self.queue.id]), **auth(self.queue.institution))
+        snapshot = get_snapshot(self.queue.id)
+        self.assertEqual((snapshot["waiting"], snapshot["active"], snapshot["serving"]), (3, 4, 2))
+
+
+class QueueEngineTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.engine = QueueEngine('*')
+        patcher = mock.patch('rnr.engine._engine', self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = make_queue()
+        self.tokens, self.users = [], [make_user(n) for n in range(1, 7)]
+        for user in self.users:
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(reverse('book_token'), {"queue_id": self.queue.id}, **auth(user))
+            self.tokens.append(res.data['id'])
+
+    def db_line(self):
+        return list(Token.objects.filter(queue=self.queue, status='WAITING').values_list('id', flat=True))
+
+    def test_skip_list_matches_sorted_list(self):
+        rng = random.Random(7)
+        skip, reference = IndexableSkipList(), []
+        for _ in range(2000):
+            key = rng.randrange(500)
+            if key in reference:
+                skip.remove(key)
+                reference.remove(key)
+            else:
+                skip.insert(key)
+                bisect.insort(reference, key)
+        self.assertEqual(list(skip), reference)
+        self.assertEqual([skip.at(i) for i in range(len(skip))], reference)
+        self.assertEqual([skip.rank(k) for k in reference], list(range(len(reference))))
+
+    def test_mutations_are_written_behind(self):
+        t = self.tokens
+        self.client.post(reverse('token_manage'), {"token_id": t[0], "action": "MOVE_BACK", "target_position": 3},
+                         **auth(self.users[0]))
+        swap = SwapRequest.objects.create(queue=self.queue, sender_id=t[4], receiver_id=t[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('accept_swap', args=[swap.id]), **auth(self.users[1]))
+        res = self.client.post(reverse('call_next', args=[self.queue.id]), **auth(self.queue.institution))
+        self.assertEqual(res.data['id'], t[4])
+
+        line = self.engine.line(self.queue.id)
+        expected = [t[2], t[0], t[3], t[1], t[5]]
+        self.assertEqual([line.at(i) for i in range(len(line))], expected)
+        self.assertEqual(Token.objects.get(id=t[4]).status, 'WAITING')
+
+        self.engine.flush()
+        self.assertEqual(self.db_line(), expected)
+        self.assertEqual(Token.objects.get(id=t[4]).status, 'CALLING')
+        self.engine.reload(self.queue.id)
+        reloaded = self.engine.line(self.queue.id)
+        self.assertEqual([reloaded.at(i) for i in range(len(reloaded))], expected)
+
+    def test_line_changes_wait_for_commit(self):
+        t, line = self.tokens, self.engine.line(self.queue.id)
+        swap = SwapRequest.objects.create(queue=self.queue, sender_id=t[4], receiver_id=t[1])
+        with mock.patch('rnr.views.credit', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            self.client.post(reverse('accept_swap', args=[swap.id]), **auth(self.users[1]))
+        # The swap rolled back, and the line never moved
+        self.assertEqual([line.at(i) for i in range(len(line))], t)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            res = self.client.post(reverse('token_manage'), {"token_id": t[0], "action": "CANCEL"}, **auth(self.users[0]))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(t[0], line)
+        # Called before the cancel's callbacks ran; the cancel still wins
+        self.assertEqual(line.pop_front(1), [t[0]])
+        for callback in callbacks:
+            callback()
+        self.engine.flush()
+        self.assertEqual(Token.objects.get(id=t[0]).status, 'SKIPPED')
+        res = self.client.post(reverse('token_manage'), {"token_id": t[0], "action": "CANCEL"}, **auth(self.users[0]))
+        self.assertEqual(res.status_code, 400)
+
+    def test_line_tolerates_tokens_that_left(self):
+        t, line = self.tokens, self.engine.line(self.queue.id)
+        line.pop_front(1)
+        self.assertFalse(line.discard(t[0]))
+        self.assertIsNone(line.rank(t[0]))
+        self.assertEqual(line.swap(t[0], t[1]), {})
+        self.assertEqual(line.move_back(t[0], 3), (None, {}))
+        self.assertEqual([line.at(i) for i in range(len(line))], t[1:])
+
+
+class BackgroundJobsTests(TestCase):
+
+    @override_settings(QUEUE_ENGINE={'QUEUES': '*'}, BACKGROUND_JOBS=False)
+    def test_engine_mode_needs_jobs_in_the_server(self):
+        with self.assertRaises(ImproperlyConfigured):
+            jobs.start()
+        with self.assertRaises(CommandError):
+            call_command('sweep_expired')
+        with self.assertRaises(CommandError):
+            call_command('rollover_queues', queue=[1])
+        with self.assertRaises(CommandError):
+            call_command('match_swaps')
+
+    @override_settings(BACKGROUND_JOBS=True)
+    def test_jobs_run_in_a_server_thread(self):
+        ran = threading.Event()
+
+        async def job():
+            ran.set()
+
+        with mock.patch('rnr.jobs._thread', None), mock.patch('rnr.jobs.jobs', lambda: [job()]):
+            jobs.start()
+            self.assertTrue(ran.wait(5))
+            self.assertEqual(jobs._thread.name, "background-jobs")
+            jobs._thread.join(5)
+
+
+class EtaEstimatorTests(TestCase):
+
+    def test_learns_from_call_gaps(self):
+        queue = make_queue(service_time_minutes=5)
+        self.assertEqual(estimate(queue, 4), {"minutes": 20.0, "low": 13.6, "high": 26.4})
+
+        start = timezone.now()
+        for seconds, count in [(0, 1), (60, 1), (120, 1), (240, 2), (3 * 3600, 1), (3 * 3600 + 60, 1)]:
+            record_calls(queue.id, count, start + timezone.timedelta(seconds=seconds))
+        queue.refresh_from_db()
+        # four 60s gaps (one shared by a batch of two); the 3 hour break is ignored
+        self.assertEqual(queue.service_samples, 4)
+        self.assertAlmostEqual(queue.service_mean_seconds, 60)
+        self.assertEqual(estimate(queue, 10), {"minutes": 10.0, "low": 10.0, "high": 10.0})
+
+
+class SwapMatchingTests(TestCase):
+
+    def best_surplus(self, intents):
+        """Exhaustive optimum for small instances."""
+        rows = sorted(intents)
+        def search(i, used):
+            if i == len(rows):
+                return 0
+            best = search(i + 1, used)
+            pos, side, bid, _ = rows[i]
+            if side == 'FORWARD':
+                for j, (p, s, ask, _) in enumerate(rows[:i]):
+                    if s == 'BACKWARD' and j not in used and ask <= bid:
+                        best = max(best, bid - ask + search(i + 1, used | {j}))
+            return best
+        return search(0, frozenset())
+
+    def test_plan_is_optimal(self):
+        rng = random.Random(3)
+        for _ in range(200):
+            intents = [(pos, rng.choice(['FORWARD', 'BACKWARD']), rng.randrange(10), pos)
+                       for pos in rng.sample(range(100), rng.randrange(1, 9))]
+            side = {i[3]: i for i in intents}
+            pairs = plan_matches(intents)
+            for buyer, seller in pairs.items():
+                self.assertLess(side[seller][0], side[buyer][0])
+                self.assertLessEqual(side[seller][2], side[buyer][2])
+            self.assertEqual(len(set(pairs.values())), len(pairs))
+            self.assertEqual(sum(side[b][2] - side[s][2] for b, s in pairs.items()), self.best_surplus(intents))
+
+    def test_pass_swaps_places_and_settles_points(self):
+        queue = make_queue()
+        users = [make_user(n) for n in range(1, 5)]
+        UserMe.objects.update(reward_points=100)
+        tokens = [Token.objects.create(user=u, queue=queue, token_number=n, position_key=n * POSITION_GAP)
+                  for n, u in enumerate(users, start=1)]
+        post = lambda token, side, points: self.client.post(
+            reverse('swap_intent'), {"token_id": token.id, "side": side, "points": points}, **auth(token.user))
+        self.assertEqual(post(tokens[0], 'BACKWARD', 30).status_code, 201)
+        post(tokens[1], 'BACKWARD', 35)
+        post(tokens[2], 'FORWARD', 40)
+        post(tokens[3], 'FORWARD', 70)
+        self.assertEqual(post(tokens[3], 'FORWARD', 500).status_code, 400)
+
+        self.assertEqual(match_all(), 2)
+        line = list(Token.objects.filter(queue=queue, status='WAITING').values_list('id', flat=True))
+        self.assertEqual(line, [tokens[2].id, tokens[3].id, tokens[0].id, tokens[1].id])
+        points = dict(UserMe.objects.filter(id__in=[u.id for u in users]).values_list('id', 'reward_points'))
+        self.assertEqual([points[u.id] for u in users], [130, 135, 70, 65])
+        self.assertFalse(SwapIntent.objects.filter(status='OPEN').exists())
+
+
+class RewardLedgerTests(TransactionTestCase):
+    WORKERS = 8
+
+    def test_concurrent_credits_are_not_lost(self):
+        user = make_user(1)
+
+        def earn(n):
+            try:
+                for _ in range(n):
+                    credit({user.id: 1}, 'test')
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            list(pool.map(earn, [25] * self.WORKERS))
+        user.refresh_from_db()
+        self.assertEqual(user.reward_points, 25 * self.WORKERS)
+        self.assertEqual(RewardLedger.objects.filter(user=user).aggregate(total=models.Sum('delta'))['total'],
+                         user.reward_points)
+
+    def test_charge_floors_at_zero_and_batch_balances(self):
+        users = [make_user(n) for n in range(1, 4)]
+        credit({users[0].id: 4, users[1].id: 20}, 'test')
+        self.assertEqual(charge(users[0].id, 10, 'test'), 4)
+        res = self.client.get(reverse('reward_balances'), {"ids": ",".join(str(u.id) for u in users)}, **auth(users[0]))
+        self.assertEqual(res.data, {str(users[0].id): 0, str(users[1].id): 20, str(users[2].id): 0})
+
+
+class SeedBulkTests(TestCase):
+
+    def test_builds_consistent_queues(self):
+        inst_ids, queue_ids, user_ids = seed_bulk(institutions=2, queues_per_institution=3, tokens_per_queue=10)
+        self.assertEqual((len(inst_ids), len(queue_ids), len(user_ids)), (2, 6, 10))
+        queue = Queue.objects.get(id=queue_ids[-1])
+        self.assertEqual((queue.last_token_number, queue.active_count), (10, 10))
+        res = self.client.post(reverse('book_token'), {"queue_id": queue.id}, **auth(make_user(1)))
+        self.assertEqual(res.data['token_number'], 11)
+        self.assertEqual(Token.objects.filter(queue=queue).order_by('-position_key').first().id, res.data['id'])
+
+
+class RequestMetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.user = make_user(1)
+        Token.objects.create(user=self.user, queue=make_queue(), token_number=1, position_key=POSITION_GAP)
+
+    def test_counts_queries_per_view(self):
+        with self.assertNumQueries(5):
+            self.client.get(reverse('user_dashboard', args=[self.user.id]), **auth(self.user))
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('rnr_request_seconds_count{view="user_dashboard"} 1', body)
+        self.assertIn('rnr_db_queries_total{view="user_dashboard"} 5', body)
+        serializer_seconds = float(body.split('rnr_serializer_seconds_total{view="user_dashboard"} ')[1].split()[0])
+        # The rows are built by hand, inside serializing()
+        self.assertGreater(serializer_seconds, 0)
+
+    def test_metrics_only_for_allowed_networks(self):
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.7').status_code, 403)
+        with override_settings(METRICS={**settings.METRICS, 'ALLOWED_NETWORKS': ['203.0.113.0/24']}):
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.7').status_code, 200)
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    @override_settings(METRICS={**settings.METRICS, 'SLOW_QUERY_MS': 0})
+    def test_slow_queries_grouped_by_fingerprint(self):
+        client = Client()
+        with self.assertLogs('rnr.metrics', 'WARNING'):
+            client.get(reverse('user_dashboard', args=[self.user.id]), **auth(self.user))
+            client.get(reverse('user_dashboard', args=[self.user.id]), **auth(self.user))
+        counts = {entry[0]: entry[2] for entry in registry.slow_queries.values()}
+        self.assertTrue(counts)
+        self.assertIn(2, counts.values())
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE name = 'o''k' AND id IN (1, 2,  3) LIMIT 21"),
+            "SELECT * FROM t WHERE name = ? AND id IN (...) LIMIT ?",
+        )
+
+
+FAST_HASHING = {**settings.PASSWORD_HASHING, 'ITERATIONS': 1000}
+
+
+@override_settings(PASSWORD_HASHING=FAST_HASHING)
+class ClaimsAuthTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.queue = make_queue()
+        self.user = UserMe.objects.create(name="Asha", email="asha@x.com", password=make_password("pw"))
+        Institution.objects.filter(id=self.queue.institution_id).update(password=make_password("pw"))
+
+    def login(self, url_name, email):
+        res = self.client.post(reverse(url_name), {"email": email, "password": "pw"})
+        return {"HTTP_AUTHORIZATION": f"Bearer {res.json()['access']}"}
+
+    def test_book_without_user_lookup(self):
+        auth = self.login('user_login', "asha@x.com")
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.post(reverse('book_token'), {"queue_id": self.queue.id}, **auth)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual((res.data['user'], res.data['user_name']), (self.user.id, "Asha"))
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "rnr_userme"' in q['sql']])
+
+    def test_roles_and_ownership(self):
+        inst_auth = self.login('inst_login', self.queue.institution.email)
+        res = self.client.post(reverse('book_token'), {"queue_id": self.queue.id}, **inst_auth)
+        self.assertEqual(res.status_code, 403)
+
+        other = Token.objects.create(user=make_user(2), queue=self.queue, token_number=1, position_key=POSITION_GAP)
+        auth = self.login('user_login', "asha@x.com")
+        res = self.client.post(reverse('token_manage'), {"token_id": other.id, "action": "CANCEL"}, **auth)
+        self.assertEqual(res.status_code, 403)
+
+        # The institution is taken from the token, not the body
+        res = self.client.post(reverse('call_next', args=[self.queue.id]), **inst_auth)
+        self.assertEqual(res.data['id'], other.id)
+
+    def test_body_ids_are_not_trusted(self):
+        token = Token.objects.create(user=self.user, queue=self.queue, token_number=1, position_key=POSITION_GAP)
+        body = {"user_id": self.user.id, "institution_id": self.queue.institution_id,
+                "token_id": token.id, "queue_id": self.queue.id, "action": "CANCEL"}
+        for url in (reverse('book_token'), reverse('token_manage'), reverse('call_next', args=[self.queue.id]),
+                    reverse('confirm_token', args=[token.id]), reverse('snooze_token', args=[token.id]),
+                    reverse('rollover_queue', args=[self.queue.id])):
+            self.assertEqual(self.client.post(url, body).status_code, 401, url)
+        res = self.client.get(reverse('inst_analytics', args=[self.queue.institution_id]))
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(Token.objects.get(id=token.id).status, 'WAITING')
+
+    def test_user_stream_is_scoped_to_the_caller(self):
+        url = reverse('user_events', args=[self.user.id])
+        self.assertEqual(self.client.get(url).status_code, 401)
+        other = auth(make_user(2))["HTTP_AUTHORIZATION"].split()[1]
+        self.assertEqual(self.client.get(url, {"token": other}).status_code, 403)
+        mine = auth(self.user)["HTTP_AUTHORIZATION"].split()[1]
+        res = self.client.get(url, {"token": mine})
+        self.assertEqual((res.status_code, res["Content-Type"]), (200, "text/event-stream"))
+
+    def test_refresh_keeps_claims(self):
+        refresh = self.client.post(reverse('user_login'), {"email": "asha@x.com", "password": "pw"}).json()['refresh']
+        access = self.client.post(reverse('token_refresh'), {"refresh": refresh}).data['access']
+        res = self.client.post(reverse('book_token'), {"queue_id": self.queue.id}, HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(res.data['user'], self.user.id)
+
+    def test_expired_access_is_a_401(self):
+        # The frontend refreshes on 401 (services/api.js), so expiry must not look like a 403
+        access = AccessToken(issue_tokens('user', self.user)['access'])
+        access.set_exp(lifetime=-timezone.timedelta(minutes=1))
+        res = self.client.get(reverse('user_dashboard', args=[self.user.id]), HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(res.status_code, 401)
+
+
+@override_settings(PASSWORD_HASHING=FAST_HASHING, LOGIN_LIMIT={'ATTEMPTS': 3, 'WINDOW': 60})
+class PasswordLoginTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserMe.objects.create(name="Ravi", email="ravi@x.com", password=make_password("pw"))
+
+    def login(self, password, **kwargs):
+        return self.client.post(reverse('user_login'), {"email": "ravi@x.com", "password": password}, **kwargs)
+
+    def test_rehash_when_cost_changes(self):
+        with override_settings(PASSWORD_HASHING={**FAST_HASHING, 'ITERATIONS': 2000}):
+            self.assertEqual(self.login("pw").status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$2000$"))
+
+    def test_json_body(self):
+        res = self.client.post(reverse('user_login'), json.dumps({"email": "ravi@x.com", "password": "pw"}),
+                               content_type='application/json')
+        self.assertEqual(res.json()["user_id"], self.user.id)
+
+    def test_failed_attempts_are_limited_per_email(self):
+        for _ in range(3):
+            self.assertEqual(self.login("wrong").status_code, 401)
+        self.assertEqual(self.login("pw").status_code, 429)
+        other = self.client.post(reverse('user_login'), {"email": "else@x.com", "password": "x"})
+        self.assertEqual(other.status_code, 401)
+
+    def test_busy_pool_sheds_logins(self):
+        with mock.patch('rnr.hashers.get_pool', return_value=(None, threading.BoundedSemaphore(1))) as get_pool:
+            get_pool.return_value[1].acquire()
+            res = self.login("pw")
+        self.assertEqual((res.status_code, res["Retry-After"]), (503, "1"))
+
+
+class QueueHistoryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('rnr.history._writer', EventWriter(batch_size=1000, max_delay=3600))
+        self.writer = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = make_queue()
+
+    def test_lifecycle_events_are_batched_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            users = [make_user(n) for n in range(3)]
+            for user in users:
+                self.client.post(reverse('book_token'), {"queue_id": self.queue.id}, **auth(user))
+            self.client.post(reverse('call_next', args=[self.queue.id]), **auth(self.queue.institution))
+            first = Token.objects.get(queue=self.queue, token_number=1)
+            self.client.post(reverse('confirm_token', args=[first.id]), **auth(users[0]))
+            third = Token.objects.get(queue=self.queue, token_number=3)
+            self.client.post(reverse('token_manage'), {"token_id": third.id, "action": "CANCEL"}, **auth(users[2]))
+        # Still buffered: nothing has reached the table yet
+        self.assertFalse(QueueEvent.objects.exists())
+        self.assertEqual(self.writer.flush(), 6)
+        kinds = list(QueueEvent.objects.filter(queue_id=self.queue.id).order_by('id').values_list('kind', 'token_id'))
+        self.assertEqual(kinds, [
+            (QueueEvent.BOOKED, first.id), (QueueEvent.BOOKED, first.id + 1), (QueueEvent.BOOKED, third.id),
+            (QueueEvent.CALLED, first.id), (QueueEvent.CONFIRMED, first.id), (QueueEvent.CANCELLED, third.id),
+        ])
+
+    def test_rollup_is_incremental(self):
+        now = timezone.now()
+        old = now - timezone.timedelta(hours=2)
+
+        def add(kind, count, at):
+            QueueEvent.objects.bulk_create(
+                QueueEvent(bucket=hour_bucket(at), queue_id=self.queue.id, token_id=n, user_id=n, kind=kind, at=at)
+                for n in range(count)
+            )
+
+        add(QueueEvent.BOOKED, 4, old)
+        add(QueueEvent.CALLED, 2, old)
+        self.assertEqual(rollup_all(), 6)
+        add(QueueEvent.BOOKED, 3, old)
+        add(QueueEvent.BOOKED, 5, now)      # not settled yet
+        self.assertEqual(rollup_all(), 3)
+        stats = dict(QueueHourlyStat.objects.filter(bucket=hour_bucket(old)).values_list('kind', 'count'))
+        self.assertEqual(stats, {QueueEvent.BOOKED: 7, QueueEvent.CALLED: 2})
+
+    def test_prune_keeps_recent_and_unfolded_events(self):
+        now = timezone.now()
+        for days_ago in (45, 40, 1):
+            at = now - timezone.timedelta(days=days_ago)
+            QueueEvent.objects.create(bucket=hour_bucket(at), queue_id=self.queue.id, token_id=days_ago,
+                                      user_id=1, kind=QueueEvent.BOOKED, at=at)
+        rollup_all()
+        at = now - timezone.timedelta(days=50)
+        QueueEvent.objects.create(bucket=hour_bucket(at), queue_id=self.queue.id, token_id=50, user_id=1,
+                                  kind=QueueEvent.BOOKED, at=at)
+
+        self.assertEqual(prune(retention_days=30, now=now), 2)
+        # The recent event, and the old one the rollup has not read yet
+        self.assertEqual(sorted(QueueEvent.objects.values_list('token_id', flat=True)), [1, 50])
+        self.assertEqual(QueueHourlyStat.objects.count(), 3)
+
+
+class QueueAnalyticsTests(TestCase):
+
+    def test_rollups_and_endpoint(self):
+        queue = make_queue()
+        day = day_floor(timezone.now())
+        hour = timezone.timedelta(hours=1)
+        minute = timezone.timedelta(minutes=1)
+        for n, (joined, called) in enumerate([(9 * hour, 9 * hour + 10 * minute),
+                                              (9 * hour + 30 * minute, 9 * hour + 50 * minute),
+                                              (10 * hour, None)], start=1):
+            token = Token.objects.create(user=make_user(n), queue=queue, token_number=n, position_key=n)
+            Token.objects.filter(id=token.id).update(joined_at=day + joined, called_at=called and day + called)
+        # An older token outside the window is ignored
+        old = Token.objects.create(user=make_user(9), queue=queue, token_number=9, position_key=9)
+        Token.objects.filter(id=old.id).update(joined_at=day - 3 * 24 * hour)
+        for kind, count in ((QueueEvent.CALLED, 4), (QueueEvent.EXPIRED, 1), (QueueEvent.SWAPPED, 2)):
+            QueueHourlyStat.objects.create(queue_id=queue.id, bucket=hour_bucket(day + 9 * hour), kind=kind, count=count)
+
+        self.assertEqual(build_rollups(days=1, now=day + 12 * hour), 3)
+
+        res = self.client.get(reverse('inst_analytics', args=[queue.institution_id]), {"days": 1},
+                              **auth(queue.institution))
+        buckets = res.data["queues"][0]["buckets"]
+        self.assertEqual([b["arrivals"] for b in buckets], [2, 1])
+        self.assertEqual(buckets[0], {
+            "start": day + 9 * hour, "arrivals": 2, "avg_wait_minutes": 15.0,
+            "calls": 4, "no_show_rate": 0.25, "swaps": 1,
+        })
+        self.assertIsNone(buckets[1]["avg_wait_minutes"])
+
+        daily = self.client.get(reverse('inst_analytics', args=[queue.institution_id]), {"granularity": "day"},
+                                **auth(queue.institution))
+        self.assertEqual([(b["arrivals"], b["calls"]) for b in daily.data["queues"][0]["buckets"]], [(3, 4)])
+
+    def test_archived_tokens_still_count(self):
+        queue = make_queue()
+        day = day_floor(timezone.now())
+        hour = timezone.timedelta(hours=1)
+        for n in range(1, 4):
+            token = Token.objects.create(user=make_user(n), queue=queue, token_number=n, position_key=n)
+            Token.objects.filter(id=token.id).update(joined_at=day + 9 * hour, called_at=day + 9 * hour + n * hour / 6)
+        # Closing the epoch makes the tokens archivable right away
+        rollover(queue.id)
+        self.assertEqual(archive()["tokens"], 3)
+        self.assertFalse(Token.objects.exists())
+
+        self.assertEqual(build_rollups(days=1, now=day + 12 * hour), 2)
+        hourly = QueueRollup.objects.get(queue_id=queue.id, granularity='hour')
+        self.assertEqual((hourly.start, hourly.arrivals, hourly.waits), (day + 9 * hour, 3, 3))
+        self.assertAlmostEqual(hourly.wait_seconds, 3600.0)
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.queue = make_queue()
+        self.user = make_user(1)
+        self.tokens = [Token.objects.create(user=self.user if n % 2 else make_user(10 + n), queue=self.queue,
+                                            token_number=n, position_key=n * POSITION_GAP) for n in range(1, 7)]
+
+    def finish(self, tokens, status='COMPLETED', days_ago=2):
+        Token.objects.filter(id__in=[t.id for t in tokens]).update(
+            status=status, joined_at=timezone.now() - timezone.timedelta(days=days_ago))
+
+    def test_moves_finished_rows_in_batches(self):
+        t = self.tokens
+        self.finish(t[:3])
+        self.finish(t[3:4], status='SKIPPED')
+        self.finish(t[4:5], days_ago=0)     # too recent
+        done = SwapRequest.objects.create(queue=self.queue, sender=t[1], receiver=t[0], status='ACCEPTED')
+        pending = SwapRequest.objects.create(queue=self.queue, sender=t[2], receiver=t[5])
+
+        moved = archive(batch_size=2)
+
+        self.assertEqual(moved, {"tokens": 3, "swaps": 1})
+        self.assertEqual(set(TokenArchive.objects.values_list('id', flat=True)), {t[0].id, t[1].id, t[3].id})
+        self.assertTrue(SwapRequestArchive.objects.filter(id=done.id, sender_id=t[1].id).exists())
+        # Held back by its pending swap request
+        self.assertTrue(Token.objects.filter(id=t[2].id).exists())
+        self.assertTrue(SwapRequest.objects.filter(id=pending.id).exists())
+
+    def test_history_merges_live_and_archived(self):
+        t = self.tokens
+        self.finish([t[0]])
+        archive()
+        self.finish([t[2]], days_ago=0)
+        res = self.client.get(reverse('user_history', args=[self.user.id]), {"limit": 1}, **auth(self.user))
+        self.assertEqual([r["id"] for r in res.data["results"]], [t[2].id])
+        res = self.client.get(reverse('user_history', args=[self.user.id]), {"before": res.data["next"]},
+                              **auth(self.user))
+        self.assertEqual([(r["id"], r["queue_name"]) for r in res.data["results"]], [(t[0].id, "General")])
+        self.assertIsNone(res.data["next"])
+
+
+class EpochRolloverTests(TestCase):
+
+    def setUp(self):
+        self.queue = make_queue(size=2)
+        self.users = [make_user(n) for n in range(1, 5)]
+
+    def book(self, user):
+        return self.client.post(reverse('book_token'), {"queue_id": self.queue.id}, **auth(user))
+
+    def test_capacity_counts_tokens_in_line(self):
+        first = self.book(self.users[0]).data
+        self.book(self.users[1])
+        self.assertEqual(self.book(self.users[2]).data["error"], "Queue is full")
+
+        self.client.post(reverse('token_manage'), {"token_id": first["id"], "action": "CANCEL"}, **auth(self.users[0]))
+        self.assertEqual(self.book(self.users[2]).data["token_number"], 3)
+        self.assertEqual(Queue.objects.get(id=self.queue.id).active_count, 2)
+
+        called = self.client.post(reverse('call_next', args=[self.queue.id]), **auth(self.queue.institution)).data
+        confirm = lambda: self.client.post(reverse('confirm_token', args=[called["id"]]), **auth(self.users[1]))
+        self.assertEqual(confirm().status_code, 200)
+        # A second confirm neither credits nor frees another slot
+        self.assertEqual(confirm().status_code, 400)
+        self.assertEqual(Queue.objects.get(id=self.queue.id).active_count, 1)
+        self.assertEqual(recount_active([self.queue.id]), 1)
+        self.assertEqual(Queue.objects.get(id=self.queue.id).active_count, 1)
+
+    def test_finished_tokens_stay_out_of_line(self):
+        cancelled = self.book(self.users[0]).data
+        self.client.post(reverse('token_manage'), {"token_id": cancelled["id"], "action": "CANCEL"}, **auth(self.users[0]))
+        res = self.client.post(reverse('snooze_token', args=[cancelled["id"]]), **auth(self.users[0]))
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(Token.objects.get(id=cancelled["id"]).status, 'SKIPPED')
+
+        self.book(self.users[1])
+        called = self.client.post(reverse('call_next', args=[self.queue.id]), **auth(self.queue.institution)).data
+        confirm = lambda: self.client.post(reverse('confirm_token', args=[called["id"]]), **auth(self.users[1]))
+        self.assertEqual(confirm().status_code, 200)
+        # Re-confirming after the call window must not put the token back in line
+        Token.objects.filter(id=called["id"]).update(called_at=timezone.now() - timezone.timedelta(hours=1))
+        self.assertEqual(confirm().status_code, 400)
+        self.assertEqual(Token.objects.get(id=called["id"]).status, 'COMPLETED')
+        self.assertEqual(Queue.objects.get(id=self.queue.id).active_count, 0)
+        self.assertEqual(recount_active([self.queue.id]), 1)
+        self.assertEqual(Queue.objects.get(id=self.queue.id).active_count, 0)
+
+    def test_rollover_restarts_numbering(self):
+        tokens = [self.book(u).data for u in self.users[:2]]
+        SwapRequest.objects.create(queue=self.queue, sender_id=tokens[0]["id"], receiver_id=tokens[1]["id"])
+        url = reverse('rollover_queue', args=[self.queue.id])
+        # Naming the institution in the body is not enough
+        self.assertEqual(self.client.post(url, {"institution_id": self.queue.institution_id}).status_code, 401)
+        self.assertEqual(self.client.post(url, **auth(make_queue().institution)).status_code, 403)
+
+        res = self.client.post(url, **auth(self.queue.institution))
+        self.assertEqual(res.data, {"epoch": 2, "closed": 2})
+        self.assertEqual(set(Token.objects.values_list('status', flat=True)), {'SKIPPED'})
+        self.assertFalse(SwapRequest.objects.filter(status='PENDING').exists())
+
+        # Numbering restarts, and the same user may book again in the new epoch
+        res = self.book(self.users[0])
+        self.assertEqual((res.data["token_number"], Token.objects.get(id=res.data["id"]).epoch), (1, 2))
+        # Closed epochs are archived whatever their age
+        self.assertEqual(archive()["tokens"], 2)
+        self.assertEqual(set(TokenArchive.objects.values_list('epoch', flat=True)), {1})
+
+    def test_rollover_due_after_midnight(self):
+        now = timezone.now()
+        Queue.objects.filter(id=self.queue.id).update(epoch_started_at=now - timezone.timedelta(days=1))
+        self.assertEqual(rollover_due(now), {self.queue.id: (2, 0)})
+        self.assertEqual(rollover_due(now), {})
+
+
+class AsyncReadViewsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.inst_ids, queue_ids, self.user_ids = seed_bulk(institutions=2, queues_per_institution=2, tokens_per_queue=8)
+        tokens = dict(Token.objects.filter(queue_id=queue_ids[0]).values_list('user_id', 'id'))
+        SwapRequest.objects.create(queue_id=queue_ids[0], sender_id=tokens[self.user_ids[5]],
+                                   receiver_id=tokens[self.user_ids[1]])
+        bearer = lambda account: {"Authorization": auth(account)["HTTP_AUTHORIZATION"]}
+        self.headers = {
+            'user_dashboard': bearer(UserMe.objects.get(id=self.user_ids[1])),
+            'inst_dashboard': bearer(Institution.objects.get(id=self.inst_ids[0])),
+        }
+
+    async def test_same_payloads_as_sync_views(self):
+        factory = AsyncRequestFactory()
+        cases = [
+            ('user_dashboard', async_views.get_user_dashboard, [self.user_ids[1]], {}),
+            ('inst_dashboard', async_views.get_institution_dashboard, [self.inst_ids[0]], {"limit": 3}),
+            ('search_institutions', async_views.search_institutions, [], {"search": "clinic", "page_size": 1}),
+            ('discovery_map', async_views.discovery_map_api, [], {"lat": 18.5, "lng": 73.8}),
+        ]
+        for name, view, args, params in cases:
+            url = reverse(name, args=args)
+            await cache.aclear()
+            headers = self.headers.get(name)
+            res = await view(factory.get(url, params, headers=headers), *args)
+            await cache.aclear()
+            expected = await self.async_client.get(url, params, headers=headers)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(json.loads(res.content), expected.json(), name)
+
+    async def test_errors(self):
+        factory = AsyncRequestFactory()
+        res = await async_views.get_user_dashboard(factory.get("/"), self.user_ids[1])
+        self.assertEqual(res.status_code, 401)
+        res = await async_views.get_user_dashboard(factory.get("/", headers=self.headers['user_dashboard']),
+                                                   self.user_ids[2])
+        self.assertEqual(res.status_code, 403)
+        nobody = {"Authorization": auth(UserMe(id=0, name=""))["HTTP_AUTHORIZATION"]}
+        res = await async_views.get_user_dashboard(factory.get("/", headers=nobody), 0)
+        self.assertEqual(res.status_code, 404)
+        res = await async_views.discovery_map_api(factory.get("/", {"lat": "x"}))
+        self.assertEqual(res.status_code, 400)
+        res = await async_views.discovery_map_api(factory.get("/", {"lat": "inf", "lng": 0}))
+        self.assertEqual(res.status_code, 400)
+        res = await async_views.search_institutions(factory.post("/"))
+        self.assertEqual(res.status_code, 405)
@@ -1,5 +1,13 @@
+import heapq
 import math
 
+try:
+    import numpy as np
+except ImportError:  # discovery still works, just without vectorization
+    np = None
+
+EARTH_RADIUS_KM = 6371
+
 def calculate_distance(lat1, lon1, lat2, lon2):
     """
     Calculate the great circle distance between two points 
@@ -21,9 +29,60 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     dlat = lat2 - lat1 
     a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
     c = 2 * math.asin(math.sqrt(a)) 
-    r = 6371 # Radius of earth in kilometers. Use 3956 for miles
+    r = EARTH_RADIUS_KM # Radius of earth in kilometers. Use 3956 for miles
     return c * r
 
+
+def bounding_box(lat, lon, radius_km):
+    """
+    (min_lat, max_lat, [(min_lon, max_lon), ...]) enclosing a circle of
+    `radius_km`, used as a cheap indexed prefilter before exact distances.
+    A box crossing the antimeridian is split into two longitude ranges.
+    """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    # Longitude degrees shrink towards the poles
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    dlon = math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat))
+    if dlon >= 180 or min_lat <= -90 or max_lat >= 90:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180:
+        return min_lat, max_lat, [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    if max_lon > 180:
+        return min_lat, max_lat, [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    return min_lat, max_lat, [(min_lon, max_lon)]
+
+
+def nearest(lat, lon, lats, lons, k):
+    """
+    Haversine distance from (lat, lon) to every candidate; returns the
+    indices and distances (km) of the k closest, nearest first.
+    """
+    if not len(lats):
+        return []
+    if np is None:
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        distances = []
+        for lat2, lon2 in zip(lats, lons):
+            lat2, lon2 = math.radians(float(lat2)), math.radians(float(lon2))
+            a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+            distances.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a)))
+        return heapq.nsmallest(k, enumerate(distances), key=lambda pair: pair[1])
+
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2 = np.radians(np.asarray(lats, dtype=float))
+    lon2 = np.radians(np.asarray(lons, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+    if k < len(distances):
+        top = np.argpartition(distances, k)[:k]
+    else:
+        top = np.arange(len(distances))
+    top = top[np.argsort(distances[top])]
+    return [(int(i), float(distances[i])) for i in top]
+
 def get_crowd_status(count):
     """
     Returns crowd status and color based on queue count
@@ -2,28 +2,92 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.contrib.auth.hashers import make_password, check_password
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.shortcuts import get_object_or_404
-from django.db import transaction, models
+from django.core.cache import cache
+from django.db import connection, transaction, models
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
 from django.utils import timezone
+import hashlib
+import math
+import re
+import uuid
 
 
-from .models import UserMe, Institution, Queue, Token, SwapRequest
+from .models import UserMe, Institution, Queue, Token, SwapRequest, SwapIntent, QueueRollup, POSITION_GAP, SWAP_REQUEST_TTL, ACTIVE_STATUSES
+from .analytics import day_floor, serialize_rollup
+from .archive import token_history
 from .serializers import UserMeSerializer, InstitutionSerializer, TokenSerializer
+from .auth import acting_institution_id, acting_user, authenticate, issue_tokens, may_act_on, password_login, principal
+from .hashers import HashingBusy, hash_password
+from .engine import get_engine, line_for
+from .eta import estimate, record_calls, service_stats
+from .events import emit, get_broker, queue_channel, user_channel
+from .metrics import serializing
+from .rewards import balances, charge, credit
+from .rollover import rollover
+from .snapshots import get_snapshots
+from .utils import bounding_box, nearest, get_crowd_status
 
 
 
 
-# --- Helper for Automatic Queue Shifting (Re-indexing) ---
-def shift_queue_positions(queue):
-    """Ensures the queue is continuous. Use after cancellation/snooze."""
-    waiting_tokens = Token.objects.filter(queue=queue, status='WAITING').order_by('token_number')
-    with transaction.atomic():
-        for index, token in enumerate(waiting_tokens, start=1):
-            if token.token_number != index:
-                token.token_number = index
-                token.save()
+# --- Helpers for Gap-Based Queue Ordering ---
+# Tokens keep a sparse `position_key`; a position is just a rank over WAITING
+# tokens, so nothing has to be renumbered when someone leaves the line.
+def waiting_tokens(queue):
+    return Token.objects.filter(queue=queue, status='WAITING')
+
+
+def get_position(token):
+    """Number of WAITING tokens ahead of `token` (0 = front of the line)."""
+    return waiting_tokens(token.queue_id).filter(position_key__lt=token.position_key).count()
+
+
+def position_annotation(prefix=''):
+    """`get_position` as a correlated subquery, for ranking many tokens in one query."""
+    ahead = Token.objects.filter(
+        queue=models.OuterRef(prefix + 'queue'), status='WAITING',
+        position_key__lt=models.OuterRef(prefix + 'position_key'),
+    ).order_by().values('queue').annotate(n=models.Count('id')).values('n')
+    return Coalesce(models.Subquery(ahead), 0)
+
+
+def lock_queue(queue_id):
+    """
+    Take the queue's row lock for the rest of the transaction. Every key
+    assignment reads the line and then writes; holding this lock (as booking's
+    conditional UPDATE does) stops two of them picking the same key.
+    """
+    Queue.objects.select_for_update().values_list('id', flat=True).get(id=queue_id)
+
+
+def next_tail_key(queue):
+    """Sort key that places a token behind everyone currently in the queue. Call under `lock_queue`."""
+    last_key = Token.objects.filter(queue=queue).aggregate(last=models.Max('position_key'))['last']
+    return (last_key or 0) + POSITION_GAP
+
+
+def rebalance_queue_keys(queue):
+    """Re-spread WAITING keys evenly. Only needed once a gap is exhausted."""
+    tokens = list(waiting_tokens(queue).order_by('position_key'))
+    for index, token in enumerate(tokens, start=1):
+        token.position_key = index * POSITION_GAP
+    Token.objects.bulk_update(tokens, ['position_key'])
+
+
+def key_between(queue, before, after):
+    """Sort key strictly between two neighbouring tokens, rebalancing if needed. Call under `lock_queue`."""
+    if after is None:
+        return before.position_key + POSITION_GAP
+    if after.position_key - before.position_key < 2:
+        rebalance_queue_keys(queue)
+        before.refresh_from_db(fields=['position_key'])
+        after.refresh_from_db(fields=['position_key'])
+    return (before.position_key + after.position_key) // 2
 
 
 # =====================================================
@@ -37,35 +101,34 @@ def user_signup_api(request):
     data = request.data
     if UserMe.objects.filter(email=data.get('email')).exists():
         return Response({"error": "Email already exists"}, status=status.HTTP_400_BAD_REQUEST)
-
+    try:
+        password = hash_password(data.get('password'))
+    except HashingBusy:
+        return Response({"error": "Server busy, please retry."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
     user = UserMe.objects.create(
         name=data.get('name'),
         email=data.get('email'),
-        password=make_password(data.get('password'))
+        password=password
     )
     return Response({"message": "User registered successfully"}, status=status.HTTP_201_CREATED)
 
 
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def user_login_api(request):
-    data = request.data
-    user = UserMe.objects.filter(email=data.get('email')).first()
-
-
-    if user and check_password(data.get('password'), user.password):
-        return Response({
-            "message": "Login successful",
-            "user_id": user.id,
-            "name": user.name,
-            "email": user.email,
-            "reward_points": user.reward_points,
-            "role": "user"
-        }, status=status.HTTP_200_OK)
-
-
-    return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
+@csrf_exempt
+@require_POST
+async def user_login_api(request):
+    user, error = await password_login(request, UserMe, "user")
+    if error:
+        return error
+    return JsonResponse({
+        "message": "Login successful",
+        "user_id": user.id,
+        "name": user.name,
+        "email": user.email,
+        "reward_points": user.reward_points,
+        "role": "user",
+        **issue_tokens("user", user),
+    }, status=status.HTTP_200_OK)
 
 
 
@@ -81,65 +144,199 @@ def institution_signup_api(request):
     data = request.data
     if Institution.objects.filter(email=data.get('email')).exists():
         return Response({"error": "Institution exists"}, status=status.HTTP_400_BAD_REQUEST)
-
+    try:
+        password = hash_password(data.get('password'))
+    except HashingBusy:
+        return Response({"error": "Server busy, please retry."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
     inst = Institution.objects.create(
         name=data.get('name'),
         email=data.get('email'),
         phone=data.get('phone'),
         address=data.get('address', ''),
-        password=make_password(data.get('password'))
+        password=password
     )
     return Response({"message": "Institution created"}, status=status.HTTP_201_CREATED)
 
 
 
 
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def institution_login_api(request):
-    data = request.data
-    inst = Institution.objects.filter(email=data.get('email')).first()
+@csrf_exempt
+@require_POST
+async def institution_login_api(request):
+    inst, error = await password_login(request, Institution, "institution")
+    if error:
+        return error
+    return JsonResponse({
+        "message": "Login successful",
+        "institution_id": inst.id,
+        "name": inst.name,
+        "role": "institution",
+        **issue_tokens("institution", inst),
+    }, status=status.HTTP_200_OK)
 
 
-    if inst and check_password(data.get('password'), inst.password):
-        return Response({
-            "message": "Login successful",
-            "institution_id": inst.id,
-            "name": inst.name,
-            "role": "institution"
-        }, status=status.HTTP_200_OK)
 
 
-    return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
+# =====================================================
+# QUEUE & DISCOVERY OPERATIONS
+# =====================================================
+
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_CACHE_SECONDS = 30
 
 
+def normalize_search(term):
+    return " ".join(term.lower().split())
 
 
-# =====================================================
-# QUEUE & DISCOVERY OPERATIONS
-# =====================================================
+def institution_search_filter(term):
+    """
+    Match `term` against name/address. On SQLite this goes through the FTS5
+    trigram index (migration 0010); trigrams need at least 3 characters, so
+    shorter terms fall back to icontains. Postgres serves icontains from its
+    pg_trgm indexes directly.
+    """
+    if connection.vendor == 'sqlite' and len(term) >= 3:
+        phrase = '"' + term.replace('"', '""') + '"'
+        return models.Q(id__in=RawSQL(
+            "SELECT rowid FROM rnr_institution_fts WHERE rnr_institution_fts MATCH %s", [phrase]
+        ))
+    return models.Q(name__icontains=term) | models.Q(address__icontains=term)
+
+
+def search_params(params):
+    """(term, page, page_size, cache key) from the query string; ValueError if malformed."""
+    term = normalize_search(params.get('search', ''))
+    page = max(int(params.get('page', 1)), 1)
+    page_size = min(max(int(params.get('page_size', SEARCH_PAGE_SIZE)), 1), SEARCH_MAX_PAGE_SIZE)
+    cache_key = "search:{}:{}:{}".format(page, page_size, hashlib.sha1(term.encode()).hexdigest())
+    return term, page, page_size, cache_key
+
+
+def search_results(term, page, page_size):
+    """(matching institutions, one page of them with their queues prefetched)."""
+    institutions = Institution.objects.order_by('id')
+    if term:
+        institutions = institutions.filter(institution_search_filter(term))
+    start = (page - 1) * page_size
+    return institutions, institutions.prefetch_related('queues')[start:start + page_size]
+
+
+def search_page(count, page, page_size, page_items, queue_snapshots):
+    return {
+        "count": count,
+        "page": page,
+        "page_size": page_size,
+        "results": InstitutionSerializer(page_items, many=True, context={"snapshots": queue_snapshots}).data,
+    }
 
 
 @api_view(['GET'])
+@permission_classes([AllowAny])
 def search_institutions(request):
-    search_query = request.query_params.get('search', '')
-    if search_query:
-        institutions = Institution.objects.filter(
-            models.Q(name__icontains=search_query) | models.Q(address__icontains=search_query)
-        )
-    else:
-        institutions = Institution.objects.all()
-    serializer = InstitutionSerializer(institutions, many=True)
-    return Response(serializer.data)
+    try:
+        search_query, page, page_size, cache_key = search_params(request.query_params)
+    except ValueError:
+        return Response({"error": "page and page_size must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+    data = cache.get(cache_key)
+    if data is not None:
+        return Response(data)
+
+    institutions, page_items = search_results(search_query, page, page_size)
+    count = institutions.count()
+    page_items = list(page_items)
+    queue_snapshots = get_snapshots([q.id for inst in page_items for q in inst.queues.all()])
+
+    data = search_page(count, page, page_size, page_items, queue_snapshots)
+    cache.set(cache_key, data, SEARCH_CACHE_SECONDS)
+    return Response(data)
+
+
+DISCOVERY_RADIUS_KM = 10
+DISCOVERY_MAX_RADIUS_KM = 200
+DISCOVERY_LIMIT = 20
+DISCOVERY_PARAMS_ERROR = "lat (-90..90) and lng (-180..180) are required."
+
+
+def discovery_params(params):
+    """(lat, lng, radius, limit) from the query string; KeyError / ValueError if malformed or out of range."""
+    lat = float(params['lat'])
+    lng = float(params['lng'])
+    radius = float(params.get('radius_km', DISCOVERY_RADIUS_KM))
+    limit = int(params.get('limit', DISCOVERY_LIMIT))
+    # float() accepts "inf" and "nan"
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180 and math.isfinite(radius)):
+        raise ValueError("coordinates out of range")
+    return lat, lng, max(0.1, min(radius, DISCOVERY_MAX_RADIUS_KM)), max(1, min(limit, 100))
+
+
+def discovery_candidates(lat, lng, radius):
+    # Indexed prefilter; exact distances are computed over these rows only
+    min_lat, max_lat, lng_ranges = bounding_box(lat, lng, radius)
+    in_lng = models.Q()
+    for min_lng, max_lng in lng_ranges:
+        in_lng |= models.Q(longitude__range=(min_lng, max_lng))
+    return Institution.objects.filter(
+        in_lng, latitude__range=(min_lat, max_lat)
+    ).values_list('id', 'name', 'address', 'latitude', 'longitude')
+
+
+def rank_candidates(candidates, lat, lng, radius, limit):
+    return [
+        (candidates[i], distance)
+        for i, distance in nearest(lat, lng, [c[3] for c in candidates], [c[4] for c in candidates], limit)
+        if distance <= radius
+    ]
+
+
+def active_counts_by_institution(inst_ids):
+    return (
+        Token.objects.filter(queue__institution_id__in=inst_ids, status__in=ACTIVE_STATUSES)
+        .values('queue__institution').annotate(n=models.Count('id')).order_by()
+        .values_list('queue__institution', 'n')
+    )
+
+
+def discovery_rows(ranked, counts):
+    return [{
+        "id": inst_id,
+        "name": name,
+        "address": address,
+        "latitude": float(inst_lat),
+        "longitude": float(inst_lng),
+        "distance_km": round(distance, 2),
+        "active_tokens": counts.get(inst_id, 0),
+        "crowd": get_crowd_status(counts.get(inst_id, 0)),
+    } for (inst_id, name, address, inst_lat, inst_lng), distance in ranked]
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def discovery_map_api(request):
+    """
+    Nearest institutions to ?lat=&lng= within ?radius_km= (default 10),
+    closest first, with live crowd status. ?limit= caps the results.
+    """
+    try:
+        lat, lng, radius, limit = discovery_params(request.query_params)
+    except (KeyError, ValueError):
+        return Response({"error": DISCOVERY_PARAMS_ERROR}, status=400)
+
+    ranked = rank_candidates(list(discovery_candidates(lat, lng, radius)), lat, lng, radius, limit)
+    counts = dict(active_counts_by_institution([c[0] for c, _ in ranked]))
+    return Response(discovery_rows(ranked, counts))
 
 
 @api_view(['POST'])
 def book_token_api(request):
-    user_id = request.data.get('user_id')
-    queue_id = request.data.get('queue_id')
-    user = get_object_or_404(UserMe, id=user_id)
-    queue = get_object_or_404(Queue, id=queue_id)
+    user = acting_user(request)
+    if user is None:
+        return Response({"error": "Only users can book."}, status=403)
+    queue = get_object_or_404(Queue, id=request.data.get('queue_id'))
 
 
     if queue.is_closed or queue.is_paused:
@@ -148,13 +345,25 @@ def book_token_api(request):
         return Response({"error": "You already have an active token"}, status=status.HTTP_400_BAD_REQUEST)
 
 
-    last_token = Token.objects.filter(queue=queue).order_by('-token_number').first()
-    next_num = (last_token.token_number + 1) if last_token else 1
-    if next_num > queue.size:
-        return Response({"error": "Queue is full"}, status=status.HTTP_400_BAD_REQUEST)
+    with transaction.atomic():
+        # Claim a slot and the next number with a conditional UPDATE; it takes
+        # the queue's row lock, so concurrent bookings serialize here instead of
+        # colliding. Capacity counts tokens in line (active_count), not numbers.
+        claimed = Queue.objects.filter(id=queue.id, active_count__lt=models.F('size')).update(
+            last_token_number=models.F('last_token_number') + 1,
+            active_count=models.F('active_count') + 1,
+        )
+        if not claimed:
+            return Response({"error": "Queue is full"}, status=status.HTTP_400_BAD_REQUEST)
+        next_num, epoch = Queue.objects.values_list('last_token_number', 'epoch').get(id=queue.id)
 
 
-    token = Token.objects.create(user=user, queue=queue, token_number=next_num)
+        line = line_for(queue.id)
+        tail_key = line.next_key() if line is not None else next_tail_key(queue)
+        token = Token.objects.create(user=user, queue=queue, epoch=epoch, token_number=next_num, position_key=tail_key)
+        if line is not None:
+            transaction.on_commit(lambda: line.append(token.id, token.position_key))
+    emit("token_booked", queue.id, [user.id], token=token.id, number=token.token_number)
     return Response(TokenSerializer(token).data, status=status.HTTP_201_CREATED)
 
 
@@ -171,21 +380,41 @@ def manage_token_position_api(request):
 
     with transaction.atomic():
         token = get_object_or_404(Token.objects.select_for_update(), id=token_id)
+        if not may_act_on(request, user_id=token.user_id):
+            return Response({"error": "Unauthorized"}, status=403)
         queue = token.queue
-        current_pos = token.token_number
+        # Engine-managed queues (rnr/engine.py) keep their line in memory and
+        # write Token changes behind, so the row may lag the line.
+        engine, line = get_engine(), line_for(queue.id)
 
 
-        if token.status != "WAITING" or token.called_at is not None:
+        rank = line.rank(token.id) if line is not None else None
+        if line is not None:
+            if rank is None:
+                return Response({"error": "Token cannot be modified."}, status=400)
+        elif token.status != "WAITING" or token.called_at is not None:
             return Response({"error": "Token cannot be modified."}, status=400)
 
 
+        # 1-based place in line, derived from the sort key
+        current_pos = (rank if line is not None else get_position(token)) + 1
+
+
         # -----------------------------------------------------
-        # CANCEL: Re-index + FCFS Logic
+        # CANCEL: Leave the line + FCFS Logic
         # -----------------------------------------------------
         if action == "CANCEL":
-            token.status = 'SKIPPED'
-            token.save()
-            shift_queue_positions(queue)
+            # Only a WAITING row can be cancelled, so racing cancels free one slot
+            if not Token.objects.filter(id=token.id, status='WAITING').update(status='SKIPPED'):
+                return Response({"error": "Token cannot be modified."}, status=400)
+            if line is not None:
+                def leave_line():
+                    if not line.discard(token.id):
+                        # Called meanwhile: keep the cancel over the call's deferred write
+                        engine.defer(queue.id, token.id, status='SKIPPED')
+                transaction.on_commit(leave_line)
+            release_slot(token)
+            emit("token_cancelled", queue.id, [token.user_id], token=token.id)
            
             if current_pos == 1:
                 return Response({
@@ -199,13 +428,6 @@ def manage_token_position_api(request):
 
         # MOVE FORWARD: Tiered Range (Legacy)
         elif action == "MOVE_FORWARD":
-            # Active Expiration Cleanup (Auto-terminate old requests)
-            expired_requests = SwapRequest.objects.filter(queue=queue, status="PENDING")
-            for req in expired_requests:
-                if req.is_expired():
-                    req.status = "REJECTED"
-                    req.save()
-
             try:
                 # Expecting tiered range from Frontend (e.g., 1-10)
                 range_start = int(request.data.get("range_start"))
@@ -220,8 +442,12 @@ def manage_token_position_api(request):
             if range_end >= current_pos:
                 return Response({"error": "Target range must be ahead of your current position."}, status=400)
 
-            total_waiting = Token.objects.filter(queue=queue, status="WAITING").count()
-            active_swaps = SwapRequest.objects.filter(queue=queue, status="PENDING").count()
+            total_waiting = len(line) if line is not None else waiting_tokens(queue).count()
+            # Expired requests are rejected by the sweeper (rnr/sweeper.py); until
+            # it runs they just don't count towards capacity.
+            active_swaps = SwapRequest.objects.filter(
+                queue=queue, status="PENDING", created_at__gte=timezone.now() - SWAP_REQUEST_TTL
+            ).count()
             limit = max(1, int(0.2 * total_waiting))
 
             if active_swaps >= limit:
@@ -230,16 +456,20 @@ def manage_token_position_api(request):
             if token.swaps_used >= queue.max_swaps_per_user:
                 return Response({"error": "Swap limit reached."}, status=400)
 
+            if range_start < 1:
+                return Response({"error": "Invalid range format."}, status=400)
+
             # Find the best target (closest to front) in the chosen tier
-            receiver = Token.objects.filter(
-                queue=queue, status="WAITING",
-                token_number__gte=range_start, token_number__lte=range_end
-            ).order_by('token_number').first()
+            if line is not None:
+                receiver = Token.objects.get(id=line.at(range_start - 1)) if range_start <= len(line) else None
+            else:
+                receiver = waiting_tokens(queue).order_by('position_key')[range_start - 1:range_end].first()
 
             if not receiver:
                 return Response({"error": f"No active tokens in range {range_start}-{range_end}."}, status=400)
 
-            SwapRequest.objects.create(sender=token, receiver=receiver, queue=queue)
+            swap = SwapRequest.objects.create(sender=token, receiver=receiver, queue=queue)
+            emit("swap_requested", queue.id, [receiver.user_id], swap=swap.id, token=receiver.id)
             return Response({"message": f"Swap request sent to #{receiver.token_number}."})
 
         # SWAP: Direct Target Selection (New)
@@ -253,13 +483,14 @@ def manage_token_position_api(request):
             if receiver.queue != queue:
                 return Response({"error": "Target must be in the same queue."}, status=400)
             
-            if receiver.status != "WAITING":
+            if (receiver.id not in line) if line is not None else receiver.status != "WAITING":
                 return Response({"error": "Target token is no longer waiting."}, status=400)
                 
             if token.swaps_used >= queue.max_swaps_per_user:
                 return Response({"error": "Swap limit reached."}, status=400)
 
-            SwapRequest.objects.create(sender=token, receiver=receiver, queue=queue)
+            swap = SwapRequest.objects.create(sender=token, receiver=receiver, queue=queue)
+            emit("swap_requested", queue.id, [receiver.user_id], swap=swap.id, token=receiver.id)
             return Response({"message": f"Swap request sent to {receiver.user.name}."})
 
 
@@ -277,23 +508,31 @@ def manage_token_position_api(request):
                 return Response({"error": "Target must be behind current position."}, status=400)
 
 
-            last_token = Token.objects.filter(queue=queue, status="WAITING").order_by('-token_number').first()
-            actual_target = min(target_pos, last_token.token_number if last_token else current_pos)
-
-
-            tokens_to_shift = Token.objects.filter(
-                queue=queue, status="WAITING",
-                token_number__gt=current_pos, token_number__lte=actual_target
-            ).select_for_update()
-
-
-            for t in tokens_to_shift:
-                t.token_number -= 1
-                t.save()
-
-
-            token.token_number = actual_target
-            token.save()
+            if line is not None:
+                # Nothing else in this transaction can roll back, so the line moves now
+                actual_target, changes = line.move_back(token.id, target_pos)
+                if actual_target is None:
+                    return Response({"error": "Token cannot be modified."}, status=400)
+                engine.defer_keys(queue.id, changes)
+                emit("token_moved", queue.id, [token.user_id], token=token.id)
+                return Response({"message": f"Moved back to position {actual_target}."})
+
+            # Slot in right after whoever holds `target_pos` now; nobody else moves.
+            lock_queue(queue.id)
+            neighbours = list(waiting_tokens(queue).order_by('position_key')[target_pos - 1:target_pos + 1])
+            if not neighbours:
+                actual_target = waiting_tokens(queue).count()
+                if actual_target == current_pos:
+                    return Response({"message": f"Moved back to position {actual_target}."})
+                token.position_key = next_tail_key(queue)
+            else:
+                actual_target = target_pos
+                after = neighbours[1] if len(neighbours) > 1 else None
+                token.position_key = key_between(queue, neighbours[0], after)
+
+
+            token.save(update_fields=['position_key'])
+            emit("token_moved", queue.id, [token.user_id], token=token.id)
             return Response({"message": f"Moved back to position {actual_target}."})
 
 
@@ -304,10 +543,13 @@ def manage_token_position_api(request):
 
 @api_view(['POST'])
 def reject_swap_api(request, swap_id):
-    swap = get_object_or_404(SwapRequest, id=swap_id)
+    swap = get_object_or_404(SwapRequest.objects.select_related('sender', 'receiver'), id=swap_id)
+    if not may_act_on(request, user_id=swap.receiver.user_id):
+        return Response({"error": "Unauthorized"}, status=403)
     if swap.status == 'PENDING':
         swap.status = 'REJECTED'
         swap.save()
+        emit("swap_rejected", swap.queue_id, [swap.sender.user_id], swap=swap.id)
         return Response({"message": "Swap request rejected."})
     return Response({"error": "Swap request not pending."}, status=400)
 
@@ -317,6 +559,8 @@ def accept_swap_api(request, swap_id):
     with transaction.atomic():
         swap = get_object_or_404(SwapRequest.objects.select_for_update(), id=swap_id, status="PENDING")
         s, r = swap.sender, swap.receiver
+        if not may_act_on(request, user_id=r.user_id):
+            return Response({"error": "Unauthorized"}, status=403)
 
 
         if swap.is_expired():
@@ -325,47 +569,138 @@ def accept_swap_api(request, swap_id):
             return Response({"error": "Swap request expired."}, status=400)
 
 
-        if s.status != "WAITING" or r.status != "WAITING":
+        line = line_for(swap.queue_id)
+        if line is not None:
+            valid = s.id in line and r.id in line
+        else:
+            valid = s.status == "WAITING" and r.status == "WAITING"
+        if not valid:
             swap.status = "REJECTED"
             swap.save()
             return Response({"error": "Swap no longer valid."}, status=400)
 
 
-        # Exchange Numbers
-        s.token_number, r.token_number = r.token_number, s.token_number
+        # Exchange places in line
+        updated = ['swaps_used']
+        if line is None:
+            s.position_key, r.position_key = r.position_key, s.position_key
+            updated.append('position_key')
+            r.save(update_fields=['position_key'])
+        else:
+            # Once the payment has committed; the keys are written behind
+            transaction.on_commit(lambda: get_engine().defer_keys(swap.queue_id, line.swap(s.id, r.id)))
         s.swaps_used += 1
         
         # Credit Transfer: Sender pays 10, Receiver gains 5 (Platform keeps 5 or adjust as needed)
         # For simplicity, let's do Sender -10, Receiver +5 as requested for "plus minus effectively"
-        s.user.reward_points = max(0, s.user.reward_points - 10)
-        r.user.reward_points += 5
+        charge(s.user_id, 10, 'swap_paid')
+        credit({r.user_id: 5}, 'swap_received')
        
-        s.save()
-        s.user.save()
-        r.save()
-        r.user.save()
+        s.save(update_fields=updated)
         swap.status = "ACCEPTED"
         swap.save()
        
         # Cleanup
         SwapRequest.objects.filter(models.Q(sender=s) | models.Q(receiver=s) | models.Q(sender=r) | models.Q(receiver=r), status="PENDING").exclude(id=swap.id).update(status="REJECTED")
+        emit("swap_accepted", swap.queue_id, [s.user_id, r.user_id], swap=swap.id, tokens=[s.id, r.id])
 
 
     return Response({"message": "Swap successful!"})
 
 
+@api_view(['POST'])
+def swap_intent_api(request):
+    """
+    Post a standing swap intent, replacing the token's previous one. Intents
+    are paired in batches by the matcher (rnr/matching.py).
+    Expects: {"token_id": 5, "side": "FORWARD" | "BACKWARD", "points": 20}
+    """
+    token = get_object_or_404(Token.objects.select_related('queue', 'user'), id=request.data.get('token_id'))
+    if not may_act_on(request, user_id=token.user_id):
+        return Response({"error": "Unauthorized"}, status=403)
+    side = request.data.get('side')
+    try:
+        points = int(request.data.get('points'))
+    except (TypeError, ValueError):
+        return Response({"error": "Invalid points."}, status=400)
+
+    if side not in ('FORWARD', 'BACKWARD') or points < 0:
+        return Response({"error": "side must be FORWARD or BACKWARD, points >= 0."}, status=400)
+    if token.status != 'WAITING' or not token.queue.allow_swaps:
+        return Response({"error": "Token cannot be swapped."}, status=400)
+    if side == 'FORWARD':
+        if token.swaps_used >= token.queue.max_swaps_per_user:
+            return Response({"error": "Swap limit reached."}, status=400)
+        if points > token.user.reward_points:
+            return Response({"error": "Not enough reward points."}, status=400)
+
+    with transaction.atomic():
+        SwapIntent.objects.filter(token=token, status='OPEN').update(status='CANCELLED')
+        intent = SwapIntent.objects.create(queue=token.queue, token=token, side=side, points=points)
+    return Response({"intent_id": intent.id, "side": side, "points": points}, status=status.HTTP_201_CREATED)
+
+
+@api_view(['POST'])
+def cancel_swap_intent_api(request, token_id):
+    intents = SwapIntent.objects.filter(token_id=token_id, status='OPEN')
+    p = principal(request)
+    intents = intents.filter(token__user_id=p.id if p.role == 'user' else None)
+    cancelled = intents.update(status='CANCELLED')
+    if not cancelled:
+        return Response({"error": "No open intent."}, status=404)
+    return Response({"message": "Intent cancelled."})
+
+
 # =====================================================
 # INSTITUTION DASHBOARD & LIFECYCLE
 # =====================================================
 
 
-@api_view(['GET'])
-def get_institution_dashboard(request, inst_id):
-    institution = get_object_or_404(Institution, id=inst_id)
-    queues = Queue.objects.filter(institution=institution)
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_MAX_PAGE_SIZE = 200
+
+
+def get_page_size(request):
+    try:
+        limit = int(request.GET.get('limit', DASHBOARD_PAGE_SIZE))
+    except ValueError:
+        limit = DASHBOARD_PAGE_SIZE
+    return max(1, min(limit, DASHBOARD_MAX_PAGE_SIZE))
+
+
+def active_tokens_after(queue_id, cursor=None):
+    tokens = Token.objects.filter(queue_id=queue_id, status__in=ACTIVE_STATUSES)
+    if cursor is not None:
+        tokens = tokens.filter(position_key__gt=cursor)
+    return tokens.order_by('position_key')
+
+
+def token_page(tokens, limit):
+    """Serialize up to `limit` tokens; the cursor is the sort key of the last one sent."""
+    has_more = len(tokens) > limit
+    tokens = tokens[:limit]
+    return {
+        "tokens": TokenSerializer(tokens, many=True).data,
+        "next_cursor": tokens[-1].position_key if has_more else None,
+    }
+
+
+def queue_heads(queues, limit):
+    """One query for every queue's head window (limit + 1 tells us if there is more)."""
+    head_filter = models.Q()
+    for q in queues:
+        head_filter |= models.Q(id__in=active_tokens_after(q.id).values('id')[:limit + 1])
+    return Token.objects.filter(head_filter).select_related('user').order_by('position_key')
+
+
+@serializing()
+def institution_dashboard_rows(queues, queue_snapshots, head_tokens, limit):
+    heads = {q.id: [] for q in queues}
+    for t in head_tokens:
+        heads[t.queue_id].append(t)
+
     data = []
     for q in queues:
-        all_active_tokens = Token.objects.filter(queue=q, status__in=['WAITING', 'CALLING']).order_by('token_number')
         data.append({
             "id": q.id,
             "queue_name": q.name,
@@ -373,72 +708,249 @@ def get_institution_dashboard(request, inst_id):
             "service_time_minutes": q.service_time_minutes,
             "is_paused": q.is_paused,
             "is_closed": q.is_closed,
-            "active_tokens": all_active_tokens.count(),
-            "tokens": TokenSerializer(all_active_tokens, many=True).data
+            "active_tokens": queue_snapshots[q.id]["active"],
+            "current_serving": queue_snapshots[q.id]["serving"],
+            "eta_minutes": queue_snapshots[q.id]["eta_minutes"],
+            **token_page(heads[q.id], limit),
         })
-    return Response(data)
+    return data
 
 
-@api_view(['POST'])
-def call_next_token(request, queue_id):
-    institution_id = request.data.get("institution_id")
+@api_view(['GET'])
+def get_institution_dashboard(request, inst_id):
+    """
+    Queue summaries plus the head of each line (?limit=, default 50).
+    Further tokens are paged per queue via `inst_queue_tokens`.
+    """
+    if not may_act_on(request, institution_id=inst_id):
+        return Response({"error": "Unauthorized"}, status=403)
+    institution = get_object_or_404(Institution, id=inst_id)
+    limit = get_page_size(request)
+    queues = list(Queue.objects.filter(institution=institution).order_by('id'))
+    queue_snapshots = get_snapshots([q.id for q in queues])
+    head_tokens = list(queue_heads(queues, limit)) if queues else []
+    return Response(institution_dashboard_rows(queues, queue_snapshots, head_tokens, limit))
 
 
-    queue = get_object_or_404(Queue, id=queue_id)
-   
-    if queue.institution.id != int(institution_id):
+@api_view(['GET'])
+def get_institution_queue_tokens(request, inst_id, queue_id):
+    """Next page of a queue's active tokens, after ?cursor= from the dashboard."""
+    if not may_act_on(request, institution_id=inst_id):
         return Response({"error": "Unauthorized"}, status=403)
+    queue = get_object_or_404(Queue, id=queue_id, institution_id=inst_id)
+    limit = get_page_size(request)
+    try:
+        cursor = int(request.query_params['cursor']) if 'cursor' in request.query_params else None
+    except ValueError:
+        return Response({"error": "Invalid cursor."}, status=400)
 
+    tokens = list(active_tokens_after(queue.id, cursor).select_related('user')[:limit + 1])
+    return Response({"id": queue.id, **token_page(tokens, limit)})
 
-    next_token = Token.objects.filter(queue=queue, status='WAITING').order_by('token_number').first()
 
 
-    if not next_token:
-        return Response({"message": "Queue empty"}, status=200)
+ANALYTICS_MAX_DAYS = 90
 
 
-    next_token.called_at = timezone.now()
-    next_token.status = 'CALLING'
-    next_token.save()
+@api_view(['GET'])
+def get_institution_analytics(request, inst_id):
+    """
+    Per-queue arrivals, average wait, no-show rate and swaps from the
+    pre-aggregated rollups (rnr/analytics.py). ?granularity=hour|day, ?days=7.
+    """
+    if not may_act_on(request, institution_id=inst_id):
+        return Response({"error": "Unauthorized"}, status=403)
+    granularity = request.query_params.get('granularity', 'hour')
+    if granularity not in ('hour', 'day'):
+        return Response({"error": "granularity must be hour or day."}, status=400)
+    try:
+        days = max(1, min(int(request.query_params.get('days', 7)), ANALYTICS_MAX_DAYS))
+    except ValueError:
+        return Response({"error": "Invalid days."}, status=400)
+
+    since = day_floor(timezone.now()) - timezone.timedelta(days=days - 1)
+    queues = {qid: {"queue_id": qid, "name": name, "buckets": []}
+              for qid, name in Queue.objects.filter(institution_id=inst_id).order_by('id').values_list('id', 'name')}
+    rows = QueueRollup.objects.filter(
+        queue_id__in=list(queues), granularity=granularity, start__gte=since,
+    ).order_by('queue_id', 'start').values('queue_id', 'start', 'arrivals', 'wait_seconds', 'waits', 'calls',
+                                           'no_shows', 'swaps')
+    for row in rows:
+        queues[row["queue_id"]]["buckets"].append(serialize_rollup(row))
+    return Response({"granularity": granularity, "since": since, "queues": list(queues.values())})
+
+
+MAX_CALL_BATCH = 50
+# Token.counter is a CharField(max_length=50)
+COUNTER_NAME = re.compile(r"[A-Za-z0-9 ._-]{1,50}")
+
+
+def claim_next_tokens(queue, count, counters):
+    """
+    Atomically move the next `count` WAITING tokens to CALLING, spreading
+    them round-robin over `counters`. The claim is a single UPDATE over a
+    `FOR UPDATE SKIP LOCKED` subquery, so concurrent callers skip each
+    other's rows and a token can never be called twice.
+    """
+    now = timezone.now()
+    line = line_for(queue.id)
+    if line is not None:
+        return claim_from_line(queue, line, count, counters, now)
+    claim = uuid.uuid4()
+    with transaction.atomic():
+        head = (
+            waiting_tokens(queue).select_for_update(skip_locked=True)
+            .order_by('position_key').values('id')[:count]
+        )
+        Token.objects.filter(id__in=head, status='WAITING').update(status='CALLING', called_at=now, claim=claim)
+        claimed = list(
+            Token.objects.filter(queue=queue, status='CALLING', claim=claim)
+            .select_related('user').order_by('position_key')
+        )
 
+        by_counter = {}
+        for index, token in enumerate(claimed):
+            token.counter = counters[index % len(counters)]
+            by_counter.setdefault(token.counter, []).append(token.id)
+        for counter, token_ids in by_counter.items():
+            Token.objects.filter(id__in=token_ids).update(counter=counter, claim=None)
+        for token in claimed:
+            emit("token_called", queue.id, [token.user_id], token=token.id,
+                 number=token.token_number, counter=token.counter)
+    return claimed
+
+
+def claim_from_line(queue, line, count, counters, now):
+    """`claim_next_tokens` for engine-managed queues: pop the head, write the calls behind."""
+    engine = get_engine()
+    token_ids = line.pop_front(count)
+    tokens = Token.objects.filter(id__in=token_ids).select_related('user').in_bulk()
+    claimed = []
+    for index, token_id in enumerate(token_ids):
+        token = tokens[token_id]
+        token.status, token.called_at, token.counter = 'CALLING', now, counters[index % len(counters)]
+        engine.defer(queue.id, token.id, status=token.status, called_at=now, counter=token.counter)
+        emit("token_called", queue.id, [token.user_id], token=token.id,
+             number=token.token_number, counter=token.counter)
+        claimed.append(token)
+    return claimed
 
-    return Response(TokenSerializer(next_token).data)
 
+@api_view(['POST'])
+def call_next_token(request, queue_id):
+    """
+    Call the next token. With ?count=k&counter=<id>[,<id>...] the next k
+    tokens are claimed in one go and spread across the given counters.
+    """
+    queue = get_object_or_404(Queue, id=queue_id)
+    if not may_act_on(request, institution_id=queue.institution_id):
+        return Response({"error": "Unauthorized"}, status=403)
+
+
+    counters = [c for c in request.query_params.get('counter', '').split(',') if c] or [None]
+    if any(c is not None and not COUNTER_NAME.fullmatch(c) for c in counters):
+        return Response({"error": "Counter names are 1-50 letters, digits, spaces, '.', '_' or '-'."}, status=400)
+    batch = 'count' in request.query_params
+    try:
+        count = int(request.query_params.get('count', 1))
+    except ValueError:
+        return Response({"error": "Invalid count."}, status=400)
+    count = max(1, min(count, MAX_CALL_BATCH))
+
+
+    called = claim_next_tokens(queue, count, counters)
+    if called:
+        record_calls(queue.id, len(called))
+
+
+    if batch:
+        return Response({"tokens": TokenSerializer(called, many=True).data})
+    if not called:
+        return Response({"message": "Queue empty"}, status=200)
+    return Response(TokenSerializer(called[0]).data)
 
 
+def send_to_back(token, statuses=ACTIVE_STATUSES):
+    """
+    Put a called (or snoozing) token at the end of its line. Only a token
+    still in one of `statuses` moves; returns False otherwise.
+    """
+    line = line_for(token.queue_id)
+    with transaction.atomic():
+        if line is not None:
+            key = line.next_key()
+        else:
+            lock_queue(token.queue_id)
+            key = next_tail_key(token.queue_id)
+        if not Token.objects.filter(id=token.id, status__in=statuses).update(
+            position_key=key, status='WAITING', called_at=None
+        ):
+            return False
+        token.position_key, token.status, token.called_at = key, 'WAITING', None
+        if line is not None:
+            def requeue():
+                line.discard(token.id)
+                line.append(token.id, key)
+            transaction.on_commit(requeue)
+    return True
+
+
+def release_slot(token):
+    """Give back the capacity a token held; a no-op once its epoch has rolled over."""
+    Queue.objects.filter(id=token.queue_id, epoch=token.epoch).update(active_count=models.F('active_count') - 1)
+
+
+def get_fresh_token(token_id):
+    token = get_object_or_404(Token.objects.select_related('queue'), id=token_id)
+    engine = get_engine()
+    if engine is not None and engine.manages(token.queue_id):
+        # The row may still be behind the engine's write-behind buffer
+        engine.flush()
+        token.refresh_from_db()
+    return token
+
 
 @api_view(['POST'])
 def confirm_token_api(request, token_id):
-    token = get_object_or_404(Token, id=token_id)
+    token = get_fresh_token(token_id)
+    if not may_act_on(request, user_id=token.user_id, institution_id=token.queue.institution_id):
+        return Response({"error": "Unauthorized"}, status=403)
     if not token.called_at:
         return Response({"error": "Token not called yet"}, status=400)
+    if token.status != 'CALLING':
+        return Response({"error": "Token is no longer active"}, status=400)
 
 
     if token.is_call_expired():
         # Late for appointment -> Auto Snooze
-        last_t = Token.objects.filter(queue=token.queue).order_by('-token_number').first()
-        token.token_number = last_t.token_number + 1
-        token.called_at = None
-        token.save()
-        shift_queue_positions(token.queue)
+        if not send_to_back(token, statuses=['CALLING']):
+            return Response({"error": "Token is no longer active"}, status=400)
+        emit("token_snoozed", token.queue_id, [token.user_id], token=token.id)
         return Response({"error": "Expired. Moved to back."}, status=403)
 
 
     token.status = 'COMPLETED'
-    token.user.reward_points += 10
-    token.save()
-    token.user.save()
+    token.completed_at = timezone.now()
+    with transaction.atomic():
+        # Only the first confirm of a still-active token counts
+        if not Token.objects.filter(id=token.id, status='CALLING').update(
+            status=token.status, completed_at=token.completed_at
+        ):
+            return Response({"error": "Token is no longer active"}, status=400)
+        release_slot(token)
+        credit({token.user_id: 10}, 'check_in')
+    emit("token_completed", token.queue_id, [token.user_id], token=token.id)
     return Response({"message": "Check-in successful!"})
 
 
 @api_view(['POST'])
 def snooze_api(request, token_id):
-    token = get_object_or_404(Token, id=token_id)
-    last_t = Token.objects.filter(queue=token.queue).order_by('-token_number').first()
-    token.token_number = last_t.token_number + 1
-    token.called_at = None
-    token.save()
-    shift_queue_positions(token.queue)
+    token = get_fresh_token(token_id)
+    if not may_act_on(request, user_id=token.user_id, institution_id=token.queue.institution_id):
+        return Response({"error": "Unauthorized"}, status=403)
+    if not send_to_back(token):
+        return Response({"error": "Only waiting or called tokens can be snoozed."}, status=400)
+    emit("token_snoozed", token.queue_id, [token.user_id], token=token.id)
     return Response({"message": "Snoozed to back."})
 
 
@@ -446,14 +958,15 @@ def snooze_api(request, token_id):
 def create_queue_api(request):
     """
     Institution creates a new queue.
-    Expects: {"institution_id": 1, "name": "General Counter", "size": 100}
+    Expects: {"name": "General Counter", "size": 100, "service_time": 5}; the institution comes from the token.
     """
     data = request.data
-    inst_id = data.get('institution_id')
-    institution = get_object_or_404(Institution, id=inst_id)
+    inst_id = acting_institution_id(request)
+    if inst_id is None:
+        return Response({"error": "Only institutions can create queues."}, status=403)
     
     queue = Queue.objects.create(
-        institution=institution,
+        institution_id=inst_id,
         name=data.get('name'),
         size=data.get('size', 100),
         service_time_minutes=data.get('service_time', 5),
@@ -465,36 +978,80 @@ def create_queue_api(request):
         "queue_id": queue.id,
         "name": queue.name
     }, status=status.HTTP_201_CREATED)
-@api_view(['GET'])
-def get_user_dashboard(request, user_id):
-    user = get_object_or_404(UserMe, id=user_id)
-    tokens = Token.objects.filter(user=user, status='WAITING').order_by('joined_at')
-    
+
+
+@api_view(['POST'])
+def rollover_queue_api(request, queue_id):
+    """
+    Start a new epoch (e.g. a new day): numbering restarts at 1 and tokens
+    still in line are closed. See rnr/rollover.py.
+    """
+    queue = get_object_or_404(Queue.objects.only('id', 'institution_id'), id=queue_id)
+    if not may_act_on(request, institution_id=queue.institution_id):
+        return Response({"error": "Unauthorized"}, status=403)
+    epoch, closed = rollover(queue.id)
+    return Response({"epoch": epoch, "closed": closed})
+def user_waiting_tokens(user_id):
+    # Ranks and queue heads come back with the tokens, so the query count
+    # no longer grows with the number of active bookings.
+    return (
+        Token.objects.filter(user_id=user_id, status='WAITING')
+        .select_related('queue__institution')
+        .annotate(position=position_annotation())
+        .order_by('joined_at')
+    )
+
+
+def token_neighbours(tokens):
+    """One batched fetch for the 5 neighbours on each side of every token."""
+    neighbour_filter = models.Q()
+    for t in tokens:
+        around = waiting_tokens(t.queue_id).values('id')
+        neighbour_filter |= models.Q(id__in=around.filter(position_key__lt=t.position_key).order_by('-position_key')[:5])
+        neighbour_filter |= models.Q(id__in=around.filter(position_key__gt=t.position_key).order_by('position_key')[:5])
+    return Token.objects.filter(neighbour_filter).select_related('user').order_by('position_key')
+
+
+def incoming_swaps(tokens):
+    return (
+        SwapRequest.objects.filter(receiver__in=[t.id for t in tokens], status='PENDING')
+        .select_related('sender__user')
+        .annotate(sender_position=position_annotation('sender__'))
+    )
+
+
+@serializing()
+def user_dashboard_rows(user, tokens, queue_snapshots, neighbour_tokens, swaps):
+    neighbours = {}
+    for tk in neighbour_tokens:
+        neighbours.setdefault(tk.queue_id, []).append(tk)
+    incoming = {}
+    for req in swaps:
+        incoming.setdefault(req.receiver_id, []).append(req)
+
     data = []
     for t in tokens:
         queue = t.queue
-        # Get current serving for this queue
-        current_serving_token = Token.objects.filter(queue=queue, status='WAITING').order_by('token_number').first()
-        current_num = current_serving_token.token_number if current_serving_token else 0
-        
-        # Get users ahead and behind for swapping
-        ahead = Token.objects.filter(queue=queue, status='WAITING', token_number__lt=t.token_number).order_by('-token_number')
-        behind = Token.objects.filter(queue=queue, status='WAITING', token_number__gt=t.token_number).order_by('token_number')
+        stats = service_stats(queue)
+        line = neighbours.get(queue.id, [])
+        ahead = [tk for tk in reversed(line) if tk.position_key < t.position_key]
+        behind = [tk for tk in line if tk.position_key > t.position_key]
         
         data.append({
             "token_id": t.id,
             "token_number": t.token_number,
+            "queue_id": queue.id,
             "queue_name": queue.name,
             "institution_name": queue.institution.name,
-            "current_serving": current_num,
-            "current_serving": current_num,
-            "position": max(0, t.token_number - current_num),
+            "current_serving": queue_snapshots[t.queue_id]["serving"],
+            "position": t.position,
+            "eta": estimate(queue, t.position, stats),
             "incoming_swaps": [{
                 "swap_id": req.id,
                 "sender_name": req.sender.user.name,
                 "sender_token": req.sender.token_number,
-                "sender_position": max(0, req.sender.token_number - current_num)
-            } for req in SwapRequest.objects.filter(receiver=t, status='PENDING')],
+                "sender_position": req.sender_position
+            } for req in incoming.get(t.id, [])],
             "status": t.status,
             "swaps_used": t.swaps_used,
             "max_swaps": queue.max_swaps_per_user,
@@ -502,19 +1059,105 @@ def get_user_dashboard(request, user_id):
             "swappable_ahead": [{
                 "id": tk.id, 
                 "token": tk.token_number, 
-                "position": t.token_number - tk.token_number,
+                "position": distance,
                 "user_name": tk.user.name,
-                "waitTime": f"{(t.token_number - tk.token_number) * queue.service_time_minutes} mins"
-            } for tk in ahead[:5]],
+                "waitTime": f"{round(estimate(queue, distance, stats)['minutes'])} mins"
+            } for distance, tk in enumerate(ahead, start=1)],
             "swappable_behind": [{
                 "id": tk.id, 
                 "token": tk.token_number, 
-                "position": tk.token_number - t.token_number,
+                "position": distance,
                 "user_name": tk.user.name,
-                "waitTime": f"{(tk.token_number - t.token_number) * queue.service_time_minutes} mins"
-            } for tk in behind[:5]]
+                "waitTime": f"{round(estimate(queue, distance, stats)['minutes'])} mins"
+            } for distance, tk in enumerate(behind, start=1)]
         })
-    return Response(data)
+    return data
+
+
+@api_view(['GET'])
+def get_user_dashboard(request, user_id):
+    if not may_act_on(request, user_id=user_id):
+        return Response({"error": "Unauthorized"}, status=403)
+    user = get_object_or_404(UserMe, id=user_id)
+    tokens = list(user_waiting_tokens(user.id))
+    if not tokens:
+        return Response([])
+    queue_snapshots = get_snapshots([t.queue_id for t in tokens])
+    return Response(user_dashboard_rows(
+        user, tokens, queue_snapshots, list(token_neighbours(tokens)), list(incoming_swaps(tokens)),
+    ))
 
 
 
+MAX_BALANCE_IDS = 500
+
+
+@api_view(['GET'])
+def get_reward_balances(request):
+    """Reward balances for many users in one query: ?ids=1,2,3 -> {"1": 40, ...}."""
+    try:
+        user_ids = {int(uid) for uid in request.query_params.get('ids', '').split(',') if uid}
+    except ValueError:
+        return Response({"error": "ids must be a comma-separated list of integers."}, status=400)
+    if len(user_ids) > MAX_BALANCE_IDS:
+        return Response({"error": f"At most {MAX_BALANCE_IDS} ids per request."}, status=400)
+    return Response({str(uid): points for uid, points in balances(user_ids).items()})
+
+
+@api_view(['GET'])
+def get_user_history(request, user_id):
+    """Past tokens, newest first, including archived ones (rnr/archive.py). Page with ?before=<last id>."""
+    if not may_act_on(request, user_id=user_id):
+        return Response({"error": "Unauthorized"}, status=403)
+    try:
+        before = int(request.query_params['before']) if 'before' in request.query_params else None
+    except ValueError:
+        return Response({"error": "Invalid cursor."}, status=400)
+    limit = get_page_size(request)
+    rows = token_history(user_id, before, limit)
+    return Response({"results": rows, "next": rows[-1]["id"] if len(rows) == limit else None})
+
+
+
+# =====================================================
+# LIVE UPDATES (Server-Sent Events, serve via ASGI)
+# =====================================================
+
+
+SSE_HEARTBEAT_SECONDS = 15
+
+
+async def sse_stream(channels):
+    events = get_broker().listen(channels, idle_timeout=SSE_HEARTBEAT_SECONDS)
+    try:
+        yield "retry: 5000\n\n"
+        async for message in events:
+            # Comment lines keep proxies from closing an idle connection
+            yield f"data: {message}\n\n" if message is not None else ": keep-alive\n\n"
+    finally:
+        await events.aclose()
+
+
+def sse_response(channels):
+    response = StreamingHttpResponse(sse_stream(channels), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def queue_events_stream(request, queue_id):
+    """Deltas for one queue: admin dashboards and queue status screens."""
+    return sse_response([queue_channel(queue_id)])
+
+
+async def user_events_stream(request, user_id):
+    """
+    Deltas touching one user's tokens and swap requests. EventSource can't
+    send headers, so the caller's access token may come as ?token=.
+    """
+    p = authenticate(request, token=request.GET.get('token'))
+    if p is None:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+    if not may_act_on(request, user_id=user_id, p=p):
+        return JsonResponse({"error": "Unauthorized"}, status=403)
+    return sse_response([user_channel(user_id)])
@@ -1,4 +1,4 @@
-from rnr.models import Institution, Queue
+from rnr.models import UserMe, Institution, Queue, Token, POSITION_GAP
 
 def seed_queues():
     institutions = Institution.objects.all()
@@ -16,5 +16,35 @@ def seed_queues():
             print(f"Created 'General Service' queue for {inst.name}")
     print(f"Seeding complete. Created {created_count} queues.")
 
+
+def seed_bulk(institutions=10, queues_per_institution=2, tokens_per_queue=200, prefix="seed"):
+    """
+    Synthetic dataset for benchmarks, built with bulk_create: every queue gets
+    `tokens_per_queue` WAITING tokens held by the same pool of users.
+    Returns (institution ids, queue ids, user ids).
+    """
+    insts = Institution.objects.bulk_create(
+        Institution(name=f"{prefix.title()} Clinic {n}", email=f"{prefix}{n}@inst.local", phone="0",
+                    password="!", address=f"{n} Main Road, Pune",
+                    latitude=18.5 + n * 0.01, longitude=73.8 + n * 0.01)
+        for n in range(institutions)
+    )
+    queues = Queue.objects.bulk_create(
+        Queue(institution=inst, name=f"Counter {q}", size=tokens_per_queue * 10,
+              last_token_number=tokens_per_queue, active_count=tokens_per_queue)
+        for inst in insts for q in range(queues_per_institution)
+    )
+    users = UserMe.objects.bulk_create(
+        UserMe(name=f"{prefix.title()} User {n}", email=f"{prefix}{n}@user.local", password="!", reward_points=100)
+        for n in range(tokens_per_queue)
+    )
+    Token.objects.bulk_create(
+        (Token(user=user, queue=queue, token_number=n, position_key=n * POSITION_GAP)
+         for queue in queues for n, user in enumerate(users, start=1)),
+        batch_size=1000,
+    )
+    return [i.id for i in insts], [q.id for q in queues], [u.id for u in users]
+
+
 if __name__ == "__main__":
     seed_queues()
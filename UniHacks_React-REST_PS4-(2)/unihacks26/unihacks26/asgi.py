@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'unihacks26.settings')
 
 application = get_asgi_application()
+
+# Engine mode and BACKGROUND_JOBS (rnr/jobs.py)
+from rnr import jobs  # noqa: E402
+
+jobs.start()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,8 +44,13 @@ INSTALLED_APPS = [
 ]
 
 REST_FRAMEWORK = {
+    # Role and id come from the token's claims; no per-request user lookup
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'rnr.auth.ClaimsAuthentication',
+    ),
+    # Views that don't need a caller (signup, search, discovery) opt out with AllowAny
+    'DEFAULT_PERMISSION_CLASSES': (
+        'rest_framework.permissions.IsAuthenticated',
     ),
 }
 
@@ -56,7 +62,62 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
+# Live queue updates (rnr/events.py). Use 'redis' when running several workers.
+QUEUE_EVENTS = {
+    'BACKEND': os.environ.get('QUEUE_EVENTS_BACKEND', 'memory'),
+    'REDIS_URL': os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+}
+
+# In-memory queue engine (rnr/engine.py) for high-traffic queues: '*' or "1,7".
+# Single worker process only; lines are reloaded from the database on startup.
+ENGINE_QUEUES = os.environ.get('QUEUE_ENGINE_QUEUES', '')
+QUEUE_ENGINE = {
+    'QUEUES': ENGINE_QUEUES if ENGINE_QUEUES in ('', '*') else [int(q) for q in ENGINE_QUEUES.split(',')],
+    'FLUSH_INTERVAL': float(os.environ.get('QUEUE_ENGINE_FLUSH_INTERVAL', '0.05')),
+}
+
+# Run the expiry sweeper, the nightly rollover and swap matching inside the server
+# process (rnr/jobs.py) instead of as management commands. Engine mode requires it.
+BACKGROUND_JOBS = os.environ.get('BACKGROUND_JOBS', '1' if QUEUE_ENGINE['QUEUES'] else '') == '1'
+
+# Route the read-heavy endpoints to their async versions (rnr/async_views.py).
+# For ASGI servers (uvicorn unihacks26.asgi:application); leave off under WSGI.
+ASYNC_READ_VIEWS = os.environ.get('ASYNC_READ_VIEWS', '') == '1'
+
+# Queue snapshots (rnr/snapshots.py) and search results. The in-process cache
+# is only invalidated by writes in the same process; use 'redis' with several workers.
+if os.environ.get('CACHE_BACKEND', 'memory') == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': QUEUE_EVENTS['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Queue history (rnr/history.py): events are inserted BATCH_SIZE at a time, or
+# once the oldest buffered one has waited MAX_DELAY seconds.
+QUEUE_HISTORY = {
+    'BATCH_SIZE': int(os.environ.get('QUEUE_HISTORY_BATCH_SIZE', '200')),
+    'MAX_DELAY': float(os.environ.get('QUEUE_HISTORY_MAX_DELAY', '2.0')),
+    # Raw events older than this are deleted by `rollup_events --prune`; the hourly stats stay
+    'RETENTION_DAYS': int(os.environ.get('QUEUE_HISTORY_RETENTION_DAYS', '30')),
+}
+
+# Per-view request metrics (rnr/metrics.py), exposed at /api/metrics/
+METRICS = {
+    'SLOW_QUERY_MS': float(os.environ.get('SLOW_QUERY_MS', '200')),
+    # Who may scrape /api/metrics/ (the proxy's address, when behind one)
+    'ALLOWED_NETWORKS': [n for n in os.environ.get('METRICS_ALLOWED_NETWORKS', '127.0.0.0/8,::1/128').split(',') if n],
+}
+
 MIDDLEWARE = [
+    'rnr.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -89,12 +150,84 @@ WSGI_APPLICATION = 'unihacks26.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# Pick a profile with DB_PROFILE:
+#   sqlite      - default, zero setup (development): IMMEDIATE transactions
+#   sqlite-wal  - single-node deployments: the same, plus a WAL journal
+#   postgres    - production: row-level locking, persistent or pooled connections
+# Benchmarks comparing them: `python manage.py bench_db`, results in README.md.
+
+DB_PROFILE = os.environ.get('DB_PROFILE', 'sqlite')
+
+if DB_PROFILE == 'postgres':
+    DB_POOL = os.environ.get('DB_POOL', '') == '1'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'unihacks26'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # A pool owns its connections; persistent connections are the
+            # alternative when running without one (e.g. behind PgBouncer).
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN', 2)),
+                    'max_size': int(os.environ.get('DB_POOL_MAX', 20)),
+                    'timeout': 10,
+                },
+            } if DB_POOL else {},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            # File-backed test DB so the concurrency tests get real SQLite locking
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+            'OPTIONS': {
+                # Taking the write lock at BEGIN and waiting for it avoids
+                # "database is locked" when two read-then-write transactions
+                # (select_for_update is a no-op on SQLite) collide.
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': int(os.environ.get('SQLITE_TIMEOUT', 20)),
+            },
+        }
     }
+    if DB_PROFILE == 'sqlite-wal':
+        # Readers no longer block the writer
+        DATABASES['default']['OPTIONS']['init_command'] = 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;'
+
+
+# Password hashing (rnr/hashers.py). PROFILE picks the preferred hasher; hashes
+# made under another profile or cost still verify and are re-encoded at login.
+# Hashing runs on a pool of WORKERS threads; beyond MAX_PENDING queued hashes,
+# logins get a 503 instead of piling onto the CPU.
+PASSWORD_HASHING = {
+    'PROFILE': os.environ.get('PASSWORD_PROFILE', 'pbkdf2'),
+    'ITERATIONS': int(os.environ.get('PASSWORD_ITERATIONS', '600000')),
+    'ARGON2_TIME_COST': int(os.environ.get('PASSWORD_ARGON2_TIME_COST', '2')),
+    'ARGON2_MEMORY_COST': int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', '19456')),
+    'WORKERS': int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2)),
+    'MAX_PENDING': int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '64')),
+}
+PASSWORD_PROFILES = {
+    'pbkdf2': 'rnr.hashers.TunedPBKDF2PasswordHasher',
+    'argon2': 'rnr.hashers.TunedArgon2PasswordHasher',  # needs argon2-cffi
+    'django': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [PASSWORD_PROFILES[PASSWORD_HASHING['PROFILE']]] + [
+    hasher for hasher in PASSWORD_PROFILES.values() if hasher != PASSWORD_PROFILES[PASSWORD_HASHING['PROFILE']]
+]
+
+# Failed logins per email before further attempts are refused for WINDOW seconds
+LOGIN_LIMIT = {
+    'ATTEMPTS': int(os.environ.get('LOGIN_LIMIT_ATTEMPTS', '5')),
+    'WINDOW': int(os.environ.get('LOGIN_LIMIT_WINDOW', '300')),
 }
 
 
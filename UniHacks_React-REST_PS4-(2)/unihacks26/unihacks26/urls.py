@@ -17,7 +17,14 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from rnr import views
+from django.conf import settings
+from rnr import async_views, views
+from rnr.metrics import metrics_view
+from rest_framework_simplejwt.views import TokenRefreshView
+
+
+# Read-heavy endpoints run as async views under ASGI when ASYNC_READ_VIEWS is on
+read_views = async_views if settings.ASYNC_READ_VIEWS else views
 
 
 urlpatterns = [
@@ -29,6 +36,7 @@ urlpatterns = [
     # =====================================================
     path('api/user/signup/', views.user_signup_api, name='user_signup'),
     path('api/user/login/', views.user_login_api, name='user_login'),
+    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
    
     path('api/institution/signup/', views.institution_signup_api, name='inst_signup'),
     path('api/institution/login/', views.institution_login_api, name='inst_login'),
@@ -37,9 +45,13 @@ urlpatterns = [
     # =====================================================
     # 🔍 DISCOVERY & DASHBOARD
     # =====================================================
-    path('api/institutions/', views.search_institutions, name='search_institutions'),
-    path('api/user/dashboard/<int:user_id>/', views.get_user_dashboard, name='user_dashboard'),
-    path('api/institution/dashboard/<int:inst_id>/', views.get_institution_dashboard, name='inst_dashboard'),
+    path('api/institutions/', read_views.search_institutions, name='search_institutions'),
+    path('api/user/dashboard/<int:user_id>/', read_views.get_user_dashboard, name='user_dashboard'),
+    path('api/users/balances/', views.get_reward_balances, name='reward_balances'),
+    path('api/user/<int:user_id>/history/', views.get_user_history, name='user_history'),
+    path('api/institution/dashboard/<int:inst_id>/', read_views.get_institution_dashboard, name='inst_dashboard'),
+    path('api/institution/dashboard/<int:inst_id>/queue/<int:queue_id>/tokens/', views.get_institution_queue_tokens, name='inst_queue_tokens'),
+    path('api/institution/<int:inst_id>/analytics/', views.get_institution_analytics, name='inst_analytics'),
 
 
     # =====================================================
@@ -47,6 +59,7 @@ urlpatterns = [
     # =====================================================
     # NEW: Create a queue
     path('api/queue/create/', views.create_queue_api, name='create_queue'),
+    path('api/queue/rollover/<int:queue_id>/', views.rollover_queue_api, name='rollover_queue'),
     # Join a queue
     path('api/book-token/', views.book_token_api, name='book_token'),
    
@@ -70,7 +83,23 @@ urlpatterns = [
     # Reject a pending swap request
     path('api/swap/reject/<int:swap_id>/', views.reject_swap_api, name='reject_swap'),
 
-    path('api/discovery/', views.discovery_map_api, name='discovery_map'),
+    # Standing swap intents, paired in batches by `manage.py match_swaps`
+    path('api/swap/intent/', views.swap_intent_api, name='swap_intent'),
+    path('api/swap/intent/<int:token_id>/cancel/', views.cancel_swap_intent_api, name='cancel_swap_intent'),
+
+    path('api/discovery/', read_views.discovery_map_api, name='discovery_map'),
+
+
+    # =====================================================
+    # 📡 LIVE UPDATES (SSE)
+    # =====================================================
+    path('api/events/queue/<int:queue_id>/', views.queue_events_stream, name='queue_events'),
+    path('api/events/user/<int:user_id>/', views.user_events_stream, name='user_events'),
+
+    # =====================================================
+    # 📈 METRICS (Prometheus)
+    # =====================================================
+    path('api/metrics/', metrics_view, name='metrics'),
 
 ]
 
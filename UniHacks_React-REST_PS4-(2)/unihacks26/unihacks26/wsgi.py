@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'unihacks26.settings')
 
 application = get_wsgi_application()
+
+# Engine mode and BACKGROUND_JOBS (rnr/jobs.py)
+from rnr import jobs  # noqa: E402
+
+jobs.start()
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { motion } from 'framer-motion';
-import { getInstitutionDashboard, callNextToken, confirmToken, snoozeToken, createQueue } from '../services/api';
+import { getInstitutionDashboard, callNextToken, confirmToken, snoozeToken, createQueue, subscribeToEvents } from '../services/api';
 import { Play, SkipForward, Pause, Power, Users, Clock, TrendingUp, AlertCircle, Loader2, CheckCircle, Plus, X } from 'lucide-react';
 
 const AdminDashboard = () => {
@@ -32,7 +32,7 @@ const AdminDashboard = () => {
 
     useEffect(() => {
         loadDashboard();
-        const interval = setInterval(loadDashboard, 10000); // Poll every 10s
+        const interval = setInterval(loadDashboard, 60000); // Safety-net poll; live updates below
         return () => clearInterval(interval);
     }, [institutionId]);
 
@@ -67,8 +67,17 @@ const AdminDashboard = () => {
 
     // Use selected queue
     const activeQueue = queues.length > 0 ? queues[activeQueueIndex] : null;
+
+    // Refetch when the selected queue changes
+    const activeQueueId = activeQueue?.id;
+    useEffect(() => {
+        if (!activeQueueId) return;
+        return subscribeToEvents('queue', activeQueueId, () => loadDashboard());
+    }, [activeQueueId]);
+
     const currentToken = activeQueue?.tokens?.find(t => t.status === 'CALLING');
-    const waitingTokens = activeQueue?.tokens?.filter(t => t.status === 'WAITING').sort((a, b) => a.token_number - b.token_number) || [];
+    // Tokens arrive in line order; token numbers no longer follow it after swaps/snoozes.
+    const waitingTokens = activeQueue?.tokens?.filter(t => t.status === 'WAITING') || [];
 
     const stats = [
         { label: "Active Tokens", value: activeQueue?.active_tokens || 0, icon: Users, color: "text-blue-600 dark:text-blue-400", bg: "bg-blue-500/10" },
@@ -9,6 +9,8 @@ const DiscoveryPage = () => {
     const [selectedPlace, setSelectedPlace] = useState(null);
     const [places, setPlaces] = useState([]);
     const [loading, setLoading] = useState(true);
+    const [nextPage, setNextPage] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
     const [error, setError] = useState('');
     const [booking, setBooking] = useState(false);
     const [selectedQueueId, setSelectedQueueId] = useState(null);
@@ -17,12 +19,14 @@ const DiscoveryPage = () => {
     const authData = JSON.parse(localStorage.getItem('auth_data') || '{}');
     const userId = authData.user_id;
 
-    const loadInstitutions = async (query = '') => {
-        setLoading(true);
+    // Later pages are appended by "Load more"
+    const loadInstitutions = async (query = '', page = 1) => {
+        const setBusy = page === 1 ? setLoading : setLoadingMore;
+        setBusy(true);
         try {
-            const data = await fetchInstitutions(query);
+            const data = await fetchInstitutions(query, page);
             // Map backend data to frontend format
-            const mapped = data.map(inst => {
+            const mapped = data.results.map(inst => {
                 const activeQueues = inst.queues?.filter(q => !q.is_closed) || [];
                 const firstQueue = activeQueues[0] || inst.queues?.[0] || null;
                 const isOffline = activeQueues.length === 0;
@@ -41,12 +45,13 @@ const DiscoveryPage = () => {
                     isOffline
                 };
             });
-            setPlaces(mapped);
+            setPlaces(prev => (page === 1 ? mapped : [...prev, ...mapped]));
+            setNextPage(data.next);
         } catch (err) {
             setError('Failed to load places');
             console.error(err);
         } finally {
-            setLoading(false);
+            setBusy(false);
         }
     };
 
@@ -138,6 +143,15 @@ const DiscoveryPage = () => {
                             <p className="text-theme-text-muted font-black text-xl">No places found matching your search.</p>
                         </div>
                     )}
+                    {!loading && nextPage && (
+                        <button
+                            onClick={() => loadInstitutions(searchQuery, nextPage)}
+                            disabled={loadingMore}
+                            className="w-full py-4 rounded-[1.5rem] border-2 border-theme-border bg-theme-bg text-theme-text-muted font-black hover:border-primary/30 hover:text-primary transition-all flex items-center justify-center gap-2"
+                        >
+                            {loadingMore ? <Loader2 className="animate-spin" size={20} /> : "Load more"}
+                        </button>
+                    )}
                 </div>
             </div>
 
@@ -3,7 +3,7 @@ import { motion, AnimatePresence } from 'framer-motion';
 import { Clock, Users, ArrowRightLeft, AlertCircle, CheckCircle2, XCircle, Zap, Loader2, MapPin } from 'lucide-react';
 import TokenSwapModal from '../components/TokenSwapModal';
 import { useNavigate } from 'react-router-dom';
-import { getUserDashboard, manageTokenPosition, snoozeToken } from '../services/api';
+import { getUserDashboard, manageTokenPosition, snoozeToken, subscribeToEvents } from '../services/api';
 
 const QueueStatusPage = () => {
     const navigate = useNavigate();
@@ -36,10 +36,24 @@ const QueueStatusPage = () => {
 
     useEffect(() => {
         loadData();
-        const interval = setInterval(loadData, 15000);
-        return () => clearInterval(interval);
+        if (!userId) return;
+        // Refetch only when something changes; the slow poll is a safety net.
+        const unsubscribe = subscribeToEvents('user', userId, () => loadData());
+        const interval = setInterval(loadData, 60000);
+        return () => {
+            unsubscribe();
+            clearInterval(interval);
+        };
     }, [userId]);
 
+    // Calls, cancels and snoozes by others only reach the queue channel, yet move our position and "now serving".
+    const queueIds = [...new Set(tokens.map(t => t.queue_id))].join(',');
+    useEffect(() => {
+        if (!queueIds) return;
+        const unsubscribes = queueIds.split(',').map(id => subscribeToEvents('queue', id, () => loadData()));
+        return () => unsubscribes.forEach(unsubscribe => unsubscribe());
+    }, [queueIds]);
+
     const activeToken = tokens.length > 0 ? tokens[0] : null;
 
     const handleAction = async (action, data = {}) => {
@@ -88,7 +102,7 @@ const QueueStatusPage = () => {
         );
     }
 
-    const serving = activeToken.token_number - activeToken.position;
+    const serving = activeToken.current_serving;
     const canSwap = activeToken.swaps_used < activeToken.max_swaps;
 
     return (
@@ -142,7 +156,10 @@ const QueueStatusPage = () => {
                         <p className="text-xs font-black text-theme-text-muted uppercase tracking-widest mb-3 flex items-center gap-2">
                             <Clock size={16} /> Wait Time
                         </p>
-                        <p className="text-5xl font-black text-primary">{activeToken.position * 5}m</p>
+                        <p className="text-5xl font-black text-primary">{Math.round(activeToken.eta?.minutes ?? activeToken.position * 5)}m</p>
+                        {activeToken.eta && (
+                            <p className="text-xs font-bold text-theme-text-muted mt-2">{Math.round(activeToken.eta.low)}–{Math.round(activeToken.eta.high)}m likely</p>
+                        )}
                     </div>
                 </div>
 
@@ -17,7 +17,7 @@ import {
     XCircle
 } from 'lucide-react';
 import { Link, useNavigate } from 'react-router-dom';
-import { getUserDashboard, manageTokenPosition, acceptSwap, rejectSwap } from '../services/api';
+import { getUserDashboard, manageTokenPosition, acceptSwap, rejectSwap, subscribeToEvents } from '../services/api';
 
 const UserDashboard = () => {
     const [tokens, setTokens] = useState([]);
@@ -49,10 +49,24 @@ const UserDashboard = () => {
 
     useEffect(() => {
         loadDashboard();
-        const interval = setInterval(loadDashboard, 15000); // Poll every 15s
-        return () => clearInterval(interval);
+        if (!userId) return;
+        // Refetch only when something changes; the slow poll is a safety net.
+        const unsubscribe = subscribeToEvents('user', userId, () => loadDashboard());
+        const interval = setInterval(loadDashboard, 60000);
+        return () => {
+            unsubscribe();
+            clearInterval(interval);
+        };
     }, [userId]);
 
+    // Calls, cancels and snoozes by others only reach the queue channel, yet move our position and "now serving".
+    const queueIds = [...new Set(tokens.map(t => t.queue_id))].join(',');
+    useEffect(() => {
+        if (!queueIds) return;
+        const unsubscribes = queueIds.split(',').map(id => subscribeToEvents('queue', id, () => loadDashboard()));
+        return () => unsubscribes.forEach(unsubscribe => unsubscribe());
+    }, [queueIds]);
+
     const handleAction = async (tokenId, action, data = {}) => {
         try {
             await manageTokenPosition(tokenId, action, data);
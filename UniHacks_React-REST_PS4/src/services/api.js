@@ -1,5 +1,52 @@
 const API_BASE_URL = 'http://localhost:8000/api';
 
+// Login responses carry a JWT (`access`); the API reads the caller's id and role from it.
+const authHeaders = (headers = {}) => {
+    const { access } = JSON.parse(localStorage.getItem('auth_data') || '{}');
+    return access ? { ...headers, Authorization: `Bearer ${access}` } : headers;
+};
+
+// Concurrent 401s share one refresh
+let refreshing = null;
+
+const refreshAccess = () => {
+    refreshing = refreshing || (async () => {
+        const { refresh } = JSON.parse(localStorage.getItem('auth_data') || '{}');
+        if (!refresh) return false;
+        try {
+            const response = await fetch(`${API_BASE_URL}/token/refresh/`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ refresh }),
+            });
+            if (!response.ok) return false;
+            const tokens = await response.json();
+            const authData = JSON.parse(localStorage.getItem('auth_data') || '{}');
+            localStorage.setItem('auth_data', JSON.stringify({ ...authData, ...tokens }));
+            return true;
+        } catch {
+            return false;
+        }
+    })().finally(() => { refreshing = null; });
+    return refreshing;
+};
+
+// fetch() with the stored access token. An expired token is refreshed once and the
+// request retried; if that fails too, the session is over and we go back to login.
+const authFetch = async (url, options = {}) => {
+    const send = () => fetch(url, { ...options, headers: authHeaders(options.headers) });
+    let response = await send();
+    if (response.status === 401 && await refreshAccess()) {
+        response = await send();
+    }
+    if (response.status === 401) {
+        localStorage.removeItem('auth_data');
+        localStorage.removeItem('role');
+        window.location.assign('/login');
+    }
+    return response;
+};
+
 // --- Auth Services ---
 export const loginUser = async (email, password) => {
     const response = await fetch(`${API_BASE_URL}/user/login/`, {
@@ -46,20 +93,33 @@ export const registerInstitution = async (userData) => {
 };
 
 // --- Discovery & User Dashboard Services ---
-export const fetchInstitutions = async (query = '') => {
-    const response = await fetch(`${API_BASE_URL}/institutions/?search=${query}`);
+// One page of matches: { results, count, next } where `next` is the following page number, or null.
+export const fetchInstitutions = async (query = '', page = 1) => {
+    const response = await fetch(`${API_BASE_URL}/institutions/?search=${encodeURIComponent(query)}&page=${page}`);
     if (!response.ok) throw new Error('Failed to fetch institutions');
-    return response.json();
+    const data = await response.json();
+    return {
+        results: data.results,
+        count: data.count,
+        next: data.page * data.page_size < data.count ? data.page + 1 : null,
+    };
 };
 
 export const getUserDashboard = async (userId) => {
-    const response = await fetch(`${API_BASE_URL}/user/dashboard/${userId}/`);
+    const response = await authFetch(`${API_BASE_URL}/user/dashboard/${userId}/`);
     if (!response.ok) throw new Error('Failed to fetch user dashboard');
     return response.json();
 };
 
+export const getUserHistory = async (userId, before = null) => {
+    const query = before ? `?before=${before}` : '';
+    const response = await authFetch(`${API_BASE_URL}/user/${userId}/history/${query}`);
+    if (!response.ok) throw new Error('Failed to fetch history');
+    return response.json();
+};
+
 export const bookToken = async (userId, queueId) => {
-    const response = await fetch(`${API_BASE_URL}/book-token/`, {
+    const response = await authFetch(`${API_BASE_URL}/book-token/`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ user_id: userId, queue_id: queueId }),
@@ -70,7 +130,7 @@ export const bookToken = async (userId, queueId) => {
 };
 
 export const manageTokenPosition = async (tokenId, action, additionalData = {}) => {
-    const response = await fetch(`${API_BASE_URL}/token/manage/`, {
+    const response = await authFetch(`${API_BASE_URL}/token/manage/`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ token_id: tokenId, action, ...additionalData }),
@@ -81,7 +141,7 @@ export const manageTokenPosition = async (tokenId, action, additionalData = {})
 };
 
 export const acceptSwap = async (swapId) => {
-    const response = await fetch(`${API_BASE_URL}/swap/accept/${swapId}/`, {
+    const response = await authFetch(`${API_BASE_URL}/swap/accept/${swapId}/`, {
         method: 'POST',
     });
     const data = await response.json();
@@ -90,7 +150,7 @@ export const acceptSwap = async (swapId) => {
 };
 
 export const rejectSwap = async (swapId) => {
-    const response = await fetch(`${API_BASE_URL}/swap/reject/${swapId}/`, {
+    const response = await authFetch(`${API_BASE_URL}/swap/reject/${swapId}/`, {
         method: 'POST',
     });
     const data = await response.json();
@@ -98,15 +158,60 @@ export const rejectSwap = async (swapId) => {
     return data;
 };
 
+// --- Live Updates (Server-Sent Events) ---
+// Calls onEvent with each delta, e.g. { type: 'token_called', queue: 3, token: 41 }.
+// Returns an unsubscribe function.
+// EventSource cannot send headers, so the user channel takes the JWT as ?token=;
+// a stream rejected with an expired token reconnects once the token is refreshed.
+export const subscribeToEvents = (channel, id, onEvent) => {
+    let source = null;
+    let closed = false;
+    const open = () => {
+        const { access } = JSON.parse(localStorage.getItem('auth_data') || '{}');
+        const query = channel === 'user' && access ? `?token=${encodeURIComponent(access)}` : '';
+        source = new EventSource(`${API_BASE_URL}/events/${channel}/${id}/${query}`);
+        source.onmessage = (e) => onEvent(JSON.parse(e.data));
+        source.onerror = async () => {
+            if (channel === 'user' && source.readyState === EventSource.CLOSED && await refreshAccess() && !closed) {
+                open();
+            }
+        };
+    };
+    open();
+    return () => {
+        closed = true;
+        source.close();
+    };
+};
+
 // --- Institution Dashboard Services ---
 export const getInstitutionDashboard = async (instId) => {
-    const response = await fetch(`${API_BASE_URL}/institution/dashboard/${instId}/`);
+    const response = await authFetch(`${API_BASE_URL}/institution/dashboard/${instId}/`);
     if (!response.ok) throw new Error('Failed to fetch institution dashboard');
     return response.json();
 };
 
+export const getInstitutionAnalytics = async (instId, granularity = 'hour', days = 7) => {
+    const response = await authFetch(`${API_BASE_URL}/institution/${instId}/analytics/?granularity=${granularity}&days=${days}`);
+    if (!response.ok) throw new Error('Failed to fetch analytics');
+    return response.json();
+};
+
+export const rolloverQueue = async (queueId, instId) => {
+    const response = await authFetch(`${API_BASE_URL}/queue/rollover/${queueId}/`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ institution_id: instId }),
+    });
+    if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.error || 'Failed to roll over queue');
+    }
+    return response.json();
+};
+
 export const callNextToken = async (queueId, instId) => {
-    const response = await fetch(`${API_BASE_URL}/queue/call-next/${queueId}/`, {
+    const response = await authFetch(`${API_BASE_URL}/queue/call-next/${queueId}/`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ institution_id: instId }),
@@ -119,7 +224,7 @@ export const callNextToken = async (queueId, instId) => {
 };
 
 export const confirmToken = async (tokenId) => {
-    const response = await fetch(`${API_BASE_URL}/token/confirm/${tokenId}/`, {
+    const response = await authFetch(`${API_BASE_URL}/token/confirm/${tokenId}/`, {
         method: 'POST',
     });
     if (!response.ok) {
@@ -130,7 +235,7 @@ export const confirmToken = async (tokenId) => {
 };
 
 export const snoozeToken = async (tokenId) => {
-    const response = await fetch(`${API_BASE_URL}/token/snooze/${tokenId}/`, {
+    const response = await authFetch(`${API_BASE_URL}/token/snooze/${tokenId}/`, {
         method: 'POST',
     });
     if (!response.ok) {
@@ -141,7 +246,7 @@ export const snoozeToken = async (tokenId) => {
 };
 
 export const createQueue = async (instId, queueData) => {
-    const response = await fetch(`${API_BASE_URL}/queue/create/`, {
+    const response = await authFetch(`${API_BASE_URL}/queue/create/`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ institution_id: instId, ...queueData }),